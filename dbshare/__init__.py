@@ -34,11 +34,15 @@ class Constants:
     # System database name
     SYSTEM  = '_system'
 
+    # Result cache database name
+    RESULT_CACHE = '_result_cache'
+
     # Meta table names in each database
     TABLES  = '_tables'
     INDEXES = '_indexes'
     VIEWS   = '_views'
     CHARTS  = '_charts'
+    COUNTS  = '_counts'
 
     # Database constants
     TABLE   = 'table'
@@ -49,6 +53,18 @@ class Constants:
     BLOB    = 'BLOB'
     COLUMN_TYPES = (INTEGER, REAL, TEXT, BLOB)
 
+    # Column statistics computation modes
+    EXACT       = 'exact'
+    APPROXIMATE = 'approximate'
+    SAMPLE      = 'sample'
+    STATISTICS_MODES = (EXACT, APPROXIMATE, SAMPLE)
+
+    # Actions when an inserted row conflicts with an existing one
+    REPLACE = 'replace'
+    IGNORE  = 'ignore'
+    UPDATE  = 'update'
+    ON_CONFLICT_ACTIONS = (REPLACE, IGNORE, UPDATE)
+
     # User roles
     ADMIN = 'admin'
     USER  = 'user'
@@ -64,6 +80,8 @@ class Constants:
     HTML_MIMETYPE    = 'text/html'
     CSV_MIMETYPE     = 'text/csv'
     JSON_MIMETYPE    = 'application/json'
+    NDJSON_MIMETYPE  = 'application/x-ndjson'
+    PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4'
     SQLITE3_MIMETYPE = 'application/x-sqlite3'
     TAR_MIMETYPE     = 'application/x-tar'
     XLSX_MIMETYPE    = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
@@ -12,6 +12,7 @@ import jsonschema
 
 import dbshare
 import dbshare.api.schema
+import dbshare.system
 
 from . import constants
 from . import utils
@@ -100,3 +101,12 @@ def settings():
             config[key] = '<hidden>'
     return flask.render_template('about/settings.html',
                                  items=sorted(config.items()))
+
+@blueprint.route('/slowqueries')
+@utils.admin_required
+def slowqueries():
+    "Display the slowest statements in the slow-query log."
+    return flask.render_template(
+        'about/slowqueries.html',
+        queries=dbshare.system.get_slow_queries(
+            flask.current_app.config['MAX_NROWS_DISPLAY']))
@@ -0,0 +1,363 @@
+"""Index advisor; recommends indexes from the queries performed.
+
+The columns compared in the WHERE part and join constraints of the queries
+performed on a database, and the columns of the ORDER BY part, are collected
+per table into candidate indexes, which are counted. The queries of the
+views are also considered. A candidate not covered by an existing index is
+recommended when it has been observed often enough.
+
+The benefit of a recommended index is estimated by replaying the latest
+query having it, without and with the index. The index is then created
+within a transaction that is rolled back.
+
+If the owner has opted in, a recommended index is created automatically
+by a job of the owner when it has been observed often enough, and the
+replay shows it to be worthwhile.
+"""
+
+import json
+import sqlite3
+import time
+
+import flask
+
+import dbshare.db
+import dbshare.jobs
+import dbshare.query
+import dbshare.system
+
+from . import utils
+
+
+# Max number of columns in a recommended index.
+MAX_COLUMNS = 3
+
+# Name of the index created temporarily when estimating the benefit.
+ESTIMATE_INDEX = '_index_advisor_estimate'
+
+
+blueprint = flask.Blueprint('advisor', __name__)
+
+@blueprint.route('/<name:dbname>')
+@utils.login_required
+def display(dbname):
+    "Display the indexes recommended for the database."
+    try:
+        db = dbshare.db.get_check_write(dbname, check_mode=False)
+    except (KeyError, ValueError) as error:
+        utils.flash_error(error)
+        return flask.redirect(flask.url_for('home'))
+    return flask.render_template('advisor/display.html',
+                                 db=db,
+                                 advice=get_advice(db))
+
+@blueprint.route('/<name:dbname>/estimate', methods=['POST'])
+@utils.login_required
+def estimate(dbname):
+    "Estimate the benefit of the recommended index by replaying its query."
+    utils.check_csrf_token()
+    try:
+        db = dbshare.db.get_check_write(dbname)
+    except (KeyError, ValueError) as error:
+        utils.flash_error(error)
+        return flask.redirect(flask.url_for('home'))
+    try:
+        set_estimate(db, get_form_advice(db))
+    except (ValueError, SystemError, sqlite3.Error) as error:
+        utils.flash_error(error)
+    return flask.redirect(flask.url_for('.display', dbname=dbname))
+
+@blueprint.route('/<name:dbname>/create', methods=['POST'])
+@utils.login_required
+def create(dbname):
+    "Create the recommended index."
+    utils.check_csrf_token()
+    try:
+        db = dbshare.db.get_check_write(dbname)
+    except (KeyError, ValueError) as error:
+        utils.flash_error(error)
+        return flask.redirect(flask.url_for('home'))
+    try:
+        advice = get_form_advice(db)
+        with dbshare.db.DbContext(db) as ctx:
+            ctx.add_index(advice['table'], {'columns': advice['columns'],
+                                            'unique': False})
+    except (ValueError, sqlite3.Error) as error:
+        utils.flash_error(error)
+    return flask.redirect(flask.url_for('.display', dbname=dbname))
+
+@blueprint.route('/<name:dbname>/autoindex', methods=['POST'])
+@utils.login_required
+def autoindex(dbname):
+    "Set whether recommended indexes are to be created automatically."
+    utils.check_csrf_token()
+    try:
+        db = dbshare.db.get_check_write(dbname, check_mode=False)
+    except (KeyError, ValueError) as error:
+        utils.flash_error(error)
+        return flask.redirect(flask.url_for('home'))
+    with dbshare.db.DbContext(db) as ctx:
+        ctx.set_autoindex(utils.to_bool(flask.request.form.get('autoindex')))
+    return flask.redirect(flask.url_for('.display', dbname=dbname))
+
+def get_form_advice(db):
+    """Return the recommendation given by the table and columns in the form.
+    Raise ValueError if there is no such recommendation.
+    """
+    tablename = flask.request.form.get('table')
+    try:
+        columns = json.loads(flask.request.form.get('columns') or '[]')
+    except ValueError:
+        columns = None
+    for advice in get_advice(db):
+        if advice['table'] == tablename and advice['columns'] == columns:
+            return advice
+    raise ValueError('no such index recommended')
+
+def get_advice(db):
+    """Return the indexes recommended for the database; the candidates not
+    covered by an existing index, which have been observed often enough,
+    or which are used by a view. The most often observed first.
+    """
+    result = {}
+    cursor = dbshare.system.get_cursor()
+    sql = "SELECT tablename, columns, count, sql, before, after, last" \
+          " FROM index_advice WHERE dbname=?"
+    cursor.execute(sql, (db['name'],))
+    for row in cursor:
+        if row[0] not in db['tables']: continue
+        columns = json.loads(row[1])
+        result[(row[0], tuple(columns))] = {'table': row[0],
+                                            'columns': columns,
+                                            'count': row[2],
+                                            'sql': row[3],
+                                            'before': row[4],
+                                            'after': row[5],
+                                            'last': row[6],
+                                            'views': []}
+    for view in db['views'].values():
+        try:
+            candidates = get_candidates(db, view['query'])
+        except ValueError:
+            continue
+        for tablename, columns in candidates:
+            advice = result.setdefault((tablename, tuple(columns)),
+                                       {'table': tablename,
+                                        'columns': columns,
+                                        'count': 0,
+                                        'sql': 'SELECT * FROM "%s"' %
+                                               view['name'],
+                                        'before': None,
+                                        'after': None,
+                                        'last': None,
+                                        'views': []})
+            advice['views'].append(view['name'])
+    min_count = flask.current_app.config['ADVISOR_MIN_COUNT']
+    result = [a for a in result.values()
+              if (a['count'] >= min_count or a['views']) and
+              not is_covered(db, a['table'], a['columns'])]
+    result.sort(key=lambda a: (-a['count'], a['table'], a['columns']))
+    return result
+
+def get_candidates(db, query):
+    """Return the candidate indexes for the query on the database, as a list
+    of tuples (tablename, columns). The columns compared for equality come
+    first, then the first column compared for a range or, if none, the
+    columns of the ORDER BY part.
+    Raises ValueError if the query cannot be parsed.
+    """
+    aliases, constraints = dbshare.query.get_from_aliases(query['from'])
+    tables = {}
+    for alias, name in aliases.items():
+        for tablename in db['tables']:
+            if tablename.lower() == name.lower():
+                tables[alias.lower()] = tablename
+    if not tables: return []
+    comparisons = dbshare.query.get_column_comparisons(constraints)
+    if query.get('where'):
+        comparisons.extend(dbshare.query.get_column_comparisons(
+            utils.lexer(query['where'])))
+    equal = {}
+    ranged = {}
+    for source, column, operator in comparisons:
+        resolved = _resolve(db, tables, source, column)
+        if resolved is None: continue
+        if operator in dbshare.query.EQUALITY_OPERATORS:
+            equal.setdefault(resolved[0], []).append(resolved[1])
+        else:
+            ranged.setdefault(resolved[0], []).append(resolved[1])
+    ordered = {}
+    if query.get('orderby'):
+        resolved = [_resolve(db, tables, source, column) for source, column
+                    in dbshare.query.get_orderby_columns(query['orderby'])]
+        if resolved and None not in resolved and \
+           len(set([r[0] for r in resolved])) == 1:
+            ordered[resolved[0][0]] = [r[1] for r in resolved]
+    result = []
+    for tablename in sorted(set(equal).union(ranged, ordered)):
+        columns = equal.get(tablename, [])
+        if tablename in ranged:
+            columns = columns + ranged[tablename][:1]
+        else:
+            columns = columns + ordered.get(tablename, [])
+        unique = []
+        for column in columns:
+            if column not in unique:
+                unique.append(column)
+        result.append((tablename, unique[:MAX_COLUMNS]))
+    return result
+
+def _resolve(db, tables, source, column):
+    """Return the tuple (tablename, column) for the column reference,
+    or None if it cannot be resolved unambiguously to a table column.
+    """
+    if source is None:
+        tablenames = set(tables.values())
+    else:
+        try:
+            tablenames = [tables[source.lower()]]
+        except KeyError:
+            return None
+    found = []
+    for tablename in tablenames:
+        for c in db['tables'][tablename]['columns']:
+            if c['name'].lower() == column.lower():
+                found.append((tablename, c['name']))
+    if len(found) == 1:
+        return found[0]
+    return None
+
+def is_covered(db, tablename, columns):
+    """Is there an existing index, or primary key, on the table
+    which starts with the given columns?
+    """
+    columns = [c.lower() for c in columns]
+    for index in db['indexes'].values():
+        if index['table'] != tablename: continue
+        if [c.lower() for c in index['columns'][:len(columns)]] == columns:
+            return True
+    primarykey = [c['name'].lower() for c in db['tables'][tablename]['columns']
+                  if c.get('primarykey')]
+    return primarykey[:len(columns)] == columns
+
+def observe(db, query, sql):
+    """Record the candidate indexes for the query performed on the database.
+    If the owner has opted in, start a job to create any recommended index
+    that has been observed often enough, if replaying its query shows it
+    to be worthwhile.
+    Any problem is ignored; the advice is not essential.
+    """
+    try:
+        candidates = get_candidates(db, query)
+    except (KeyError, ValueError):
+        return
+    if not candidates: return
+    cnx = dbshare.system.get_cnx()
+    try:
+        with cnx:
+            for tablename, columns in candidates:
+                cnx.execute("INSERT INTO index_advice (dbname, tablename,"
+                            " columns, count, sql, last)"
+                            " VALUES (?, ?, ?, 1, ?, ?)"
+                            " ON CONFLICT (dbname, tablename, columns)"
+                            " DO UPDATE SET count=count+1, sql=excluded.sql,"
+                            " last=excluded.last",
+                            (db['name'], tablename, json.dumps(columns),
+                             sql, utils.get_time()))
+    except sqlite3.Error:
+        return
+    if not db['autoindex'] or db['readonly']: return
+    if not get_autoindex(db, candidates): return
+    # The replay and creation are done by a job of the owner, since
+    # the current user may not have write access, or be anonymous.
+    for job in dbshare.jobs.get_jobs(dbname=db['name']):
+        if job['kind'] == 'autoindex' and not dbshare.jobs.is_done(job): return
+    try:
+        dbshare.jobs.submit('autoindex', db['name'], _autoindex, candidates,
+                            owner=db['owner'])
+    except (ValueError, sqlite3.Error):
+        pass
+
+def get_autoindex(db, candidates):
+    """Return the recommended indexes among the candidates which have been
+    observed often enough to be created automatically, and whose benefit
+    has not yet been estimated.
+    """
+    config = flask.current_app.config
+    return [advice for advice in get_advice(db)
+            if (advice['table'], advice['columns']) in candidates and
+            advice['count'] >= config['ADVISOR_AUTOINDEX_MIN_COUNT'] and
+            advice['after'] is None]
+
+def _autoindex(job, candidates):
+    """Create those of the recommended indexes among the candidates which
+    replaying their query shows to be worthwhile; executed as a job.
+    """
+    db = dbshare.db.get_db(job.dbname, complete=True)
+    if db is None: return None  # Deleted meanwhile.
+    if not db['autoindex'] or db['readonly']: return None
+    config = flask.current_app.config
+    created = []
+    for advice in get_autoindex(db, candidates):
+        job.check_cancelled()
+        try:
+            set_estimate(db, advice)
+            if advice['before'] >= advice['after'] * \
+               config['ADVISOR_AUTOINDEX_MIN_SPEEDUP']:
+                with dbshare.db.DbContext(db) as ctx:
+                    ctx.add_index(advice['table'],
+                                  {'columns': advice['columns'],
+                                   'unique': False})
+                created.append({'table': advice['table'],
+                                'columns': advice['columns']})
+        except (ValueError, SystemError, sqlite3.Error):
+            pass
+    return {'indexes': created}
+
+def set_estimate(db, advice):
+    """Estimate the benefit of the recommended index by replaying its query
+    without and with the index, which is created within a transaction that
+    is rolled back. Set the best times, and record them.
+    Raises SystemError if the creation of the index is interrupted.
+    """
+    dbcnx = dbshare.db.get_cnx(db['name'], write=True)
+    advice['before'] = _replay(dbcnx, advice['sql'])
+    dbcnx.execute('BEGIN')
+    try:
+        sql = dbshare.db.get_sql_create_index(advice['table'],
+                                              {'name': ESTIMATE_INDEX,
+                                               'columns': advice['columns']})
+        utils.execute_timeout(dbcnx, sql)
+        advice['after'] = _replay(dbcnx, advice['sql'])
+    finally:
+        dbcnx.rollback()
+    cnx = dbshare.system.get_cnx()
+    with cnx:
+        cnx.execute("INSERT INTO index_advice (dbname, tablename, columns,"
+                    " count, sql, before, after, last)"
+                    " VALUES (?, ?, ?, 0, ?, ?, ?, ?)"
+                    " ON CONFLICT (dbname, tablename, columns)"
+                    " DO UPDATE SET before=excluded.before,"
+                    " after=excluded.after",
+                    (db['name'], advice['table'], json.dumps(advice['columns']),
+                     advice['sql'], advice['before'], advice['after'],
+                     utils.get_time()))
+
+def _replay(dbcnx, sql):
+    """Return the best time of a number of runs executing the SQL and
+    fetching all rows. If interrupted, return the time-out.
+    """
+    def fetch(cnx):
+        for row in cnx.execute(sql): pass
+
+    result = None
+    for run in range(flask.current_app.config['ADVISOR_REPLAY_RUNS']):
+        started = time.perf_counter()
+        try:
+            utils.execute_timeout(dbcnx, fetch)
+        except SystemError:
+            return utils.get_execute_timeout()
+        elapsed = time.perf_counter() - started
+        if result is None or elapsed < result:
+            result = elapsed
+    return result
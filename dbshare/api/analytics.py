@@ -0,0 +1,88 @@
+"Access analytics API endpoint."
+
+import datetime
+import http.client
+import sqlite3
+
+import flask
+
+import dbshare.system
+
+from .. import utils
+
+
+blueprint = flask.Blueprint('api_analytics', __name__)
+
+@blueprint.route('')
+@utils.admin_required
+def analytics():
+    """Return the top databases, endpoints, users and status codes,
+    with counts and latencies, from the rollups of the access logs.
+    The period is the given number of 'days' (default 7), or 'hours'.
+    """
+    config = flask.current_app.config
+    try:
+        limit = int(flask.request.args.get('limit') or 10)
+        if limit <= 0: raise ValueError
+        if flask.request.args.get('hours'):
+            hours = int(flask.request.args['hours'])
+            if hours <= 0: raise ValueError
+            table = 'access_hourly'
+            since = datetime.datetime.utcnow() - \
+                    datetime.timedelta(hours=hours-1)
+            since = since.strftime('%Y-%m-%dT%H')
+            period = {'hours': hours, 'since': since}
+        else:
+            days = int(flask.request.args.get('days') or 7)
+            if days <= 0: raise ValueError
+            table = 'access_daily'
+            since = datetime.datetime.utcnow().date() - \
+                    datetime.timedelta(days=days-1)
+            since = since.isoformat()
+            period = {'days': days, 'since': since}
+    except ValueError:
+        utils.abort_json(http.client.BAD_REQUEST,
+                         'invalid limit, days or hours; must be positive')
+    cnx = dbshare.system.get_cnx()
+    try:
+        dbshare.system.rollup_access_logs(cnx,
+                                          config['LOG_ACCESS_RETENTION'],
+                                          config['LOG_ACCESS_HOURLY_RETENTION'])
+    except sqlite3.Error:       # E.g. locked by the logger; use as is.
+        pass
+
+    def top(column):
+        "Return the rows for the top values of the column."
+        sql = f"SELECT {column}, SUM(count), SUM(duration), MAX(duration_max)" \
+              f" FROM {table} WHERE period>=?" \
+              f" GROUP BY {column} ORDER BY 2 DESC, 1 LIMIT ?"
+        return cnx.execute(sql, (since, limit)).fetchall()
+
+    def latency(count, duration, duration_max):
+        "Return the mean and max latencies in milliseconds."
+        return {'mean_latency_ms': round(1000 * duration / count, 1),
+                'max_latency_ms': round(1000 * duration_max, 1)}
+
+    sql = f"SELECT SUM(count), SUM(duration), MAX(duration_max)" \
+          f" FROM {table} WHERE period>=?"
+    count, duration, duration_max = cnx.execute(sql, (since,)).fetchone()
+    if count:
+        total = dict(count=count, **latency(count, duration, duration_max))
+    else:
+        total = {'count': 0}
+    result = {
+        'title': 'Access analytics from the rollups of the access logs.',
+        'period': period,
+        'total': total,
+        'databases': [dict(name=row[0] or None, count=row[1],
+                           **latency(*row[1:]))
+                      for row in top('dbname')],
+        'endpoints': [dict(name=row[0] or None, count=row[1],
+                           **latency(*row[1:]))
+                      for row in top('endpoint')],
+        'users': [dict(username=row[0] or None, count=row[1])
+                  for row in top('username')],
+        'status_codes': [dict(status_code=row[0], count=row[1])
+                         for row in top('status_code')]
+    }
+    return utils.jsonify(utils.get_json(**result), schema='/analytics')
@@ -7,8 +7,12 @@ import sqlite3
 import flask
 import jsonschema
 
+import dbshare.advisor
+import dbshare.cache
 import dbshare.db
+import dbshare.jobs
 import dbshare.query
+import dbshare.api.jobs
 import dbshare.api.schema
 import dbshare.api.table
 import dbshare.api.user
@@ -22,19 +26,25 @@ blueprint = flask.Blueprint('api_db', __name__)
 @blueprint.route('/<name:dbname>', methods=['GET', 'PUT', 'POST', 'DELETE'])
 def database(dbname):
     """GET: List the database tables, views and metadata.
-    PUT: Create the database, load the data if any input.
+    PUT: Create the database, load the data if any input. If the query
+      parameter 'background' is true, the data is loaded by a job,
+      which is returned with status 202 Accepted.
     POST: Edit the database metadata.
     DELETE: Delete the database.
     """
     if utils.http_GET():
         try:
-            db = dbshare.db.get_check_read(dbname, nrows=True)
+            db = dbshare.db.get_check_read(dbname)
         except ValueError:
             flask.abort(http.client.UNAUTHORIZED)
         except KeyError:
             flask.abort(http.client.NOT_FOUND)
-        return utils.jsonify(utils.get_json(**get_json(db, complete=True)),
-                             schema='/db')
+        response = dbshare.cache.not_modified(db, 'json')
+        if response: return response
+        dbshare.db.set_nrows(db, True)
+        response = utils.jsonify(utils.get_json(**get_json(db, complete=True)),
+                                 schema='/db')
+        return dbshare.cache.set_headers(response, db, 'json')
  
     elif utils.http_PUT():
         db = dbshare.db.get_db(dbname)
@@ -51,7 +61,18 @@ def database(dbname):
         else:
             flask.abort(http.client.UNSUPPORTED_MEDIA_TYPE)
         try:
-            if add_func:
+            if add_func and \
+               utils.to_bool(flask.request.args.get('background')):
+                try:
+                    job = dbshare.db.start_add_database(
+                        dbname,
+                        add_func,
+                        io.BytesIO(flask.request.get_data()),
+                        flask.request.content_length)
+                except ValueError as error:
+                    utils.abort_json(http.client.TOO_MANY_REQUESTS, error)
+                return dbshare.api.jobs.accepted(job)
+            elif add_func:
                 db = add_func(dbname,
                               io.BytesIO(flask.request.get_data()),
                               flask.request.content_length)
@@ -93,6 +114,8 @@ def database(dbname):
                     pass
         except (jsonschema.ValidationError, ValueError) as error:
             utils.abort_json(http.client.BAD_REQUEST, error)
+        except SystemError as error:
+            utils.abort_json(http.client.CONFLICT, error)
         return flask.redirect(flask.url_for('.database', dbname=dbname))
 
     elif utils.http_DELETE(csrf=False):
@@ -107,7 +130,11 @@ def database(dbname):
 
 @blueprint.route('/<name:dbname>/query', methods=['POST'])
 def query(dbname):
-    "Perform a query of the database; return rows."
+    """Perform a query of the database; return rows.
+    If the query has a limit, then the result is a page of rows, and
+    'next' is the query to perform for the next page, if any. It contains
+    an opaque continuation token 'cursor'.
+    """
     try:
         db = dbshare.db.get_check_read(dbname)
     except ValueError:
@@ -115,39 +142,99 @@ def query(dbname):
     except KeyError:
         flask.abort(http.client.NOT_FOUND)
     timer = utils.Timer()
+    position = None
     try:
         query = flask.request.get_json()
         sql = dbshare.query.get_sql_statement(query)
-        dbcnx = dbshare.db.get_cnx(dbname)
-        cursor = utils.execute_timeout(dbcnx, sql)
-    except (jsonschema.ValidationError, sqlite3.Error) as error:
+        if query.get('limit'):
+            if query.get('cursor'):
+                position = utils.decode_cursor(query['cursor'])
+            else:
+                position = {}
+            page_sql, params, keyset = dbshare.query.get_page_sql(query, db,
+                                                                  position)
+            columns, rows, key = dbshare.cache.fetch(db, page_sql, params)
+            rows = list(rows)
+            if keyset:
+                columns = columns[:-1]
+            if len(rows) > query['limit']:
+                rows = rows[:query['limit']]
+                if keyset:
+                    position = {'rowid': rows[-1][-1]}
+                else:
+                    position = {'offset': position.get('offset', 0) +
+                                          query['limit']}
+            else:
+                position = None
+            if keyset:
+                rows = [row[:-1] for row in rows]
+        else:
+            columns, rows, key = dbshare.cache.fetch(db, sql)
+            rows = list(rows)
+    except (jsonschema.ValidationError, ValueError, sqlite3.Error) as error:
         utils.abort_json(http.client.BAD_REQUEST, error)
     except SystemError:
         flask.abort(http.client.REQUEST_TIMEOUT)
-    columns = [d[0] for d in cursor.description]
-    rows = cursor.fetchall()
+    dbshare.advisor.observe(db, query, sql)
     result = {
         'query': query,
         'sql': sql,
         'nrows': len(rows),
         'columns': columns,
-        'cpu_time': timer(),
-        'data': [dict(zip(columns, row)) for row in rows]
+        'cpu_time': timer()
+    }
+    if position:
+        result['cursor'] = utils.encode_cursor(position)
+        result['next'] = dict(query, cursor=result['cursor'])
+    result['data'] = [dict(zip(columns, row)) for row in rows]
+    response = utils.jsonify(utils.get_json(**result), schema='/query/output')
+    if key:
+        dbshare.cache.set_headers(response, db, 'json', key=key)
+    return response
+
+@blueprint.route('/<name:dbname>/advice')
+def advice(dbname):
+    "Return the indexes recommended for the database by the index advisor."
+    try:
+        db = dbshare.db.get_check_write(dbname, check_mode=False)
+    except ValueError:
+        flask.abort(http.client.UNAUTHORIZED)
+    except KeyError:
+        flask.abort(http.client.NOT_FOUND)
+    result = {
+        'name': db['name'],
+        'autoindex': db['autoindex'],
+        'advice': dbshare.advisor.get_advice(db)
     }
-    return utils.jsonify(utils.get_json(**result), schema='/query/output')
+    return utils.jsonify(utils.get_json(**result), schema='/advice')
 
 @blueprint.route('/<name:dbname>/readonly', methods=['POST'])
 def readonly(dbname):
-    "POST: Set the database to read-only."
+    """POST: Set the database to read-only.
+    If the query parameter 'background' is true, then the content hashes
+    are computed by a job, which is returned with status 202 Accepted.
+    Status 409 Conflict if the database is busy.
+    """
+    background = utils.to_bool(flask.request.args.get('background'))
     try:
         db = dbshare.db.get_check_write(dbname, check_mode=False)
         if not db['readonly']:
             with dbshare.db.DbContext(db) as ctx:
-                ctx.set_readonly(True)
+                ctx.set_readonly(True, hashes=not background)
+            if background:
+                try:
+                    return dbshare.api.jobs.accepted(
+                        dbshare.db.start_hashing(db))
+                except ValueError as error:
+                    with dbshare.db.DbContext(db) as ctx:
+                        ctx.set_readonly(False)
+                    utils.abort_json(http.client.TOO_MANY_REQUESTS, error)
     except ValueError:
         flask.abort(http.client.UNAUTHORIZED)
     except KeyError:
         flask.abort(http.client.NOT_FOUND)
+    except SystemError as error:
+        utils.abort_json(http.client.CONFLICT, error)
     return flask.redirect(flask.url_for('.database', dbname=dbname))
 
 @blueprint.route('/<name:dbname>/readwrite', methods=['POST'])
@@ -164,6 +251,93 @@ def readwrite(dbname):
         flask.abort(http.client.NOT_FOUND)
     return flask.redirect(flask.url_for('.database', dbname=dbname))
 
+@blueprint.route('/<name:dbname>/vacuum', methods=['POST'])
+def vacuum(dbname):
+    """POST: Run VACUUM on the database, and reset the table caches,
+    by a job, which is returned with status 202 Accepted.
+    """
+    try:
+        db = dbshare.db.get_check_write(dbname)
+    except ValueError:
+        flask.abort(http.client.UNAUTHORIZED)
+    except KeyError:
+        flask.abort(http.client.NOT_FOUND)
+    try:
+        job = dbshare.db.start_vacuum(db)
+    except ValueError as error:
+        utils.abort_json(http.client.TOO_MANY_REQUESTS, error)
+    return dbshare.api.jobs.accepted(job)
+
+@blueprint.route('/<name:dbname>/analyze', methods=['POST'])
+def analyze(dbname):
+    """POST: Run ANALYZE on the database by a job,
+    which is returned with status 202 Accepted.
+    """
+    try:
+        db = dbshare.db.get_check_write(dbname)
+    except ValueError:
+        flask.abort(http.client.UNAUTHORIZED)
+    except KeyError:
+        flask.abort(http.client.NOT_FOUND)
+    try:
+        job = dbshare.db.start_analyze(db)
+    except ValueError as error:
+        utils.abort_json(http.client.TOO_MANY_REQUESTS, error)
+    return dbshare.api.jobs.accepted(job)
+
+@blueprint.route('/<name:dbname>/hashes')
+def hashes(dbname):
+    """Return the status and values of the content hashes of the database.
+    Status 202 Accepted while they are being computed in the background.
+    """
+    try:
+        db = dbshare.db.get_check_read(dbname, complete=False)
+    except ValueError:
+        flask.abort(http.client.UNAUTHORIZED)
+    except KeyError:
+        flask.abort(http.client.NOT_FOUND)
+    result = get_hashes_json(db)
+    response = utils.jsonify(utils.get_json(**result), schema='/hashes')
+    if dbshare.db.is_hashing(db):
+        response.status_code = http.client.ACCEPTED
+        response.headers.set('Retry-After', 2)
+    return response
+
+@blueprint.route('/<name:dbname>/hashes/verify', methods=['POST'])
+@utils.admin_required
+def verify(dbname):
+    "Recompute the content hashes of the database and compare them."
+    db = dbshare.db.get_db(dbname)
+    if db is None:
+        flask.abort(http.client.NOT_FOUND)
+    try:
+        verified = dbshare.db.verify_hashes(db)
+    except ValueError as error:
+        utils.abort_json(http.client.CONFLICT, error)
+    result = get_hashes_json(db)
+    result['verified'] = [{'hashname': hashname,
+                           'recorded': recorded,
+                           'computed': computed,
+                           'match': recorded == computed}
+                          for hashname, (recorded, computed)
+                          in sorted(verified.items())]
+    result['valid'] = all([v['match'] for v in result['verified']])
+    return utils.jsonify(utils.get_json(**result), schema='/hashes')
+
+def get_hashes_json(db):
+    "Return the JSON for the status of the content hashes of the database."
+    if not db['readonly']:
+        status = 'none'
+    elif dbshare.db.is_hashing(db):
+        status = 'computing'
+    else:
+        status = 'done'
+    return {'name': db['name'],
+            'database': {'href': utils.url_for('.database',
+                                               dbname=db['name'])},
+            'status': status,
+            'hashes': db['hashes']}
+
 def get_json(db, complete=False):
     "Return the JSON for the database."
     result = {'name': db['name'],
@@ -178,6 +352,9 @@ def get_json(db, complete=False):
               'hashes': db['hashes']
     }
     if complete:
+        if dbshare.db.has_write_access(db, check_mode=False):
+            result['advice'] = {'href': utils.url_for('api_db.advice',
+                                                     dbname=db['name'])}
         result['tables'] = [dbshare.api.table.get_json(db, table, title=True)
                             for table in db['tables'].values()]
         result['views'] = [dbshare.api.view.get_json(db, view)
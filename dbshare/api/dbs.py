@@ -3,11 +3,13 @@
 import http.client
 
 import flask
+import jsonschema
 
 import dbshare.dbs
 import dbshare.user
 
 import dbshare.api.db
+import dbshare.schema.lookup
 
 from .. import utils
 
@@ -16,40 +18,111 @@ blueprint = flask.Blueprint('api_dbs', __name__)
 
 @blueprint.route('/public')
 def public():
-    "Return the list of public databases."
-    result = {
-        'title': 'Public databases',
-        'databases': get_json(dbshare.dbs.get_dbs(public=True))
-    }
+    """Return the list of public databases.
+    May be sorted and paged; see 'get_page'.
+    """
+    result = {'title': 'Public databases',
+              'count': dbshare.dbs.get_total(public=True)[0]}
+    get_page(result, '.public', public=True)
     return utils.jsonify(utils.get_json(**result), schema='/dbs')
 
 @blueprint.route('/all')
 @utils.admin_required
 def all():
-    "Return the list of all databases."
-    dbs = dbshare.dbs.get_dbs()
-    result = {
-        'title': 'All databases',
-        'total_size': sum([db['size'] for db in dbs]),
-        'databases': get_json(dbs)
-    }
+    """Return the list of all databases.
+    May be sorted and paged; see 'get_page'.
+    """
+    count, total_size = dbshare.dbs.get_total()
+    result = {'title': 'All databases',
+              'count': count,
+              'total_size': total_size}
+    get_page(result, '.all')
     return utils.jsonify(utils.get_json(**result), schema='/dbs')
 
 @blueprint.route('/owner/<name:username>')
 @utils.login_required
 def owner(username):
-    "Return the list of databases owned by the given user."
+    """Return the list of databases owned by the given user.
+    May be sorted and paged; see 'get_page'.
+    """
     if not dbshare.dbs.has_access(username):
         return flask.abort(http.client.UNAUTHORIZED)
-    dbs = dbshare.dbs.get_dbs(owner=username)
-    result = {
-        'title': f"Databases owned by {username}",
-        'user': dbshare.api.user.get_json(username),
-        'total_size': sum([db['size'] for db in dbs]),
-        'databases': get_json(dbs)
-    }
+    count, total_size = dbshare.dbs.get_total(owner=username)
+    result = {'title': f"Databases owned by {username}",
+              'user': dbshare.api.user.get_json(username),
+              'count': count,
+              'total_size': total_size}
+    get_page(result, '.owner', owner=username)
     return utils.jsonify(utils.get_json(**result), schema='/dbs')
 
+@blueprint.route('/lookup/<hashcode>')
+def lookup(hashcode):
+    """Redirect to the database with the given hash, which may be
+    prefixed by the hash name and a colon.
+    """
+    try:
+        dbname = dbshare.dbs.resolve_hashes([hashcode])[hashcode]
+    except ValueError as error:
+        utils.abort_json(http.client.BAD_REQUEST, error)
+    if dbname is None:
+        flask.abort(http.client.NOT_FOUND)
+    return flask.redirect(utils.url_for('api_db.database', dbname=dbname))
+
+@blueprint.route('/lookup', methods=['POST'])
+def lookup_batch():
+    """Return the databases having the given hashes, in the same order.
+    The database is null for a hash that does not match one that
+    the current user may read.
+    """
+    try:
+        data = flask.request.get_json()
+        utils.json_validate(data, dbshare.schema.lookup.input)
+        if len(data['hashes']) > flask.current_app.config['LOOKUP_MAX_HASHES']:
+            raise ValueError('too many hashes in one request')
+        dbnames = dbshare.dbs.resolve_hashes(data['hashes'])
+    except (jsonschema.ValidationError, ValueError) as error:
+        utils.abort_json(http.client.BAD_REQUEST, error)
+    result = {'title': 'Databases looked up by content hashes.',
+              'hashes': []}
+    for hashcode in data['hashes']:
+        dbname = dbnames[hashcode]
+        if dbname is None:
+            database = None
+        else:
+            database = {'name': dbname,
+                        'href': utils.url_for('api_db.database',
+                                              dbname=dbname)}
+        result['hashes'].append({'hash': hashcode, 'database': database})
+    return utils.jsonify(utils.get_json(**result), schema='/lookup/output')
+
+def get_page(result, endpoint, **criteria):
+    """Set the databases satisfying the criteria in the result, sorted by
+    the request argument 'sort' (default 'name'), in descending order if
+    'desc' is true. If the argument 'limit' is given, set a page of at most
+    that many databases, and the cursor and link for the next page, if any.
+    Abort with 400 if any argument is invalid.
+    """
+    sort = flask.request.args.get('sort') or 'name'
+    desc = utils.to_bool(flask.request.args.get('desc'))
+    try:
+        limit, position = utils.get_page_args()
+        dbs, position = dbshare.dbs.get_dbs_page(sort=sort,
+                                                 desc=desc,
+                                                 limit=limit,
+                                                 position=position,
+                                                 **criteria)
+    except ValueError as error:
+        utils.abort_json(http.client.BAD_REQUEST, error)
+    result['databases'] = get_json(dbs)
+    if position:
+        result['cursor'] = utils.encode_cursor(position)
+        values = {'sort': sort, 'limit': limit, 'cursor': result['cursor']}
+        if desc:
+            values['desc'] = 'true'
+        if criteria.get('owner'):
+            values['username'] = criteria['owner']
+        result['next'] = {'href': utils.url_for(endpoint, **values)}
+
 def get_json(dbs):
     "Return JSON for the databases."
     result = []
@@ -0,0 +1,139 @@
+"Background jobs API endpoints."
+
+import http.client
+
+import flask
+
+import dbshare.jobs
+
+from .. import utils
+
+
+blueprint = flask.Blueprint('api_jobs', __name__)
+
+@blueprint.route('')
+def jobs():
+    """Return the jobs of the current user, the latest first.
+    For an admin, the query parameter 'all' gives the jobs of all users.
+    """
+    if not flask.g.current_user:
+        flask.abort(http.client.UNAUTHORIZED)
+    try:
+        limit = int(flask.request.args.get('limit') or 100)
+        if limit <= 0: raise ValueError
+    except ValueError:
+        utils.abort_json(http.client.BAD_REQUEST,
+                         'invalid limit; must be positive')
+    if flask.g.is_admin and utils.to_bool(flask.request.args.get('all')):
+        owner = None
+    else:
+        owner = flask.g.current_user['username']
+    result = {
+        'title': 'Background jobs.',
+        'jobs': [get_json(job)
+                 for job in dbshare.jobs.get_jobs(owner=owner, limit=limit)]
+    }
+    return utils.jsonify(utils.get_json(**result), schema='/jobs')
+
+@blueprint.route('/<iuid>')
+def job(iuid):
+    "Return the status, progress and result of the job."
+    job = get_check_job(iuid)
+    response = utils.jsonify(utils.get_json(**get_json(job)), schema='/job')
+    if not dbshare.jobs.is_done(job):
+        response.headers.set('Retry-After', 2)
+    return response
+
+@blueprint.route('/<iuid>/result')
+def result(iuid):
+    """Redirect to the resource produced or changed by the job.
+    Status 202 Accepted while it is queued or running,
+    and 409 Conflict if it failed or was cancelled.
+    """
+    job = get_check_job(iuid)
+    if not dbshare.jobs.is_done(job):
+        response = flask.make_response('', http.client.ACCEPTED)
+        response.headers.set('Retry-After', 2)
+        return response
+    if job['status'] != dbshare.jobs.FINISHED:
+        utils.abort_json(http.client.CONFLICT,
+                         f"job {job['status']}: {job['error']}")
+    url = get_result_url(job)
+    if url is None:
+        flask.abort(http.client.NOT_FOUND)
+    return flask.redirect(url, code=http.client.SEE_OTHER)
+
+@blueprint.route('/<iuid>/cancel', methods=['POST'])
+def cancel(iuid):
+    """POST: Cancel the job, if not done. A running job stops when
+    it next checks for cancellation.
+    """
+    job = get_check_job(iuid)
+    dbshare.jobs.cancel(job)
+    return flask.redirect(flask.url_for('.job', iuid=iuid))
+
+def get_check_job(iuid):
+    "Return the job, if the current user has access to it. Else abort."
+    job = dbshare.jobs.get_job(iuid)
+    if job is None:
+        flask.abort(http.client.NOT_FOUND)
+    if not dbshare.jobs.has_access(job):
+        flask.abort(http.client.UNAUTHORIZED)
+    return job
+
+def get_result_url(job):
+    "Return the URL of the resource produced or changed by the job, if any."
+    result = job['result'] or {}
+    if job['kind'] == 'export' and result.get('filename'):
+        return utils.url_for('db.export',
+                             dbname=job['dbname'],
+                             filename=result['filename'])
+    elif job['kind'] == 'create' and result.get('name'):
+        return utils.url_for('api_db.database', dbname=result['name'])
+    elif job['kind'] in ('load', 'clone') and result.get('table'):
+        return utils.url_for('api_table.table',
+                             dbname=job['dbname'],
+                             tablename=result['table'])
+    elif job['kind'] == 'hashing':
+        return utils.url_for('api_db.hashes', dbname=job['dbname'])
+    elif job['dbname']:
+        return utils.url_for('api_db.database', dbname=job['dbname'])
+    return None
+
+def get_json(job):
+    "Return the JSON for the job."
+    url = utils.url_for('api_jobs.job', iuid=job['iuid'])
+    result = {'iuid': job['iuid'],
+              'href': url,
+              'kind': job['kind'],
+              'database': None,
+              'owner': job['owner'],
+              'status': job['status'],
+              'progress': job['progress'],
+              'result': job['result'],
+              'error': job['error'],
+              'created': job['created'],
+              'started': job['started'],
+              'finished': job['finished']}
+    if job['dbname']:
+        result['database'] = {'name': job['dbname'],
+                              'href': utils.url_for('api_db.database',
+                                                    dbname=job['dbname'])}
+    if dbshare.jobs.is_done(job):
+        if job['status'] == dbshare.jobs.FINISHED:
+            result['result_link'] = {'href': url + '/result'}
+    else:
+        result['cancel'] = {'href': url + '/cancel', 'method': 'POST'}
+    return result
+
+def accepted(job):
+    """Return the response 202 Accepted for the submitted job,
+    with its location.
+    """
+    url = utils.url_for('api_jobs.job', iuid=job['iuid'])
+    response = utils.jsonify(utils.get_json(**get_json(job), **{'$id': url}),
+                             schema='/job')
+    response.status_code = http.client.ACCEPTED
+    response.headers.set('Location', url)
+    response.headers.set('Retry-After', 2)
+    return response
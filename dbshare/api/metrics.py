@@ -0,0 +1,60 @@
+"Metrics API endpoint, in Prometheus text format."
+
+import http.client
+
+import flask
+
+import dbshare.db
+import dbshare.jobs
+import dbshare.metrics
+import dbshare.pool
+import dbshare.system
+
+from .. import constants
+
+
+blueprint = flask.Blueprint('api_metrics', __name__)
+
+@blueprint.route('')
+def metrics():
+    """Return the timing histograms per endpoint, summed over all worker
+    processes, and the counters of the metadata cache, the connection pool
+    and the access logger. The latter are those of the process answering,
+    labelled by its instance token; each process is a separate series.
+    Only for admin, or from an address allowed by configuration.
+    """
+    if not flask.g.is_admin and flask.request.remote_addr not in \
+       flask.current_app.config['METRICS_REMOTE_ADDRS']:
+        flask.abort(http.client.UNAUTHORIZED)
+    lines = dbshare.metrics.get_lines(dbshare.system.get_cnx())
+    labels = f'instance="{dbshare.jobs.get_instance()}"'
+    cache = dbshare.db.METADATA_CACHE
+    add_metric(lines, 'dbshare_metadata_cache_hits_total', 'counter',
+               'Hits in the database metadata cache.', labels, cache.hits)
+    add_metric(lines, 'dbshare_metadata_cache_misses_total', 'counter',
+               'Misses in the database metadata cache.', labels,
+               cache.misses)
+    add_metric(lines, 'dbshare_metadata_cache_size', 'gauge',
+               'Number of databases in the metadata cache.', labels,
+               len(cache))
+    add_metric(lines, 'dbshare_pool_idle_connections', 'gauge',
+               'Number of idle connections in the pool.', labels,
+               dbshare.pool.count_idle())
+    logger = dbshare.system.ACCESS_LOGGER
+    if logger is not None:
+        add_metric(lines, 'dbshare_access_logs_written_total', 'counter',
+                   'Access log entries written.', labels, logger.written)
+        add_metric(lines, 'dbshare_access_logs_dropped_total', 'counter',
+                   'Access log entries dropped.', labels, logger.dropped)
+        add_metric(lines, 'dbshare_access_logs_queued', 'gauge',
+                   'Access log entries waiting to be written.', labels,
+                   logger.queue.qsize())
+    lines.append('')
+    return flask.Response('\n'.join(lines),
+                          mimetype=constants.PROMETHEUS_MIMETYPE)
+
+def add_metric(lines, name, kind, text, labels, value):
+    "Add the lines for a metric with a single value."
+    lines.append(f"# HELP {name} {text}")
+    lines.append(f"# TYPE {name} {kind}")
+    lines.append(f"{name}{{{labels}}} {value}")
@@ -33,9 +33,14 @@ def root():
         result['users'] = {
             'all': {'href': utils.url_for('api_users.all')}
         }
+        result['analytics'] = {'href': utils.url_for('api_analytics.analytics')}
+        result['metrics'] = {'href': utils.url_for('api_metrics.metrics')}
+        result['slowqueries'] = {
+            'href': utils.url_for('api_slowqueries.slowqueries')}
     if flask.g.current_user:
         result['user'] = dbshare.api.user.get_json(
             flask.g.current_user['username'])
+        result['jobs'] = {'href': utils.url_for('api_jobs.jobs')}
     result['operations'] = {
         'database': {
             'query': {
@@ -57,13 +62,33 @@ def root():
                         'href': schema_base_url + '/query/output'
                     }
                 }
+            },
+            'lookup': {
+                'title': 'Look up databases by content hashes.',
+                'href': utils.url_for('api_dbs.lookup_batch'),
+                'method': 'POST',
+                'input' : {
+                    'content-type': constants.JSON_MIMETYPE,
+                    'schema': {
+                        'href': schema_base_url + '/lookup/input'
+                    }
+                },
+                'output' : {
+                    'content-type': constants.JSON_MIMETYPE,
+                    'schema': {
+                        'href': schema_base_url + '/lookup/output'
+                    }
+                }
             }
         }
     }
     if flask.g.current_user:
         result['operations']['database'].update({
             'create': {
-                'title': 'Create a new database.',
+                'title': 'Create a new database. If the query parameter'
+                         ' background is true, the data is loaded by a'
+                         ' background job, which is at the returned'
+                         ' location.',
                 'href': utils.url_for_unq('api_db.database', dbname='{dbname}'),
                 'variables': {
                     'dbname': {'title': 'Name of the database.'}
@@ -93,7 +118,10 @@ def root():
                 'method': 'DELETE'
             },
             'readonly': {
-                'title': 'Set the database to read-only.',
+                'title': 'Set the database to read-only. If the query'
+                         ' parameter background is true, the content'
+                         ' hashes are computed by a background job,'
+                         ' which is at the returned location.',
                 'href': utils.url_for_unq('api_db.database', dbname='{dbname}'),
                 'variables': {
                     'dbname': {'title': 'Name of the database.'}
@@ -107,6 +135,24 @@ def root():
                     'dbname': {'title': 'Name of the database.'}
                 },
                 'method': 'POST'
+            },
+            'vacuum': {
+                'title': 'Run VACUUM on the database by a background job,'
+                         ' which is at the returned location.',
+                'href': utils.url_for_unq('api_db.vacuum', dbname='{dbname}'),
+                'variables': {
+                    'dbname': {'title': 'Name of the database.'}
+                },
+                'method': 'POST'
+            },
+            'analyze': {
+                'title': 'Run ANALYZE on the database by a background job,'
+                         ' which is at the returned location.',
+                'href': utils.url_for_unq('api_db.analyze', dbname='{dbname}'),
+                'variables': {
+                    'dbname': {'title': 'Name of the database.'}
+                },
+                'method': 'POST'
             }
         })
         result['operations']['table'] = {
@@ -135,7 +181,9 @@ def root():
                 'method': 'DELETE'
             },
             'insert': {
-                'title': 'Insert rows from JSON or CSV data into the table.',
+                'title': 'Insert rows from JSON, NDJSON or CSV data into'
+                         ' the table. The query parameter on_conflict'
+                         ' may be replace, ignore or update.',
                 'href': utils.url_for_unq('api_table.insert', dbname='{dbname}', tablename='{tablename}'),
                 'variables': {
                     'dbname': {'title': 'Name of the database.'},
@@ -149,11 +197,20 @@ def root():
                             'href': schema_base_url + '/table/input'
                         }
                     },
+                    {'content-type': constants.NDJSON_MIMETYPE},
                     {'content-type': constants.CSV_MIMETYPE}
-                ]
+                ],
+                'output': {
+                    'content-type': constants.JSON_MIMETYPE,
+                    'schema': {
+                        'href': schema_base_url + '/table/insert/summary'
+                    }
+                }
             },
             'update': {
-                'title': 'Update rows in the table from CSV data.',
+                'title': 'Update rows in the table from CSV data.'
+                         ' Insert the non-matching rows if the query'
+                         ' parameter upsert is true.',
                 'href': utils.url_for_unq('api_table.update', dbname='{dbname}', tablename='{tablename}'),
                 'variables': {
                     'dbname': {'title': 'Name of the database.'},
@@ -2,8 +2,14 @@
 
 import flask
 
+import dbshare.schema.advice
+import dbshare.schema.analytics
+import dbshare.schema.slowqueries
 import dbshare.schema.db
 import dbshare.schema.dbs
+import dbshare.schema.hashes
+import dbshare.schema.jobs
+import dbshare.schema.lookup
 import dbshare.schema.root
 import dbshare.schema.rows
 import dbshare.schema.table
@@ -31,6 +37,9 @@ schemas = {
                      'title': dbshare.schema.table.create['title']},
     'table/input': {'href':  dbshare.schema.table.input['$id'],
                     'title': dbshare.schema.table.input['title']},
+    'table/insert/summary': {
+        'href':  dbshare.schema.table.insert_summary['$id'],
+        'title': dbshare.schema.table.insert_summary['title']},
     'view': {'href':  dbshare.schema.view.schema['$id'],
              'title': dbshare.schema.view.schema['title']},
     'view/create': {'href':  dbshare.schema.view.create['$id'],
@@ -49,6 +58,22 @@ schemas = {
              'title': dbshare.schema.user.schema['title']},
     'users': {'href':  dbshare.schema.users.schema['$id'],
               'title': dbshare.schema.users.schema['title']},
+    'advice': {'href':  dbshare.schema.advice.schema['$id'],
+               'title': dbshare.schema.advice.schema['title']},
+    'analytics': {'href':  dbshare.schema.analytics.schema['$id'],
+                  'title': dbshare.schema.analytics.schema['title']},
+    'slowqueries': {'href':  dbshare.schema.slowqueries.schema['$id'],
+                    'title': dbshare.schema.slowqueries.schema['title']},
+    'hashes': {'href':  dbshare.schema.hashes.schema['$id'],
+               'title': dbshare.schema.hashes.schema['title']},
+    'job': {'href':  dbshare.schema.jobs.job['$id'],
+            'title': dbshare.schema.jobs.job['title']},
+    'jobs': {'href':  dbshare.schema.jobs.jobs['$id'],
+             'title': dbshare.schema.jobs.jobs['title']},
+    'lookup/input': {'href':  dbshare.schema.lookup.input['$id'],
+                     'title': dbshare.schema.lookup.input['title']},
+    'lookup/output': {'href':  dbshare.schema.lookup.output['$id'],
+                      'title': dbshare.schema.lookup.output['title']},
 }
 
 blueprint = flask.Blueprint('api_schema', __name__)
@@ -102,6 +127,11 @@ def table_input():
     "JSON schema for table input API."
     return flask.jsonify(dbshare.schema.table.input)
 
+@blueprint.route('/table/insert/summary')
+def table_insert_summary():
+    "JSON schema for table NDJSON data insert summary API."
+    return flask.jsonify(dbshare.schema.table.insert_summary)
+
 @blueprint.route('/view')
 def view():
     "JSON schema for view API."
@@ -146,3 +176,43 @@ def user():
 def users():
     "JSON schema for user list API."
     return flask.jsonify(dbshare.schema.users.schema)
+
+@blueprint.route('/advice')
+def advice():
+    "JSON schema for index advisor API."
+    return flask.jsonify(dbshare.schema.advice.schema)
+
+@blueprint.route('/analytics')
+def analytics():
+    "JSON schema for access analytics API."
+    return flask.jsonify(dbshare.schema.analytics.schema)
+
+@blueprint.route('/slowqueries')
+def slowqueries():
+    "JSON schema for slow-query log API."
+    return flask.jsonify(dbshare.schema.slowqueries.schema)
+
+@blueprint.route('/hashes')
+def hashes():
+    "JSON schema for content hashes status API."
+    return flask.jsonify(dbshare.schema.hashes.schema)
+
+@blueprint.route('/job')
+def job():
+    "JSON schema for background job API."
+    return flask.jsonify(dbshare.schema.jobs.job)
+
+@blueprint.route('/jobs')
+def jobs():
+    "JSON schema for background jobs list API."
+    return flask.jsonify(dbshare.schema.jobs.jobs)
+
+@blueprint.route('/lookup/input')
+def lookup_input():
+    "JSON schema for content hash lookup input API."
+    return flask.jsonify(dbshare.schema.lookup.input)
+
+@blueprint.route('/lookup/output')
+def lookup_output():
+    "JSON schema for content hash lookup output API."
+    return flask.jsonify(dbshare.schema.lookup.output)
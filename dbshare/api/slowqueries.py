@@ -0,0 +1,33 @@
+"Slow-query log API endpoint."
+
+import http.client
+
+import flask
+
+import dbshare.system
+
+from .. import utils
+
+
+blueprint = flask.Blueprint('api_slowqueries', __name__)
+
+@blueprint.route('')
+@utils.admin_required
+def slowqueries():
+    """Return the slowest statements in the slow-query log, optionally
+    for the database given by 'dbname', with their query plans and
+    the tables scanned in full where an index might help.
+    """
+    try:
+        limit = int(flask.request.args.get('limit') or 20)
+        if limit <= 0: raise ValueError
+    except ValueError:
+        utils.abort_json(http.client.BAD_REQUEST,
+                         'invalid limit; must be positive')
+    dbname = flask.request.args.get('dbname') or None
+    result = {
+        'title': 'Slowest statements in the slow-query log.',
+        'threshold': flask.current_app.config['SLOW_QUERY_THRESHOLD'],
+        'queries': dbshare.system.get_slow_queries(limit, dbname=dbname)
+    }
+    return utils.jsonify(utils.get_json(**result), schema='/slowqueries')
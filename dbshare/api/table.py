@@ -1,12 +1,14 @@
 "Table API endpoints."
 
-import io
+import copy
 import http.client
 import sqlite3
+import time
 
 import flask
 import jsonschema
 
+import dbshare.cache
 import dbshare.db
 import dbshare.table
 import dbshare.schema.table
@@ -35,9 +37,12 @@ def table(dbname, tablename):
             schema = db['tables'][tablename]
         except KeyError:
             flask.abort(http.client.NOT_FOUND)
+        response = dbshare.cache.not_modified(db, 'json')
+        if response: return response
         result = get_json(db, schema, complete=True)
         result.update(schema)
-        return utils.jsonify(utils.get_json(**result), schema='/table')
+        response = utils.jsonify(utils.get_json(**result), schema='/table')
+        return dbshare.cache.set_headers(response, db, 'json')
 
     elif utils.http_PUT():
         try:
@@ -81,17 +86,25 @@ def statistics(dbname, tablename):
     except KeyError:
         flask.abort(http.client.NOT_FOUND)
     try:
-        schema = db['tables'][tablename]
+        schema = copy.deepcopy(db['tables'][tablename])
     except KeyError:
         flask.abort(http.client.NOT_FOUND)
     result = get_json(db, schema, complete=False)
-    dbshare.table.compute_statistics(db, schema)
+    try:
+        dbshare.table.compute_statistics(db, schema,
+                                         mode=flask.request.args.get('mode'))
+    except ValueError as error:
+        utils.abort_json(http.client.BAD_REQUEST, error)
     result.update(schema)
     return utils.jsonify(utils.get_json(**result), schema='/table/statistics')
 
 @blueprint.route('/<name:dbname>/<name:tablename>/insert', methods=['POST'])
 def insert(dbname, tablename):
-    "POST: Insert rows from JSON or CSV data into the table."
+    """POST: Insert rows from JSON, NDJSON or CSV data into the table.
+    The query parameter 'on_conflict' specifies the action when a row
+    conflicts with an existing row: 'replace', 'ignore' or 'update'.
+    NDJSON data is read and inserted in batches, and a summary is returned.
+    """
     try:
         db = dbshare.db.get_check_write(dbname)
     except ValueError:
@@ -102,6 +115,7 @@ def insert(dbname, tablename):
         schema = db['tables'][tablename]
     except KeyError:
         flask.abort(http.client.NOT_FOUND)
+    on_conflict = flask.request.args.get('on_conflict') or None
     
     try:
         # JSON input data
@@ -111,54 +125,68 @@ def insert(dbname, tablename):
                 utils.json_validate(data, dbshare.schema.table.input)
             except jsonschema.ValidationError as error:
                 utils.abort_json(http.client.BAD_REQUEST, error)
-            columns = schema['columns']
             # Check validity of values in input data.
+            convert = dbshare.table.get_item_converter(schema)
             rows = []
             for pos, item in enumerate(data['data']):
-                values = []
-                for column in columns:
-                    try:
-                        value = item[column['name']]
-                    except KeyError:
-                        if column.get('notnull'):
-                            raise ValueError(f"missing key '{column['name']}'"
-                                             f" in item # {pos}")
-                        value = None
-                    else:
-                        try:
-                            if column['type'] == constants.INTEGER: 
-                                if not isinstance(value, int): raise TypeError
-                            elif column['type'] == constants.REAL:
-                                if not isinstance(value, (int, float)):
-                                    raise TypeError
-                            elif column['type'] == constants.TEXT:
-                                if not isinstance(value, str): raise TypeError
-                            elif column['type'] == constants.BLOB:
-                                raise TypeError
-                        except TypeError:
-                            raise ValueError(f"'{column['name']}'invalid type"
-                                             f" in item # {pos}")
-                    values.append(value)
-                rows.append(values)
+                try:
+                    rows.append(convert(item))
+                except ValueError as error:
+                    raise ValueError(f"{error} in item # {pos}")
+
+        # NDJSON input data
+        elif flask.request.mimetype == constants.NDJSON_MIMETYPE:
+            rows = dbshare.table.get_ndjson_rows(schema, flask.request.stream)
+            return insert_summary(db, schema, rows, on_conflict)
 
         # CSV input data
         elif flask.request.content_type == constants.CSV_MIMETYPE:
-            csvfile = io.BytesIO(flask.request.data)
-            rows = dbshare.table.get_csv_rows(schema, csvfile, ',', True)
+            rows = dbshare.table.get_csv_rows(schema, flask.request.stream,
+                                              ',', True)
 
         # Unrecognized input data type
         else:
             flask.abort(http.client.UNSUPPORTED_MEDIA_TYPE)
 
-        dbshare.table.insert_rows(db, schema, rows)
+        dbshare.table.insert_rows(db, schema, rows, on_conflict=on_conflict)
     except (ValueError, sqlite3.Error) as error:
         utils.abort_json(http.client.BAD_REQUEST, error)
     return flask.redirect(
         flask.url_for('api_table.table', dbname=dbname, tablename=tablename))
 
+def insert_summary(db, schema, rows, on_conflict):
+    """Insert the rows in batches, timing each batch.
+    Return the response containing the summary.
+    """
+    batches = []
+    started = time.monotonic()
+    previous = [0, started]     # Count and time at end of previous batch.
+    def progress(count):
+        now = time.monotonic()
+        batches.append({'records': count - previous[0],
+                        'seconds': round(now - previous[1], 3)})
+        previous[:] = [count, now]
+    count = dbshare.table.insert_rows(db, schema, rows,
+                                      progress=progress,
+                                      on_conflict=on_conflict)
+    result = {'name': schema['name'],
+              'href': utils.url_for('api_table.table',
+                                    dbname=db['name'],
+                                    tablename=schema['name']),
+              'on_conflict': on_conflict,
+              'records': count,
+              'nrows': schema['nrows'],
+              'seconds': round(time.monotonic() - started, 3),
+              'batches': batches}
+    return utils.jsonify(utils.get_json(**result),
+                         schema='/table/insert/summary')
+
 @blueprint.route('/<name:dbname>/<name:tablename>/update', methods=['POST'])
 def update(dbname, tablename):
-    "POST: Update table rows from CSV data (JSON not implemented)."
+    """POST: Update table rows from CSV data (JSON not implemented).
+    If the query parameter 'upsert' is true, then insert the CSV records
+    not matching any existing row.
+    """
     try:
         db = dbshare.db.get_check_write(dbname)
     except ValueError:
@@ -173,8 +201,9 @@ def update(dbname, tablename):
     try:
         # CSV input data
         if flask.request.content_type == constants.CSV_MIMETYPE:
-            csvfile = io.BytesIO(flask.request.data)
-            dbshare.table.update_csv_rows(db, schema, csvfile, ',')
+            upsert = utils.to_bool(flask.request.args.get('upsert'))
+            dbshare.table.update_csv_rows(db, schema, flask.request.stream,
+                                          ',', upsert=upsert)
 
         # Unrecognized input data type
         else:
@@ -225,10 +254,10 @@ def get_json(db, table, complete=False, title=False):
         result['statistics'] = {'href': utils.url_for('api_table.statistics',
                                                       dbname=db['name'],
                                                       tablename=table['name'])}
-        result['indexes'] = [i for i in db['indexes'].values()
+        result['indexes'] = [dict([(k, v) for k, v in i.items() 
+                                   if k != 'table'])
+                             for i in db['indexes'].values()
                              if i['table'] == table['name']]
-        for i in result['indexes']:
-            i.pop('table')
         result['charts'] = []
         for chart in db['charts'].values():
             if chart['schema'] != table['name']: continue
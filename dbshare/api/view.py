@@ -5,6 +5,7 @@ import http.client
 import flask
 import jsonschema
 
+import dbshare.cache
 import dbshare.db
 
 from .. import constants
@@ -31,9 +32,12 @@ def view(dbname, viewname):
             schema = db['views'][viewname]
         except KeyError:
             flask.abort(http.client.NOT_FOUND)
+        response = dbshare.cache.not_modified(db, 'json')
+        if response: return response
         result = get_json(db, schema, complete=True)
         result.update(schema)
-        return utils.jsonify(utils.get_json(**result), schema='/view')
+        response = utils.jsonify(utils.get_json(**result), schema='/view')
+        return dbshare.cache.set_headers(response, db, 'json')
 
     elif utils.http_PUT():
         try:
@@ -4,9 +4,13 @@ import flask
 
 import dbshare
 import dbshare.about
+import dbshare.advisor
+import dbshare.cache
 import dbshare.config
 import dbshare.db
+import dbshare.metrics
 import dbshare.dbs
+import dbshare.pool
 import dbshare.chart
 import dbshare.query
 import dbshare.schema
@@ -17,8 +21,12 @@ import dbshare.user
 import dbshare.view
 
 import dbshare.api.root
+import dbshare.api.analytics
+import dbshare.api.metrics
+import dbshare.api.slowqueries
 import dbshare.api.db
 import dbshare.api.dbs
+import dbshare.api.jobs
 import dbshare.api.schema
 import dbshare.api.table
 import dbshare.api.user
@@ -48,7 +56,11 @@ app.add_template_filter(utils.mode)
 dbshare.config.init(app)
 
 # Initialize the subsystems.
+dbshare.metrics.init(app)
 dbshare.system.init(app)
+dbshare.pool.init(app)
+dbshare.db.init(app)
+dbshare.cache.init(app)
 dbshare.chart.init(app)
 utils.mail.init_app(app)
 
@@ -80,7 +92,9 @@ def prepare():
                        flask.g.current_user.get('role') == constants.ADMIN
     flask.g.timer = utils.Timer()
 
+app.before_request(dbshare.system.reconcile_usage_if_due)
 app.after_request(dbshare.system.log_access)
+app.teardown_request(dbshare.system.write_slow_queries)
 
 @app.route('/')
 def home():
@@ -99,17 +113,24 @@ app.register_blueprint(dbshare.view.blueprint, url_prefix='/view')
 app.register_blueprint(dbshare.chart.blueprint, url_prefix='/chart')
 app.register_blueprint(dbshare.user.blueprint, url_prefix='/user')
 app.register_blueprint(dbshare.about.blueprint, url_prefix='/about')
+app.register_blueprint(dbshare.advisor.blueprint, url_prefix='/advisor')
 app.register_blueprint(dbshare.site.blueprint, url_prefix='/site')
 
 app.register_blueprint(dbshare.api.root.blueprint, url_prefix='/api')
 app.register_blueprint(dbshare.api.db.blueprint, url_prefix='/api/db')
 app.register_blueprint(dbshare.api.dbs.blueprint, url_prefix='/api/dbs')
+app.register_blueprint(dbshare.api.jobs.blueprint, url_prefix='/api/jobs')
 app.register_blueprint(dbshare.api.table.blueprint, url_prefix='/api/table')
 app.register_blueprint(dbshare.api.view.blueprint, url_prefix='/api/view')
 app.register_blueprint(dbshare.api.chart.blueprint, url_prefix='/api/chart')
 app.register_blueprint(dbshare.api.user.blueprint, url_prefix='/api/user')
 app.register_blueprint(dbshare.api.users.blueprint, url_prefix='/api/users')
 app.register_blueprint(dbshare.api.schema.blueprint, url_prefix='/api/schema')
+app.register_blueprint(dbshare.api.analytics.blueprint,
+                       url_prefix='/api/analytics')
+app.register_blueprint(dbshare.api.metrics.blueprint, url_prefix='/api/metrics')
+app.register_blueprint(dbshare.api.slowqueries.blueprint,
+                       url_prefix='/api/slowqueries')
 
 
 # This code is used only during development.
@@ -0,0 +1,307 @@
+"""Server-side cache of query results for read-only databases.
+
+The content of a read-only database cannot change, so the result of an
+SQL statement on it is determined by the content hashes of the database
+and the statement itself. The results are stored compressed in an Sqlite3
+file, which is bounded in total size by evicting the least recently used
+results. The total size is kept in the 'meta' table of the file by
+triggers, so that it need not be summed over all results.
+
+The ETags of the responses containing data from a database are derived
+from the result key, the content hashes or the modification timestamp,
+so that conditional requests can be answered before any Sqlite3 work.
+"""
+
+import datetime
+import hashlib
+import itertools
+import json
+import re
+import sqlite3
+import time
+import zlib
+
+import flask
+
+import dbshare
+import dbshare.db
+import dbshare.pool
+
+from . import constants
+from . import utils
+
+
+# String literals and quoted identifiers; whitespace in these is significant.
+QUOTED_RX = re.compile(r'''('(?:[^']|'')*'|"(?:[^"]|"")*")''')
+WHITESPACE_RX = re.compile(r'\s+')
+
+RESULTS_TABLE = dict(
+    name='results',
+    columns=[dict(name='key', type=constants.TEXT, primarykey=True),
+             dict(name='value', type=constants.BLOB, notnull=True),
+             dict(name='size', type=constants.INTEGER, notnull=True),
+             dict(name='used', type=constants.REAL, notnull=True)])
+
+RESULTS_INDEX = dict(name='results_used', table='results', columns=['used'])
+
+META_TABLE = dict(
+    name='meta',
+    columns=[dict(name='key', type=constants.TEXT, primarykey=True),
+             dict(name='value', type=constants.INTEGER, notnull=True)])
+
+# Triggers maintaining the total size of the results in 'meta'.
+RESULTS_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS results_insert AFTER INSERT ON results"
+    " BEGIN UPDATE meta SET value=value+new.size WHERE key='total'; END",
+    "CREATE TRIGGER IF NOT EXISTS results_delete AFTER DELETE ON results"
+    " BEGIN UPDATE meta SET value=value-old.size WHERE key='total'; END"
+]
+
+# Seconds before the time a result was last used is updated on a hit.
+USED_UPDATE_INTERVAL = 60.0
+
+# Number of least recently used results fetched at a time for eviction.
+EVICT_BATCH_SIZE = 100
+
+
+def init(app):
+    "Create the table of the result cache file, if not done."
+    path = utils.dbpath(constants.RESULT_CACHE,
+                        dirpath=app.config['DATABASES_DIRPATH'])
+    cnx = sqlite3.connect(path)
+    try:
+        with cnx:
+            cnx.execute(dbshare.db.get_sql_create_table(RESULTS_TABLE,
+                                                        if_not_exists=True))
+            cnx.execute(dbshare.db.get_sql_create_index('results',
+                                                        RESULTS_INDEX,
+                                                        if_not_exists=True))
+            cnx.execute(dbshare.db.get_sql_create_table(META_TABLE,
+                                                        if_not_exists=True))
+            # Set the total size, e.g. for a file from a previous version.
+            cnx.execute("INSERT OR IGNORE INTO meta (key, value) VALUES"
+                        " ('total', (SELECT COALESCE(SUM(size), 0)"
+                        " FROM results))")
+            for sql in RESULTS_TRIGGERS:
+                cnx.execute(sql)
+    finally:
+        cnx.close()
+
+def get_key(db, sql, params=()):
+    """Return the cache key for the SQL statement with the parameters
+    on the database. Return None if the result may not be cached; the
+    database is not read-only, or the result cache is disabled.
+    """
+    if not db['readonly'] or not db.get('hashes'): return None
+    if not flask.current_app.config['RESULT_CACHE_SIZE']: return None
+    key = hashlib.sha256()
+    key.update(json.dumps(db['hashes'], sort_keys=True).encode('utf-8'))
+    key.update(normalized(sql).encode('utf-8'))
+    key.update(json.dumps(list(params)).encode('utf-8'))
+    return key.hexdigest()
+
+def normalized(sql):
+    """Return the SQL statement with whitespace collapsed and stripped,
+    except in string literals and quoted identifiers.
+    """
+    parts = QUOTED_RX.split(sql)
+    for pos in range(0, len(parts), 2):
+        parts[pos] = WHITESPACE_RX.sub(' ', parts[pos])
+    return ''.join(parts).strip().rstrip(';').strip()
+
+def get(key):
+    """Return the columns and rows for the key, or None if not in the cache.
+    The time the result was last used is updated only if it is older than
+    an interval, to avoid a write for every hit on a popular result.
+    """
+    cnx = dbshare.pool.acquire(_path(), write=True)
+    try:
+        row = cnx.execute("SELECT value, used FROM results WHERE key=?",
+                          (key,)).fetchone()
+        if row is None: return None
+        now = time.time()
+        if now - row[1] > USED_UPDATE_INTERVAL:
+            with cnx:
+                cnx.execute("UPDATE results SET used=? WHERE key=?",
+                            (now, key))
+    except sqlite3.Error:
+        return None
+    finally:
+        dbshare.pool.release(cnx)
+    return json.loads(zlib.decompress(row[0]).decode('utf-8'))
+
+def put(key, columns, rows):
+    """Store the columns and rows for the key in the cache, unless
+    the rows contain values that cannot be stored as JSON.
+    Evict the least recently used results to keep within the total size,
+    in the order of the index on the time last used.
+    """
+    try:
+        value = json.dumps([columns, rows], ensure_ascii=False)
+    except (TypeError, ValueError):     # E.g. BLOB values.
+        return
+    value = zlib.compress(value.encode('utf-8'))
+    maxsize = flask.current_app.config['RESULT_CACHE_SIZE']
+    if len(value) > maxsize: return
+    cnx = dbshare.pool.acquire(_path(), write=True)
+    try:
+        with cnx:
+            # Delete any previous entry explicitly, to fire the trigger.
+            cnx.execute("DELETE FROM results WHERE key=?", (key,))
+            cnx.execute("INSERT INTO results (key, value, size, used)"
+                        " VALUES (?, ?, ?, ?)",
+                        (key, value, len(value), time.time()))
+            total = cnx.execute("SELECT value FROM meta"
+                                " WHERE key='total'").fetchone()[0]
+            while total > maxsize:
+                rows = cnx.execute("SELECT key, size FROM results"
+                                   " WHERE key!=? ORDER BY used LIMIT ?",
+                                   (key, EVICT_BATCH_SIZE)).fetchall()
+                if not rows: break
+                evicted = []
+                for evict, size in rows:
+                    evicted.append((evict,))
+                    total -= size
+                    if total <= maxsize: break
+                cnx.executemany("DELETE FROM results WHERE key=?", evicted)
+    except sqlite3.Error:
+        pass
+    finally:
+        dbshare.pool.release(cnx)
+
+def clear():
+    "Remove all results from the cache."
+    cnx = dbshare.pool.acquire(_path(), write=True)
+    try:
+        with cnx:
+            cnx.execute("DELETE FROM results")
+    finally:
+        dbshare.pool.release(cnx)
+
+def fetch(db, sql, params=(), stream=False, deadline=None):
+    """Return the column names and the rows for the SQL statement with
+    the parameters on the database, and the cache key, which is None
+    if the result may not be cached.
+    The result is taken from the cache, if there. Otherwise the statement
+    is executed, and the result is stored in the cache unless it has
+    more rows than allowed. In that case the rows are an iterator
+    over the cursor, else they are a list.
+    If the result may not be cached and 'stream' is true, the rows
+    are the cursor, to be iterated over by the caller.
+    The optional 'deadline' is passed on to 'utils.execute_timeout'.
+    Raises SystemError if interrupted by timeout.
+    """
+    key = get_key(db, sql, params)
+    if key:
+        result = get(key)
+        if result is not None:
+            return result[0], result[1], key
+    dbcnx = dbshare.db.get_cnx(db['name'])
+    cursor = dbcnx.cursor()
+    if key is None:
+        if stream:
+            utils.execute_timeout(dbcnx, lambda cnx: cursor.execute(sql, params),
+                                  deadline=deadline)
+            rows = cursor
+        else:
+            rows = utils.execute_timeout(
+                dbcnx, lambda cnx: cursor.execute(sql, params).fetchall(),
+                deadline=deadline)
+        return [d[0] for d in cursor.description], rows, key
+    maxnrows = flask.current_app.config['RESULT_CACHE_MAX_NROWS']
+    rows = utils.execute_timeout(
+        dbcnx,
+        lambda cnx: cursor.execute(sql, params).fetchmany(maxnrows + 1),
+        deadline=deadline)
+    columns = [d[0] for d in cursor.description]
+    if len(rows) > maxnrows:
+        return columns, itertools.chain(rows, cursor), key
+    put(key, columns, rows)
+    return columns, rows, key
+
+def get_etag(db, variant, key=None):
+    """Return the ETag for the variant of a representation of data from
+    the database. If the key of a cached result is given, it is used.
+    Otherwise the ETag is derived from the content hashes of a read-only
+    database, else from its modification timestamp, and from the current
+    user, the CSRF token and the software version, which the representation
+    may depend on.
+    """
+    if key is None:
+        if db['readonly'] and db.get('hashes'):
+            basis = json.dumps(db['hashes'], sort_keys=True)
+        else:
+            basis = db['modified']
+        if flask.g.current_user:
+            username = flask.g.current_user['username']
+        else:
+            username = ''
+        key = hashlib.sha256()
+        token = flask.session.get('_csrf_token', '')
+        key.update(f"{basis} {username} {token} {dbshare.__version__}"
+                   .encode('utf-8'))
+        key = key.hexdigest()
+    return f"{key}-{variant}"
+
+def get_last_modified(db):
+    "Return the modification timestamp of the database as a datetime."
+    return datetime.datetime.strptime(db['modified'], '%Y-%m-%dT%H:%M:%S.%fZ')
+
+def not_modified(db, variant, key=None):
+    """Return a '304 Not Modified' response if the GET request has a header
+    If-None-Match containing the ETag, or else a header If-Modified-Since
+    not older than the modification of the database, except for HTML.
+    Otherwise None.
+    No check is done if there are flashed messages waiting to be shown.
+    """
+    if flask.request.method not in ('GET', 'HEAD'): return None
+    if '_flashes' in flask.session: return None
+    if flask.request.if_none_match:
+        if not flask.request.if_none_match.contains_weak(
+                get_etag(db, variant, key=key)):
+            return None
+    elif flask.request.if_modified_since and key is None and \
+         variant != 'html':
+        modified = get_last_modified(db).replace(microsecond=0)
+        if modified > flask.request.if_modified_since.replace(tzinfo=None):
+            return None
+    else:
+        return None
+    return set_headers(flask.Response(status=304), db, variant, key=key)
+
+def set_headers(response, db, variant, key=None):
+    """Set the headers ETag, Last-Modified, Cache-Control and Vary in the
+    response. The ETag is weak since the representation contains the time
+    of the request. Clients must revalidate the response, since a read-only
+    database may be set to read-write, unless the URL contains the content
+    hash of the read-only database in the query parameter 'hash', in which
+    case it is immutable. Shared caches may store the response only if
+    the database is public, and never an HTML page.
+    An HTML page showing flashed messages is not to be cached.
+    """
+    if variant == 'html' and flask.get_flashed_messages(): return response
+    response.set_etag(get_etag(db, variant, key=key), weak=True)
+    if key is None and variant != 'html':
+        response.last_modified = get_last_modified(db)
+    if variant == 'html':
+        response.headers['Cache-Control'] = 'private, no-cache'
+    elif is_hash_url(db):
+        response.headers['Cache-Control'] = "%s, max-age=%s, immutable" % \
+            (db['public'] and 'public' or 'private',
+             flask.current_app.config['RESULT_CACHE_MAX_AGE'])
+    else:
+        response.headers['Cache-Control'] = "%s, no-cache" % \
+            (db['public'] and 'public' or 'private')
+    response.vary.update(('Accept', 'Cookie', 'x-apikey'))
+    return response
+
+def is_hash_url(db):
+    """Does the URL of the request contain, in the query parameter 'hash',
+    one of the content hashes of the read-only database?
+    """
+    if not (db['readonly'] and db.get('hashes')): return False
+    return flask.request.args.get('hash') in db['hashes'].values()
+
+def _path():
+    "Return the file path of the result cache."
+    return utils.dbpath(constants.RESULT_CACHE)
@@ -10,6 +10,7 @@ import flask
 import jinja2
 import jsonschema
 
+import dbshare.cache
 import dbshare.db
 import dbshare.schema.chart
 
@@ -88,18 +89,24 @@ def display(dbname, chartname):
     except KeyError:
         utils.flash_error('no such table or view')
         return flask.redirect(flask.url_for('db.display', dbname=dbname))
+    representation = utils.get_representation(chartname)
+    response = dbshare.cache.not_modified(db, representation)
+    if response: return response
 
-    if chartname.ext == 'json' or utils.accept_json():
-        return flask.jsonify(chart['spec'])
+    if representation == 'json':
+        response = flask.jsonify(chart['spec'])
+        return dbshare.cache.set_headers(response, db, representation)
 
-    elif chartname.ext in (None, 'html'):
+    elif representation == 'html':
         url = flask.url_for('.display', dbname=dbname, chartname=chartname)
-        return flask.render_template('chart/display.html',
-                                     db=db,
-                                     schema=schema,
-                                     chart=chart,
-                                     has_write_access=dbshare.db.has_write_access(db),
-                                     json_url=url + '.json')
+        response = flask.make_response(
+            flask.render_template('chart/display.html',
+                                  db=db,
+                                  schema=schema,
+                                  chart=chart,
+                                  has_write_access=dbshare.db.has_write_access(db),
+                                  json_url=url + '.json'))
+        return dbshare.cache.set_headers(response, db, representation)
 
 @blueprint.route('/<name:dbname>/<name:chartname>/edit',
                  methods=['GET', 'POST', 'DELETE'])
@@ -13,12 +13,20 @@ from . import constants
 DEFAULT_SETTINGS = dict(
     SERVER_NAME = '127.0.0.1:5000',
     DATABASES_DIRPATH = 'data',
+    EXPORTS_DIRPATH = None,     # Default: subdirectory of DATABASES_DIRPATH
     SITE_NAME = 'DbShare',
     SITE_STATIC_DIRPATH = None,
     SITE_ICON = None,           # Filename, must be in 'SITE_STATIC_DIRPATH'
     SITE_LOGO = None,           # Filename, must be in 'SITE_STATIC_DIRPATH'
     SITE_CHART_TEMPLATES_DIRPATH = None,
     LOG_ACCESS = False,
+    LOG_ACCESS_BATCH_SIZE = 1000, # Max entries written in one transaction
+    LOG_ACCESS_INTERVAL = 1.0,  # Max seconds an entry waits to be written
+    LOG_ACCESS_QUEUE_SIZE = 10**5, # Entries beyond this are dropped
+    LOG_ACCESS_TIMINGS = False, # Log the Sqlite3, render and JSON times
+    LOG_ACCESS_ROLLUP_INTERVAL = 300.0, # Seconds between rollups of entries
+    LOG_ACCESS_RETENTION = 30,  # Days that log entries are kept
+    LOG_ACCESS_HOURLY_RETENTION = 90, # Days that hourly rollups are kept
     HOST_LOGO = None,           # Filename, must be in 'SITE_STATIC_DIRPATH'
     HOST_NAME = None,
     HOST_URL = None,
@@ -33,24 +41,49 @@ DEFAULT_SETTINGS = dict(
     USER_DEFAULT_QUOTA = 2**27,       # 134 megabytes
     TABLE_INITIAL_COLUMNS = 8,
     MAX_NROWS_DISPLAY = 2000,
+    STREAM_CHUNK_ROWS = 1000,   # Rows per chunk in streamed CSV and JSON
+    LOAD_BATCH_SIZE = 10000,    # Records per batch when loading a table
+    LOAD_SAMPLE_SIZE = None,    # Records to infer column types from; all if None
+    EXPORT_CHUNK_SIZE = 2**16,  # Bytes per chunk in streamed export files
+    EXPORT_SPOOL_SIZE = 2**22,  # Max in-memory size of a CSV file in a tar
+    STATISTICS_EXACT_MAX_NROWS = 10**6, # Larger tables are sampled by default
+    STATISTICS_SAMPLE_SIZE = 10**5,     # Approximate number of rows sampled
     CONTENT_HASHES = ['md5', 'sha1'],
+    CONTENT_HASH_CHUNK_SIZE = 2**24, # Bytes per update of a content hash
+    LOOKUP_MAX_HASHES = 10000,  # Hashes per content hash lookup request
+    POOL_MAX_IDLE = 4,          # Idle connections per database and mode
+    POOL_IDLE_TIMEOUT = 300.0,  # Seconds before an idle connection is closed
+    POOL_CHECKPOINT_TIMEOUT = 5.0, # Seconds to retry checkpoint of busy db
+    SQLITE_JOURNAL_MODE = 'WAL', # For read-write connections
+    SQLITE_CACHE_SIZE = -8192,  # Page cache; negative value means KiB
+    SQLITE_MMAP_SIZE = 2**26,   # Bytes of database file memory-mapped
+    METADATA_CACHE_SIZE = 256,  # Number of databases
+    USAGE_RECONCILE_INTERVAL = 3600.0, # Seconds between checks of sizes
+    VIEW_COUNTS_CACHE_SIZE = 4096, # Number of view row counts
+    VIEW_COUNTS_WORKERS = 4,    # Threads counting rows of views concurrently
+    VIEW_COUNTS_TIMEOUT = 2.0,  # Seconds; total for counting rows per request
+    JOB_WORKERS = 2,            # Threads per process executing background jobs
+    JOB_MAX_PER_USER = 4,       # Jobs queued or running per user
+    JOB_RETENTION = 7,          # Days that records of done jobs are kept
+    METRICS_REMOTE_ADDRS = ['127.0.0.1'], # May get metrics without login
+    METRICS_WRITE_INTERVAL = 10.0, # Seconds between writes of histograms
+    RESULT_CACHE_SIZE = 2**28,  # Bytes of compressed results; 0 disables
+    RESULT_CACHE_MAX_NROWS = 10**5, # Results with more rows are not cached
+    RESULT_CACHE_MAX_AGE = 365 * 24 * 60 * 60, # in seconds; 1 year
+    SLOW_QUERY_THRESHOLD = 1.0, # Seconds; slower statements logged. None disables
+    SLOW_QUERY_RETENTION = 30,  # Days that slow-query log entries are kept
+    ADVISOR_MIN_COUNT = 3,      # Observations before an index is recommended
+    ADVISOR_AUTOINDEX_MIN_COUNT = 10, # Observations before auto-creation
+    ADVISOR_AUTOINDEX_MIN_SPEEDUP = 2.0, # Replay speedup for auto-creation
+    ADVISOR_REPLAY_RUNS = 3,    # Best time of this many runs is used
     QUERY_DEFAULT_LIMIT = 200,
     DOCS_DIRPATH = os.path.join(constants.ROOT_DIRPATH, 'docs'),
     CHART_TEMPLATES_DIRPATH = os.path.join(constants.ROOT_DIRPATH,
                                            'chart_templates'),
-    # Suggested values for timeout, increment and backoff.
-    # t=2.0, i=0.010, b=1.75
-    #        i=0.014, b=1.55
-    #        i=0.022, b=1.55
-    # t=3.0, i=0.012, b=1.50
-    #        i=0.014, b=1.95
-    #        i=0.022, b=1.80
-    # t=4.0, i=0.010, b=1.45
-    #        i=0.014, b=1.70
-    #        i=0.020, b=1.75
-    EXECUTE_TIMEOUT           = 2.0,
-    EXECUTE_TIMEOUT_INCREMENT = 0.010,
-    EXECUTE_TIMEOUT_BACKOFF   = 1.75,
+    EXECUTE_TIMEOUT = 2.0,      # Seconds per Sqlite3 command
+    EXECUTE_TIMEOUT_ENDPOINTS = {}, # Endpoint name: seconds
+    EXECUTE_TIMEOUT_USERS = {},     # Username: seconds
+    EXECUTE_TIMEOUT_PROGRESS_STEPS = 1000, # Sqlite3 VM steps between checks
     CHART_DEFAULT_WIDTH = 400,
     CHART_DEFAULT_HEIGHT = 400,
     COLUMN_ANNOTATIONS = ['quantitative', 'temporal', 
@@ -89,9 +122,49 @@ def init(app):
             else:
                 app.config['SETTINGS_FILEPATH'] = filepath
                 break
+    # 'UPDATE ... FROM' requires Sqlite3 3.33; upserts, window functions
+    # and aggregate FILTER clauses are also used.
+    assert sqlite3.sqlite_version_info >= (3, 33, 0), \
+        f"Sqlite3 3.33.0 or later required; is {sqlite3.sqlite_version}"
     assert app.config['SECRET_KEY']
     assert app.config['SALT_LENGTH'] > 6
     assert app.config['MIN_PASSWORD_LENGTH'] > 4
     assert app.config['EXECUTE_TIMEOUT'] > 0.0
-    assert app.config['EXECUTE_TIMEOUT_INCREMENT'] > 0.0
-    assert app.config['EXECUTE_TIMEOUT_BACKOFF'] > 1.0
+    assert all(t > 0.0 for t in app.config['EXECUTE_TIMEOUT_ENDPOINTS'].values())
+    assert all(t > 0.0 for t in app.config['EXECUTE_TIMEOUT_USERS'].values())
+    assert app.config['EXECUTE_TIMEOUT_PROGRESS_STEPS'] > 0
+    assert app.config['STREAM_CHUNK_ROWS'] > 0
+    assert app.config['LOAD_BATCH_SIZE'] > 0
+    assert app.config['LOAD_SAMPLE_SIZE'] is None or \
+           app.config['LOAD_SAMPLE_SIZE'] > 0
+    assert app.config['LOG_ACCESS_BATCH_SIZE'] > 0
+    assert app.config['LOG_ACCESS_INTERVAL'] > 0.0
+    assert app.config['LOG_ACCESS_QUEUE_SIZE'] > 0
+    assert app.config['LOG_ACCESS_ROLLUP_INTERVAL'] > 0.0
+    assert app.config['LOG_ACCESS_RETENTION'] > 0
+    assert app.config['LOG_ACCESS_HOURLY_RETENTION'] > 0
+    assert app.config['POOL_MAX_IDLE'] >= 0
+    assert app.config['POOL_IDLE_TIMEOUT'] > 0.0
+    assert app.config['POOL_CHECKPOINT_TIMEOUT'] >= 0.0
+    assert app.config['METADATA_CACHE_SIZE'] > 0
+    assert app.config['CONTENT_HASH_CHUNK_SIZE'] > 0
+    assert app.config['LOOKUP_MAX_HASHES'] > 0
+    assert app.config['USAGE_RECONCILE_INTERVAL'] > 0.0
+    assert app.config['VIEW_COUNTS_CACHE_SIZE'] > 0
+    assert app.config['VIEW_COUNTS_WORKERS'] > 0
+    assert app.config['VIEW_COUNTS_TIMEOUT'] > 0.0
+    assert app.config['JOB_WORKERS'] > 0
+    assert app.config['JOB_MAX_PER_USER'] > 0
+    assert app.config['JOB_RETENTION'] > 0
+    assert app.config['METRICS_WRITE_INTERVAL'] >= 0.0
+    assert app.config['RESULT_CACHE_SIZE'] >= 0
+    assert app.config['RESULT_CACHE_MAX_NROWS'] > 0
+    assert app.config['RESULT_CACHE_MAX_AGE'] > 0
+    assert app.config['SLOW_QUERY_THRESHOLD'] is None or \
+        app.config['SLOW_QUERY_THRESHOLD'] >= 0.0
+    assert app.config['SLOW_QUERY_RETENTION'] > 0
+    assert app.config['ADVISOR_MIN_COUNT'] > 0
+    assert app.config['ADVISOR_AUTOINDEX_MIN_COUNT'] > 0
+    assert app.config['ADVISOR_AUTOINDEX_MIN_SPEEDUP'] > 1.0
+    assert app.config['ADVISOR_REPLAY_RUNS'] > 0
+    assert app.config['STATISTICS_SAMPLE_SIZE'] > 0
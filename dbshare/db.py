@@ -1,11 +1,14 @@
 "Database HTML endpoints."
 
+import bz2
+import concurrent.futures
 import copy
-import csv
+import datetime
 import hashlib
-import io
+import http.client
 import itertools
 import json
+import mmap
 import os
 import os.path
 import re
@@ -14,12 +17,19 @@ import sqlite3
 import stat
 import tarfile
 import tempfile
+import threading
+import time
 import urllib.parse
+import zlib
 
 import dpath
 import flask
 import openpyxl
 
+import dbshare.cache
+import dbshare.infer
+import dbshare.jobs
+import dbshare.pool
 import dbshare.system
 import dbshare.schema.table
 import dbshare.table
@@ -54,6 +64,38 @@ CHARTS_TABLE = {
                 dict(name='spec', type=constants.TEXT, notnull=True)]
 }
 
+# The row counts of the tables, maintained by triggers, except for bulk
+# writes which suspend them and update the count once. The version is
+# changed by every modification of the table.
+COUNTS_TABLE = {
+    'name': constants.COUNTS,
+    'columns': [dict(name='name', type=constants.TEXT, primarykey=True),
+                dict(name='nrows', type=constants.INTEGER, notnull=True),
+                dict(name='version', type=constants.INTEGER, notnull=True)]
+}
+
+
+# The file types for export of all tables and views of a database.
+EXPORT_MIMETYPES = {'tar': constants.TAR_MIMETYPE,
+                    'tar.gz': constants.TAR_MIMETYPE,
+                    'tar.bz2': constants.TAR_MIMETYPE,
+                    'xlsx': constants.XLSX_MIMETYPE}
+
+# A background export that has not written anything for this number
+# of seconds is assumed to have died.
+EXPORT_STALE_TIMEOUT = 600
+
+# Global instance of the cache of database metadata; size set in 'init'.
+METADATA_CACHE = utils.LruCache()
+
+# Global instance of the cache of view row counts, keyed by the versions
+# of the underlying tables; size set in 'init'.
+VIEW_COUNTS_CACHE = utils.LruCache()
+
+# The thread pool for counting rows concurrently, per process id.
+_counters = {}
+_counters_lock = threading.Lock()
+
 
 blueprint = flask.Blueprint('db', __name__)
 
@@ -66,63 +108,31 @@ def display(dbname):
         utils.flash_error(error)
         return flask.redirect(flask.url_for('home'))
 
-    if dbname.ext in ('tar', 'tar.gz', 'tar.bz2'):
-        try:
-            mode = 'w:' + dbname.ext.split('.')[1]
-        except IndexError:
-            mode = 'w'
-        outfile = io.BytesIO()
-        tar = tarfile.open(fileobj=outfile, mode=mode)
-        schemas = list(db['tables'].values()) + list(db['views'].values())
-        for schema in schemas:
-            columns = [c['name'] for c in schema['columns']]
-            sql = 'SELECT %s FROM "%s"' % \
-                  (','.join([f'"{c}"' for c in columns]), schema['name'])
-            writer = utils.CsvWriter(header=columns)
-            try:
-                cursor = utils.execute_timeout(get_cnx(db['name']), sql)
-            except SystemError:
-                pass
-            else:
-                writer.write_rows(cursor)
-                data = writer.getvalue().encode('utf-8')
-                tarinfo = tarfile.TarInfo(name=f"{dbname}/{schema['name']}.csv")
-                tarinfo.size = len(data)
-                tar.addfile(tarinfo, io.BytesIO(data))
-        tar.close()
-        response = flask.make_response(outfile.getvalue())
-        response.headers.set('Content-Type', constants.TAR_MIMETYPE)
-        response.headers.set('Content-Disposition', 'attachment', 
-                             filename=f"{dbname}.{dbname.ext}")
-        return response
-
-    elif dbname.ext == 'xlsx':
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        tables = list(db['tables'].values())
-        if tables:
-            ws.title = tables[0]['name']
-            for table in tables[1:]:
-                ws = wb.create_sheet(title=table['name'])
-        for table in tables:
-            ws = wb[table['name']]
-            columns = [c['name'] for c in table['columns']]
-            ws.append(columns)
-            sql = 'SELECT %s FROM "%s"' % \
-                  (','.join([f'"{c}"' for c in columns]), table['name'])
+    if dbname.ext in EXPORT_MIMETYPES:
+        if utils.to_bool(flask.request.args.get('background')):
+            filename = f"{dbname}.{dbname.ext}"
             try:
-                cursor = utils.execute_timeout(get_cnx(db['name']), sql)
-            except SystemError:
-                pass
-            else:
-                for row in cursor:
-                    ws.append(list(row))
-        with tempfile.NamedTemporaryFile(suffix='.xlsx') as tmp:
-            wb.save(tmp.name)
-            tmp.seek(0)
-            content = tmp.read()
-        response = flask.make_response(content)
-        response.headers.set('Content-Type', constants.XLSX_MIMETYPE)
+                job = start_export(db, dbname.ext)
+            except ValueError as error:
+                utils.abort_json(http.client.TOO_MANY_REQUESTS, error)
+            response = flask.make_response('', http.client.ACCEPTED)
+            response.headers.set('Location',
+                                 utils.url_for('.export',
+                                               dbname=db['name'],
+                                               filename=filename))
+            if job:
+                url = utils.url_for('api_jobs.job', iuid=job['iuid'])
+                response.headers.set('Link', f'<{url}>; rel="monitor"')
+            return response
+        if dbname.ext == 'xlsx':
+            outfile = tempfile.TemporaryFile()
+            write_xlsx(db, outfile)
+            outfile.seek(0)
+            chunks = get_file_chunks(outfile)
+        else:
+            chunks = get_tar_chunks(db, dbname.ext)
+        response = flask.Response(flask.stream_with_context(chunks),
+                                  mimetype=EXPORT_MIMETYPES[dbname.ext])
         response.headers.set('Content-Disposition', 'attachment', 
                              filename=f"{dbname}.{dbname.ext}")
         return response
@@ -133,17 +143,57 @@ def display(dbname):
         for view in db['views'].values(): charts[view['name']] = []
         for chart in db['charts'].values():
             charts[chart['source']].append(chart)
+        can_change_mode = has_write_access(db, check_mode=False)
+        if can_change_mode:
+            jobs = dbshare.jobs.get_jobs(dbname=db['name'], limit=5)
+        else:
+            jobs = []
         return flask.render_template(
             'db/display.html', 
             db=db,
             charts=charts,
+            jobs=jobs,
             title=db.get('title') or "Database {}".format(dbname),
             has_write_access=has_write_access(db),
-            can_change_mode=has_write_access(db, check_mode=False))
+            can_change_mode=can_change_mode)
 
     else:
         flask.abort(http.client.NOT_ACCEPTABLE)
 
+@blueprint.route('/<name:dbname>/export/<filename>')
+def export(dbname, filename):
+    """Return the file produced by a background export of the database.
+    Status 202 Accepted if the export is still in progress.
+    An export older than the latest modification of the database is
+    out of date; it is deleted.
+    """
+    try:
+        db = get_check_read(dbname)
+    except (KeyError, ValueError) as error:
+        utils.flash_error(error)
+        return flask.redirect(flask.url_for('home'))
+    # A database name cannot contain a dot, but an extension may.
+    name, dot, ext = filename.partition('.')
+    if not dot or name != db['name'] or ext not in EXPORT_MIMETYPES:
+        flask.abort(http.client.NOT_FOUND)
+    filepath = utils.exportpath(filename)
+    if os.path.exists(filepath) and not is_export_current(db, filepath):
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+    if os.path.exists(filepath):
+        return flask.send_file(filepath,
+                               mimetype=EXPORT_MIMETYPES[ext],
+                               as_attachment=True,
+                               attachment_filename=filename)
+    elif is_export_running(filepath):
+        response = flask.make_response('', http.client.ACCEPTED)
+        response.headers.set('Retry-After', 10)
+        return response
+    else:
+        flask.abort(http.client.NOT_FOUND)
+
 @blueprint.route('/', methods=['GET', 'POST'])
 @utils.login_required
 def create():
@@ -197,7 +247,7 @@ def edit(dbname):
                     ctx.set_description(flask.request.form['description'])
                 except KeyError:
                     pass
-        except (KeyError, ValueError) as error:
+        except (KeyError, ValueError, SystemError) as error:
             utils.flash_error(error)
         return flask.redirect(flask.url_for('.display', dbname=db['name']))
 
@@ -244,7 +294,6 @@ def upload(dbname):
     elif utils.http_POST():
         try:
             csvfile = flask.request.files['csvfile']
-            infile = io.StringIO(csvfile.read().decode('utf-8'))
             delimiter = flask.request.form.get('delimiter') or 'comma'
             try:
                 delimiter = flask.current_app.config['CSV_FILE_DELIMITERS'][delimiter]['char']
@@ -259,27 +308,23 @@ def upload(dbname):
             tablename = utils.name_cleaned(tablename)
             if utils.name_in_nocase(tablename, db['tables']):
                 raise ValueError('table name already in use')
-            # Read the file; eliminate empty records.
-            records = [r for r in csv.reader(infile, delimiter=delimiter) if r]
-            if not records:
-                raise ValueError('empty CSV file')
-            # Change empty string items to None.
-            for record in records:
-                for i, item in enumerate(record):
-                    if item == '':
-                        record[i] = None
+            # The file is read in a streaming fashion, twice, by a job;
+            # it must outlive the request.
+            infile = tempfile.TemporaryFile()
+            shutil.copyfileobj(csvfile.stream, infile)
             has_header = utils.to_bool(flask.request.form.get('header'))
-            with DbContext(db) as ctx:
-                ctx.create_table_load_records(tablename,
-                                              records,
-                                              has_header=has_header)
-            utils.flash_message(f"Loaded {len(records)} records.")
+            try:
+                start_load_csv(db, tablename, infile, delimiter, has_header)
+            except ValueError:
+                infile.close()
+                raise
+            utils.flash_message(f"Loading table {tablename}"
+                                " as a background job.")
         except (ValueError, IndexError, sqlite3.Error) as error:
             utils.flash_error(error)
             return flask.redirect(
                 flask.url_for('.upload', dbname=dbname, tablename=tablename))
-        return flask.redirect(
-            flask.url_for('table.rows', dbname=dbname, tablename=tablename))
+        return flask.redirect(flask.url_for('.display', dbname=dbname))
 
 @blueprint.route('/<name:dbname>/clone', methods=['GET', 'POST'])
 @utils.login_required
@@ -305,6 +350,7 @@ def clone(dbname):
         except (KeyError, ValueError) as error:
             utils.flash_error(error)
             return flask.redirect(flask.url_for('.clone', dbname=dbname))
+        dbshare.pool.checkpoint(utils.dbpath(dbname))
         shutil.copyfile(utils.dbpath(dbname), utils.dbpath(ctx.db['name']))
         db = get_db(name, complete=True)
         with DbContext(db) as ctx:
@@ -320,6 +366,8 @@ def download(dbname):
     except (KeyError, ValueError) as error:
         utils.flash_error(error)
         return flask.redirect(flask.url_for('home'))
+    if not db['readonly']:
+        dbshare.pool.checkpoint(utils.dbpath(dbname))
     return flask.send_file(utils.dbpath(dbname),
                            mimetype=constants.SQLITE3_MIMETYPE,
                            as_attachment=True)
@@ -335,14 +383,11 @@ def vacuum(dbname):
         utils.flash_error(error)
         return flask.redirect(flask.url_for('home'))
     try:
-        with DbContext(db) as cnx:
-            for schema in db['tables'].values():
-                cnx.update_table(schema)
-        dbcnx = get_cnx(db['name'], write=True)
-        sql = 'VACUUM'
-        dbcnx.execute(sql)
-    except sqlite3.Error as error:
+        start_vacuum(db)
+    except ValueError as error:
         utils.flash_error(error)
+    else:
+        utils.flash_message('VACUUM started as a background job.')
     return flask.redirect(flask.url_for('.display', dbname=db['name']))
 
 @blueprint.route('/<name:dbname>/analyze', methods=['POST'])
@@ -356,11 +401,11 @@ def analyze(dbname):
         utils.flash_error(error)
         return flask.redirect(flask.url_for('home'))
     try:
-        dbcnx = get_cnx(db['name'], write=True)
-        sql = 'ANALYZE'
-        dbcnx.execute(sql)
-    except sqlite3.Error as error:
+        start_analyze(db)
+    except ValueError as error:
         utils.flash_error(error)
+    else:
+        utils.flash_message('ANALYZE started as a background job.')
     return flask.redirect(flask.url_for('.display', dbname=db['name']))
 
 @blueprint.route('/<name:dbname>/public', methods=['POST'])
@@ -435,12 +480,34 @@ def readonly(dbname):
         try:
             with DbContext(db) as ctx:
                 ctx.set_readonly(True)
-        except (KeyError, ValueError) as error:
+        except (KeyError, ValueError, SystemError) as error:
             utils.flash_error(error)
         else:
             utils.flash_message('Database set to read-only mode.')
     return flask.redirect(flask.url_for('.display', dbname=db['name']))
 
+@blueprint.route('/<name:dbname>/verify', methods=['POST'])
+@utils.admin_required
+def verify(dbname):
+    "Recompute the content hashes of the database and compare them."
+    utils.check_csrf_token()
+    db = get_db(dbname)
+    if db is None:
+        utils.flash_error('no such database')
+        return flask.redirect(flask.url_for('home'))
+    try:
+        verified = verify_hashes(db)
+    except ValueError as error:
+        utils.flash_error(error)
+    else:
+        mismatch = [hashname for hashname, (recorded, computed)
+                    in sorted(verified.items()) if recorded != computed]
+        if mismatch:
+            utils.flash_error('content hashes differ: ' + ', '.join(mismatch))
+        else:
+            utils.flash_message('Content hashes verified.')
+    return flask.redirect(flask.url_for('.display', dbname=dbname))
+
 
 class DbContext:
     "Context handler to create, modify and save metadata for a database."
@@ -450,12 +517,14 @@ class DbContext:
             self.db = {'owner':    flask.g.current_user['username'],
                        'public':   False,
                        'readonly': False,
+                       'autoindex': False,
                        'hashes':   {},
                        'created':  utils.get_time()}
             self.old = {}
         else:
             self.db = db
             self.old = copy.deepcopy(db)
+        self.vacuum = False
 
     @property
     def cnx(self):
@@ -479,7 +548,11 @@ class DbContext:
         return self
 
     def __exit__(self, etyp, einst, etb):
-        if etyp is not None: return False
+        if etyp is not None:
+            # Metadata in the database file may have been changed.
+            if self.db.get('name'):
+                METADATA_CACHE.pop(self.db['name'])
+            return False
         for key in ['name', 'owner']:
             if not self.db.get(key):
                 raise ValueError(f"invalid db: {key} not set")
@@ -487,9 +560,10 @@ class DbContext:
         with self.cnx:
             # Update the existing database entry in system.
             if self.old:
+                size = os.path.getsize(utils.dbpath(self.db['name']))
                 sql = "UPDATE dbs SET name=?, owner=?, title=?," \
-                    "description=?, public=?, readonly=?, modified=?" \
-                    " WHERE name=?"
+                    "description=?, public=?, readonly=?, modified=?," \
+                    " autoindex=?, size=? WHERE name=?"
                 self.cnx.execute(sql, (self.db['name'],
                                        self.db['owner'],
                                        self.db.get('title'),
@@ -497,12 +571,16 @@ class DbContext:
                                        bool(self.db['public']),
                                        bool(self.db['readonly']),
                                        self.db['modified'],
+                                       bool(self.db.get('autoindex')),
+                                       size,
                                        self.old['name']))
                 # The Sqlite3 database file was renamed in 'set_name'.
                 if self.old.get('name') != self.db['name']:
-                    # Fix entries in log records.
+                    # Fix entries in log records and index advice.
                     sql = "UPDATE dbs_logs SET name=? WHERE name=?"
                     self.cnx.execute(sql, (self.db['name'], self.old['name']))
+                    sql = "UPDATE index_advice SET dbname=? WHERE dbname=?"
+                    self.cnx.execute(sql, (self.db['name'], self.old['name']))
                     # No need to fix hash values: is (or at least, was)
                     # in read/write mode, so db has no hash values.
                 # Insert hash values if newly computed.
@@ -522,10 +600,12 @@ class DbContext:
             else:
                 # This actually creates the database file.
                 self.dbcnx
+                size = os.path.getsize(utils.dbpath(self.db['name']))
                 # Create the database entry in system.
                 sql = "INSERT INTO dbs" \
                       " (name, owner, title, description, public, readonly," \
-                      "  created, modified) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                      "  created, modified, autoindex, size)" \
+                      " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
                 self.cnx.execute(sql, (self.db['name'],
                                        self.db['owner'],
                                        self.db.get('title'),
@@ -533,17 +613,17 @@ class DbContext:
                                        bool(self.db['public']),
                                        bool(self.db['readonly']),
                                        self.db['created'], 
-                                       self.db['modified']))
+                                       self.db['modified'],
+                                       bool(self.db.get('autoindex')),
+                                       size))
             # Add log entry
             new = {}
             for key, value in self.db.items():
                 if value != self.old.get(key):
                     new[key] = value
             new.pop('modified')
-            try:
-                editor = flask.g.current_user['username']
-            except AttributeError:
-                editor = None
+            user = flask.g.get('current_user')
+            editor = user and user['username']
             if flask.has_request_context():
                 remote_addr = str(flask.request.remote_addr)
                 user_agent = str(flask.request.user_agent)
@@ -559,17 +639,27 @@ class DbContext:
                                    remote_addr,
                                    user_agent,
                                    utils.get_time()))
+        self.db['size'] = size
+        METADATA_CACHE.pop(self.db['name'])
+        if self.old.get('name'):
+            METADATA_CACHE.pop(self.old['name'])
         # Set the OS-level file permissions.
         if self.db['readonly']:
             os.chmod(utils.dbpath(self.db['name']), stat.S_IREAD)
         else:
             os.chmod(utils.dbpath(self.db['name']), stat.S_IREAD|stat.S_IWRITE)
+        if self.vacuum and not self.db['readonly']:
+            try:
+                start_vacuum(self.db, reset=False)
+            except ValueError:  # Too many jobs; left for a later VACUUM.
+                pass
 
     def set_name(self, name, modify=False):
         """Set or change the database name.
         If 'modify' is True, then allow modifying the name to make it unique.
         Return the final name.
         Raise ValueError if name is invalid or already in use.
+        Raise SystemError if the database is busy.
         """
         assert not hasattr(self, '_dbcnx') # Must be done before any write ops.
         if name == self.db.get('name'): return
@@ -587,7 +677,20 @@ class DbContext:
         old_dbname = self.db.get('name')
         if old_dbname:
             # Rename the Sqlite3 file if the database already exists.
-            os.rename(utils.dbpath(old_dbname), utils.dbpath(name))
+            # Its connections must be closed and its WAL file emptied first.
+            release_cnx()
+            oldpath = utils.dbpath(old_dbname)
+            if not dbshare.pool.close(oldpath):
+                raise SystemError('database is in use; try again later')
+            os.rename(oldpath, utils.dbpath(name))
+            # The emptied WAL files are recreated for the new name.
+            for filepath in (oldpath + '-wal', oldpath + '-shm'):
+                try:
+                    os.remove(filepath)
+                except FileNotFoundError:
+                    pass
+            # The export files are named after the database, and contain it.
+            delete_exports(old_dbname)
             # The entries in the dbs_log will be fixed in '__exit__'
         self.db['name'] = name
         # Update of chart data URLs must be done *after* db rename.
@@ -607,25 +710,30 @@ class DbContext:
         "Set to public (True) or private (False) access."
         self.db['public'] = access
 
-    def set_readonly(self, mode):
+    def set_autoindex(self, flag):
+        "Set whether indexes recommended by the advisor are created."
+        self.db['autoindex'] = flag
+
+    def set_readonly(self, mode, hashes=True):
         """Set to 'readonly' (True) or 'readwrite' (False).
-        If 'readonly', then compute the hash values, else remove them.
+        If 'readonly', then compute the hash values, unless 'hashes' is False,
+        in which case they must be computed by 'start_hashing' after exit.
+        If 'readwrite', then remove the hash values.
+        Raise SystemError if the database is busy.
         """
         if self.db['readonly'] == mode: return
         self.db['readonly'] = self.readonly = mode
         if mode:
-            hashes = {}
-            for hashname in flask.current_app.config['CONTENT_HASHES']:
-                hashes[hashname] = hashlib.new(hashname)
-            with open(utils.dbpath(self.db['name']), 'rb') as infile:
-                data = infile.read(8192)
-                while data:
-                    for hash in hashes.values():
-                        hash.update(data)
-                    data = infile.read(8192)
-            for hashname in hashes:
-                hashes[hashname] = hashes[hashname].hexdigest()
-            self.db['hashes'] = hashes
+            # All content must be in the database file itself.
+            release_cnx()
+            try:
+                delattr(self, '_dbcnx')
+            except AttributeError:
+                pass
+            if not dbshare.pool.close(utils.dbpath(self.db['name'])):
+                raise SystemError('database is in use; try again later')
+            if hashes:
+                self.db['hashes'] = get_hashes(self.db['name'])
         else:
             self.db['hashes'] = {}
 
@@ -640,103 +748,99 @@ class DbContext:
         self.dbcnx.execute(sql)
         sql = get_sql_create_table(CHARTS_TABLE, if_not_exists=True)
         self.dbcnx.execute(sql)
+        sql = get_sql_create_table(COUNTS_TABLE, if_not_exists=True)
+        self.dbcnx.execute(sql)
 
-    def create_table_load_records(self, tablename, records, has_header=True):
+    def create_table_load_records(self, tablename, records, has_header=True,
+                                  progress=None):
         """Create and load table from records (lists of data items).
-        Infer table column types and constraints from records contents.
+        The records may be any iterable which can be iterated over twice,
+        such as a list or a 'utils.CsvRecords' instance for a file.
+        Infer table column types and constraints in a first pass over
+        the records, or a sample of the first records if LOAD_SAMPLE_SIZE
+        is set. Then insert the records in batches, in one transaction.
+        If given, 'progress' is called with the number of records inserted
+        so far after each batch.
+        Return the number of records inserted.
         Raises ValueError or sqlite3.Error if any problem.
         """
+        config = flask.current_app.config
+        records_iter = iter(records)
+        try:
+            first = next(records_iter)
+        except StopIteration:
+            raise ValueError('no records to load')
+
         # Column names from header, or make up.
         if has_header:
-            header = records.pop(0)
-            header = [utils.name_cleaned(n) for n in header]
+            header = [utils.name_cleaned(n) for n in first]
             if len(header) != len(set(header)):
                 raise ValueError('non-unique header column names')
         else:
-            header = [f"column{i+1}" for i in range(len(records[0]))]
+            header = [f"column{i+1}" for i in range(len(first))]
+            records_iter = itertools.chain([first], records_iter)
 
         # Infer column types and constraints.
-        schema = {'name': tablename}
-        schema['columns'] = [{'name': name} for name in header]
-        try:
-            for i, column in enumerate(schema['columns']):
-                type = None
-                column['notnull'] = True
-
-                # First attempt: integer
-                for n, record in enumerate(records):
-                    value = record[i]
-                    if value is None:
-                        column['notnull'] = False
-                    elif isinstance(value, int):
-                        pass
-                    elif isinstance(value, str):
-                        try:
-                            int(value)
-                        except (ValueError, TypeError):
-                            break
-                    else:
-                        break
-                else:
-                    type = constants.INTEGER
-
-                # Next attempt: float
-                if type is None:
-                    for n, record in enumerate(records):
-                        value = record[i]
-                        if value is None:
-                            column['notnull'] = False
-                        elif isinstance(value, (float, int)):
-                            pass
-                        elif isinstance(value, str):
-                            try:
-                                float(value)
-                            except (ValueError, TypeError):
-                                break
-                        else:
-                            break
-                    else:
-                        type = constants.REAL
-
-                # Default: text
-                if type is None:
-                    column['type'] = constants.TEXT
-                    if column['notnull']:
-                        for record in records:
-                            value = record[i]
-                            if value is None:
-                                column['notnull'] = False
-                                break
-                else:
-                    column['type'] = type
-        except IndexError:
-            raise ValueError(f"record {i+1} has too few items")
+        inferrer = dbshare.infer.Inferrer(len(header))
+        sample = itertools.islice(records_iter, config['LOAD_SAMPLE_SIZE'])
+        for batch in utils.batches(sample, config['LOAD_BATCH_SIZE']):
+            inferrer.update(batch)
+        schema = {'name': tablename,
+                  'columns': inferrer.get_columns(header)}
+        annotations = inferrer.get_annotations(header)
+        if annotations:
+            schema['annotations'] = annotations
 
         # Create the table.
         self.add_table(schema)
 
-        # Actually convert values in records.
-        for i, column in enumerate(schema['columns']):
-            type = column['type']
-            if type == constants.INTEGER:
-                for n, record in enumerate(records):
-                    value = record[i]
-                    if value is not None:
-                        record[i] = int(value)
-            elif type == constants.REAL:
-                for n, record in enumerate(records):
-                    value = record[i]
-                    if value is not None:
-                        record[i] = float(value)
-
-        # Insert the data.
+        # Convert and insert the records in batches, in one transaction.
+        converters = []
+        for column in schema['columns']:
+            if column['type'] == constants.INTEGER:
+                converters.append(int)
+            elif column['type'] == constants.REAL:
+                converters.append(float)
+            else:
+                converters.append(None)
         sql = 'INSERT INTO "%s" (%s) VALUES (%s)' % \
               (tablename,
                ','.join(['"%(name)s"' % c for c in schema['columns']]),
                ','.join('?' * len(schema['columns'])))
-        with self.dbcnx:
-            self.dbcnx.executemany(sql, records)
+        records = iter(records)
+        if has_header:
+            next(records)
+        count = 0
+        try:
+            with self.dbcnx:
+                self.suspend_counts(tablename)
+                for batch in utils.batches(records,config['LOAD_BATCH_SIZE']):
+                    for record in batch:
+                        count += 1
+                        try:
+                            for i, convert in enumerate(converters):
+                                if convert and isinstance(record[i], str):
+                                    record[i] = convert(record[i])
+                        except (ValueError, TypeError) as error:
+                            raise ValueError(f"record {count}, column"
+                                             f" {header[i]}: {error}")
+                        except IndexError:
+                            raise ValueError(f"record {count} has too"
+                                             " few items")
+                    self.dbcnx.executemany(sql, batch)
+                    if progress:
+                        progress(count)
+                self.resume_counts(tablename, count)
+        except (ValueError, SystemError, sqlite3.Error):
+            # Remove the partially created table.
+            with self.dbcnx:
+                self.dbcnx.execute(f'DROP TABLE "{tablename}"')
+                sql = f"DELETE FROM {constants.TABLES} WHERE name=?"
+                self.dbcnx.execute(sql, (tablename,))
+            self.db['tables'].pop(tablename)
+            raise
         self.update_table(schema)
+        return count
 
     def update_chart_data_urls(self, old_dbname):
         """When renaming or cloning the database,
@@ -873,8 +977,8 @@ class DbContext:
         2) Remove any column statistics.
         """
         if reset_cache:
-            sql = f'''SELECT COUNT(*) FROM "{schema['name']}"'''
-            schema['nrows'] = self.dbcnx.execute(sql).fetchone()[0]
+            schema['nrows'] = self.get_nrows(schema['name'])
+            schema.pop('statistics_mode', None)
             for column in schema['columns']:
                 column.pop('statistics', None)
         utils.json_validate(schema, dbshare.schema.table.create)
@@ -883,11 +987,94 @@ class DbContext:
             self.dbcnx.execute(sql, (json.dumps(schema), schema['name']))
         self.db['tables'][schema['name']] = schema
 
+    def get_nrows(self, tablename):
+        """Return the number of rows in the table from the counts meta table.
+        Set up the triggers maintaining it, if not already done.
+        """
+        sql = f"SELECT nrows FROM {constants.COUNTS} WHERE name=?"
+        try:
+            row = self.dbcnx.execute(sql, (tablename,)).fetchone()
+        except sqlite3.OperationalError: # No counts meta table yet.
+            row = None
+        if row is None:
+            return self.set_counts(tablename)
+        return row[0]
+
+    def set_counts(self, tablename):
+        """Create the triggers maintaining the row count of the table in the
+        counts meta table, and set its current row count. The version starts
+        at a random value, so that it will differ for a re-created table.
+        Return the number of rows.
+        """
+        begin = not self.dbcnx.in_transaction
+        if begin:
+            self.dbcnx.execute('BEGIN IMMEDIATE')
+        try:
+            self.dbcnx.execute(get_sql_create_table(COUNTS_TABLE,
+                                                    if_not_exists=True))
+            self.create_counts_triggers(tablename)
+            sql = f'SELECT COUNT(*) FROM "{tablename}"'
+            nrows = self.dbcnx.execute(sql).fetchone()[0]
+            sql = f"INSERT OR REPLACE INTO {constants.COUNTS}" \
+                  " (name, nrows, version) VALUES (?, ?, abs(random()))"
+            self.dbcnx.execute(sql, (tablename, nrows))
+        except sqlite3.Error:
+            if begin:
+                self.dbcnx.rollback()
+            raise
+        if begin:
+            self.dbcnx.commit()
+        return nrows
+
+    def create_counts_triggers(self, tablename):
+        """Create the triggers maintaining the row count of the table.
+        An update does not change the count, only the version.
+        """
+        for event, setexpr in [('INSERT', 'nrows=nrows+1, version=version+1'),
+                               ('DELETE', 'nrows=nrows-1, version=version+1'),
+                               ('UPDATE', 'version=version+1')]:
+            sql = f'CREATE TRIGGER IF NOT EXISTS' \
+                  f' "{constants.COUNTS}_{event.lower()}_{tablename}"' \
+                  f' AFTER {event} ON "{tablename}" BEGIN' \
+                  f' UPDATE {constants.COUNTS} SET {setexpr}' \
+                  f" WHERE name='{tablename}'; END"
+            self.dbcnx.execute(sql)
+
+    def suspend_counts(self, tablename):
+        """Drop the triggers maintaining the row count of the table, so that
+        a bulk write need not update the count for each row. A transaction
+        is begun, if not already in one; 'resume_counts' must be called
+        within it, which is rolled back if anything fails.
+        """
+        if not self.dbcnx.in_transaction:
+            self.dbcnx.execute('BEGIN IMMEDIATE')
+        for event in ('insert', 'delete', 'update'):
+            self.dbcnx.execute('DROP TRIGGER IF EXISTS'
+                               f' "{constants.COUNTS}_{event}_{tablename}"')
+
+    def resume_counts(self, tablename, change):
+        """Change the row count of the table by the given number of rows,
+        change its version, and re-create the triggers maintaining it.
+        If it has no row count yet, it is counted.
+        """
+        try:
+            sql = f"UPDATE {constants.COUNTS}" \
+                  " SET nrows=nrows+?, version=version+1 WHERE name=?"
+            updated = self.dbcnx.execute(sql, (change, tablename)).rowcount
+        except sqlite3.OperationalError: # No counts meta table yet.
+            updated = 0
+        if updated:
+            self.create_counts_triggers(tablename)
+        else:
+            self.set_counts(tablename)
+
     def empty_table(self, schema):
         "Empty the table; delete all rows."
         with self.dbcnx:
+            self.suspend_counts(schema['name'])
             sql = f'''DELETE FROM "{schema['name']}"'''
-            self.dbcnx.execute(sql)
+            deleted = self.dbcnx.execute(sql).rowcount
+            self.resume_counts(schema['name'], -deleted)
             self.update_table(schema)
 
     def delete_table(self, tablename):
@@ -917,10 +1104,16 @@ class DbContext:
         with self.dbcnx:
             sql = 'DELETE FROM "%s" WHERE name=?' % constants.TABLES
             self.dbcnx.execute(sql, (tablename,))
+            sql = 'DELETE FROM "%s" WHERE name=?' % constants.COUNTS
+            try:
+                self.dbcnx.execute(sql, (tablename,))
+            except sqlite3.OperationalError: # No counts meta table.
+                pass
+        # The triggers maintaining the row count are dropped with the table.
         sql = 'DROP TABLE "%s"' % tablename
         self.dbcnx.execute(sql)
-        sql = 'VACUUM'
-        self.dbcnx.execute(sql)
+        # The space is reclaimed by a job, when the context is done.
+        self.vacuum = True
 
     def add_index(self, tablename, schema):
         "Create an index in the database and add to the database definition."
@@ -1169,13 +1362,19 @@ class DbContext:
             sql = f"DROP INDEX {name}"
             cursor.execute(sql)
 
-def get_db(name, complete=False):
+def get_db(name, complete=False, mutable=True):
     """Return the database metadata for the given name.
     Return None if no such database.
+    The metadata from the database file is cached; the cache entry is
+    valid as long as the 'modified' value of the database is unchanged.
+    The content hashes are not cached, since a job records them without
+    changing 'modified', possibly in another process.
+    If 'mutable' is False, the table, index, view and chart schemas
+    are shared with the cache, and must not be modified.
     """
     cursor = dbshare.system.get_cursor()
     sql = "SELECT owner, title, description, public, readonly," \
-          " created, modified FROM dbs WHERE name=?"
+          " created, modified, autoindex, size FROM dbs WHERE name=?"
     cursor.execute(sql, (name,))
     rows = cursor.fetchall()
     if len(rows) != 1: return None # 'rowcount' does not work?!
@@ -1188,43 +1387,79 @@ def get_db(name, complete=False):
           'readonly':   bool(row[4]),
           'created':    row[5],
           'modified':   row[6],
-          'size':       os.path.getsize(utils.dbpath(name))}
+          'autoindex':  bool(row[7]),
+          'size':       row[8]}
+    if db['size'] is None:      # Not yet set; should not happen.
+        db['size'] = set_size(name)
     db['hashes'] = {}
-    sql = "SELECT hashname, hashvalue FROM dbs_hashes WHERE name=?"
-    cursor.execute(sql, (name,))
-    for row in cursor:
-        db['hashes'][row[0]] = row[1]
+    if db['readonly']:          # Only a read-only database has hashes.
+        sql = "SELECT hashname, hashvalue FROM dbs_hashes WHERE name=?"
+        for row in cursor.execute(sql, (name,)):
+            db['hashes'][row[0]] = row[1]
+    entry = METADATA_CACHE.get(name)
+    if entry is None or entry['modified'] != db['modified'] or \
+       (complete and 'tables' not in entry):
+        entry = get_metadata(name, db['modified'], complete=complete)
+        if complete:
+            METADATA_CACHE.set(name, entry)
+    if complete:
+        for key in ['tables', 'indexes', 'views', 'charts']:
+            if mutable:
+                db[key] = copy.deepcopy(entry[key])
+            else:
+                db[key] = entry[key].copy()
+    return db
+
+def get_metadata(name, modified, complete=False):
+    "Read the metadata for the database from the system and its file."
+    entry = {'modified': modified}
     if complete:
         cursor = get_cnx(name).cursor()
         sql = "SELECT name, schema FROM %s" % constants.TABLES
         cursor.execute(sql)
-        db['tables'] = dict([(row[0], json.loads(row[1])) for row in cursor])
+        entry['tables'] = dict([(row[0], json.loads(row[1]))
+                                for row in cursor])
         sql = "SELECT name, schema FROM %s" % constants.INDEXES
         cursor.execute(sql)
-        db['indexes'] = dict([(row[0], json.loads(row[1])) for row in cursor])
+        entry['indexes'] = dict([(row[0], json.loads(row[1]))
+                                 for row in cursor])
         sql = "SELECT name, schema FROM %s" % constants.VIEWS
         cursor.execute(sql)
-        db['views'] = dict([(row[0], json.loads(row[1])) for row in cursor])
+        entry['views'] = dict([(row[0], json.loads(row[1]))
+                               for row in cursor])
         sql = "SELECT name, schema, spec FROM %s" % constants.CHARTS
         cursor.execute(sql)
-        db['charts'] = dict([(row[0], {'name': row[0], 
-                                       'source': row[1], 
-                                       'spec': json.loads(row[2])})
-                             for row in cursor])
-    return db
+        entry['charts'] = dict([(row[0], {'name': row[0], 
+                                          'source': row[1], 
+                                          'spec': json.loads(row[2])})
+                                for row in cursor])
+    return entry
+
+def set_size(dbname):
+    """Set the size of the database file in the system database,
+    where it is kept for the listings of databases. Return the size.
+    """
+    size = os.path.getsize(utils.dbpath(dbname))
+    cnx = dbshare.system.get_cnx()
+    with cnx:
+        cnx.execute("UPDATE dbs SET size=? WHERE name=?", (size, dbname))
+    return size
 
 def get_usage(username=None):
-    "Return the number and total size of the databases for the user, or all."
+    """Return the number and total size of the databases for the user, or all,
+    from the usage ledger in the system database.
+    """
     cursor = dbshare.system.get_cursor()
     if username:
-        sql = "SELECT name FROM dbs WHERE owner=?"
+        sql = "SELECT ndbs, size FROM usage WHERE username=?"
         cursor.execute(sql, (username,))
     else:
-        sql = "SELECT name FROM dbs"
+        sql = "SELECT COALESCE(SUM(ndbs), 0), COALESCE(SUM(size), 0) FROM usage"
         cursor.execute(sql)
-    rows = cursor.fetchall()
-    return (len(rows),
-            sum([os.path.getsize(utils.dbpath(row[0])) for row in rows]))
+    row = cursor.fetchone()
+    if row is None:
+        return (0, 0)
+    return tuple(row)
 
 def check_quota(user=None, size=0):
     "Raise ValueError if the current user has exceeded her size quota."
@@ -1236,17 +1471,15 @@ def check_quota(user=None, size=0):
         raise ValueError('size quota exceeded; cannot add data')
 
 def get_schema(db, sourcename):
-    """Get the schema of the table or view. 
+    """Get a copy of the schema of the table or view. 
     Add a member 'type' denoting which it is.
     Raise ValueError if no such table or view.
     """
     try:
-        schema = db['tables'][sourcename]
-        schema['type'] = constants.TABLE
+        schema = dict(db['tables'][sourcename], type=constants.TABLE)
     except KeyError:
         try:
-            schema = db['views'][sourcename]
-            schema['type'] = constants.VIEW
+            schema = dict(db['views'][sourcename], type=constants.VIEW)
         except KeyError:
             raise ValueError('no such table/view')
     return schema
@@ -1285,7 +1518,7 @@ def get_sql_create_table(schema, if_not_exists=False):
     # Primary key when more than one column.
     if len(primarykey) >= 2:
         clauses.append('PRIMARY KEY (%s)' %
-                       ','.join(['"%s"' for k in primarykey]))
+                       ','.join(['"%s"' % k for k in primarykey]))
     # Foreign keys.
     for foreignkey in schema.get('foreignkeys', []):
         clauses.append('FOREIGN KEY (%s) REFERENCES "%s" (%s)' %
@@ -1318,26 +1551,31 @@ def get_sql_create_index(tablename, schema, if_not_exists=False):
     return ' '.join(sql)
 
 def get_cnx(dbname, write=False):
-    """Get a connection for the given database name.
-    IMPORTANT: Currently, only one connection to a given database can
-    be open at any time!
+    """Get a connection for the given database name from the pool.
+    It is kept for the rest of the request, and then returned to the pool.
     If write is true, then assume the old connection is read-only,
-    so close it and open a new one.
+    so release it and acquire a new one.
     """
-    if write:
-        try:
-            flask.g.dbcnx.close()
-        except AttributeError:
-            pass
-        flask.g.dbcnx = utils.get_cnx(utils.dbpath(dbname), write=write)
-        flask.g.dbname = dbname
+    if write or getattr(flask.g, 'dbname', dbname) != dbname:
+        release_cnx()
     try:
         return flask.g.dbcnx
     except AttributeError:
-        flask.g.dbcnx = utils.get_cnx(utils.dbpath(dbname))
+        flask.g.dbcnx = dbshare.pool.acquire(utils.dbpath(dbname), write=write)
         flask.g.dbname = dbname
         return flask.g.dbcnx
 
+def release_cnx():
+    "Return the connection for the current database, if any, to the pool."
+    cnx = flask.g.pop('dbcnx', None)
+    if cnx is not None:
+        dbshare.pool.release(cnx)
+
+def init(app):
+    "Set the sizes of the metadata cache and the view row counts cache."
+    METADATA_CACHE.maxsize = app.config['METADATA_CACHE_SIZE']
+    VIEW_COUNTS_CACHE.maxsize = app.config['VIEW_COUNTS_CACHE_SIZE']
+
 def has_read_access(db):
     "Does the current user (if any) have read access to the database?"
     if db['public']: return True
@@ -1350,8 +1588,9 @@ def get_check_read(dbname, nrows=False, complete=True):
     Optionally add nrows for each table and view.
     Raise KeyError if no such database.
     Raise ValueError if may not access.
+    The schemas are shared with the metadata cache; do not modify them.
     """
-    db = get_db(dbname, complete=complete)
+    db = get_db(dbname, complete=complete, mutable=False)
     if db is None:
         raise KeyError('no such database')
     if not has_read_access(db):
@@ -1381,23 +1620,134 @@ def get_check_write(dbname, check_mode=True, nrows=False, complete=True):
     return db
 
 def set_nrows(db, targets):
-    "Set the item 'nrows' for all or given tables and views of the database."
+    """Set the item 'nrows' for all or given tables and views of the database.
+    The schemas are replaced by copies, since they may be shared.
+    The counts for tables are taken from the counts meta table. The counts
+    for views are cached, keyed by the versions of the underlying tables.
+    Otherwise the rows are counted concurrently; see 'count_rows'.
+    """
     if not targets: return
     if targets == True:
-        targets = list(db['views'].values())
+        targets = [get_schema(db, name) for name in db['views']]
     else:
         targets = [get_schema(db, name) for name in targets]
-    cnx = get_cnx(db['name'])
+    counts = get_counts(db)
+    uncounted = []
     for target in targets:
+        if target['type'] == constants.TABLE:
+            try:
+                target['nrows'] = counts[target['name']][0]
+            except KeyError:
+                uncounted.append((target, None))
+        else:
+            key = get_view_counts_key(db, target, counts)
+            if key is None:
+                target['nrows'] = None
+            else:
+                target['nrows'] = VIEW_COUNTS_CACHE.get(key)
+            if target['nrows'] is None:
+                uncounted.append((target, key))
+        if target['type'] == constants.TABLE:
+            db['tables'][target['name']] = target
+        else:
+            db['views'][target['name']] = target
+    if uncounted:
+        count_rows(db, uncounted)
+
+def count_rows(db, targets):
+    """Count the rows of the given tables and views of the database
+    concurrently, in the thread pool, within one total time budget.
+    The targets are tuples (schema, key); the item 'nrows' is set in the
+    schema, or None if not counted in time. The count is cached by the key,
+    unless it is None.
+    """
+    timeout = flask.current_app.config['VIEW_COUNTS_TIMEOUT']
+    deadline = time.monotonic() + timeout
+    app = flask.current_app._get_current_object()
+    counter = get_counter()
+    futures = [counter.submit(_count_rows, app, db, schema['name'], deadline)
+               for schema, key in targets]
+    concurrent.futures.wait(futures, timeout=timeout)
+    for (schema, key), future in zip(targets, futures):
+        if future.done():
+            schema['nrows'] = future.result()
+        else:
+            future.cancel()
+            schema['nrows'] = None
+        if key is not None and schema['nrows'] is not None:
+            VIEW_COUNTS_CACHE.set(key, schema['nrows'])
+
+def get_counter():
+    """Return the thread pool for counting rows. It is created in the
+    process using it, since threads do not survive forking a worker process.
+    """
+    pid = os.getpid()
+    with _counters_lock:
         try:
-            utils.execute_timeout(cnx, _set_nrows, target=target)
-        except SystemError:
-            target['nrows'] = None
-
-def _set_nrows(cnx, target):
-    "Actually set the nrow values for the given target; executed with time-out."
-    sql = 'SELECT COUNT(*) FROM "%s"' % target['name']
-    target['nrows'] = cnx.execute(sql).fetchone()[0]
+            return _counters[pid]
+        except KeyError:
+            _counters.clear()
+            counter = concurrent.futures.ThreadPoolExecutor(
+                max_workers=flask.current_app.config['VIEW_COUNTS_WORKERS'],
+                thread_name_prefix='row-counter')
+            _counters[pid] = counter
+            return counter
+
+def get_counts(db):
+    """Return a dictionary of the tuples (nrows, version) for the tables
+    from the counts meta table. Empty if no such meta table.
+    """
+    cnx = get_cnx(db['name'])
+    sql = f"SELECT name, nrows, version FROM {constants.COUNTS}"
+    try:
+        return dict([(row[0], (row[1], row[2])) for row in cnx.execute(sql)])
+    except sqlite3.OperationalError:
+        return {}
+
+def get_view_counts_key(db, view, counts):
+    """Return the key for the row count of the view in the cache; the view
+    query and the versions of the underlying tables, found recursively
+    through any views. Return None if not all versions are available.
+    """
+    versions = {}
+    pending = list(view['sources'])
+    seen = set()
+    while pending:
+        name = pending.pop()
+        if name.lower() in seen: continue
+        seen.add(name.lower())
+        for tablename in db['tables']:
+            if tablename.lower() == name.lower():
+                try:
+                    versions[tablename] = counts[tablename][1]
+                except KeyError:
+                    return None
+                break
+        else:
+            for viewname, schema in db['views'].items():
+                if viewname.lower() == name.lower():
+                    pending.extend(schema['sources'])
+                    break
+            else:
+                return None
+    return (db['name'],
+            view['name'],
+            json.dumps(view['query'], sort_keys=True),
+            tuple(sorted(versions.items())))
+
+def _count_rows(app, db, name, deadline):
+    """Return the number of rows in the table or view, or None if not done
+    before the deadline. Executed in a thread of the pool, using its own
+    connection; for a read-only database the count is taken from the
+    result cache.
+    """
+    if time.monotonic() >= deadline: return None
+    with app.app_context():
+        sql = 'SELECT COUNT(*) FROM "%s"' % name
+        try:
+            return dbshare.cache.fetch(db, sql, deadline=deadline)[1][0][0]
+        except (SystemError, sqlite3.Error):
+            return None
 
 def add_sqlite3_database(dbname, infile, size):
     """Add the Sqlite3 database file present in the given open file object.
@@ -1412,9 +1762,14 @@ def add_sqlite3_database(dbname, infile, size):
         check_quota(size=size)
         with DbContext() as ctx:
             dbname = ctx.set_name(dbname, modify=True)
+            # Get rid of any stale connections and WAL files.
+            dbshare.pool.remove(utils.dbpath(dbname))
             with open(utils.dbpath(dbname), 'wb') as outfile:
                 outfile.write(infile.read())
             ctx.initialize()
+            # Any row counts in the file may be stale; recount when needed.
+            with ctx.dbcnx:
+                ctx.dbcnx.execute(f"DELETE FROM {constants.COUNTS}")
     except (ValueError, TypeError, OSError, IOError, sqlite3.Error) as error:
         raise ValueError(str(error))
     try:
@@ -1477,9 +1832,352 @@ def delete_database(dbname):
     with cnx:
         sql = 'DELETE FROM dbs_logs WHERE name=?'
         cnx.execute(sql, (dbname,))
+        sql = 'DELETE FROM index_advice WHERE dbname=?'
+        cnx.execute(sql, (dbname,))
         sql = 'DELETE FROM dbs WHERE name=?'
         cnx.execute(sql, (dbname,))
+    METADATA_CACHE.pop(dbname)
+    if getattr(flask.g, 'dbname', None) == dbname:
+        release_cnx()
+    dbshare.pool.remove(utils.dbpath(dbname))
+    delete_exports(dbname)
+
+def delete_exports(dbname):
+    "Delete the export files of the database, including any partial."
+    for ext in EXPORT_MIMETYPES:
+        filepath = utils.exportpath(f"{dbname}.{ext}")
+        for path in (filepath, filepath + '.partial'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def get_export_sources(db, views=True):
+    """Generator of (schema, cursor) for the tables, and optionally views,
+    of the database. Skip any for which the query is interrupted by time-out.
+    """
+    cnx = get_cnx(db['name'])
+    schemas = list(db['tables'].values())
+    if views:
+        schemas.extend(db['views'].values())
+    for schema in schemas:
+        columns = [c['name'] for c in schema['columns']]
+        sql = 'SELECT %s FROM "%s"' % \
+              (','.join([f'"{c}"' for c in columns]), schema['name'])
+        try:
+            cursor = utils.execute_timeout(cnx, sql)
+        except SystemError:
+            pass
+        else:
+            yield schema, cursor
+
+def get_tar_chunks(db, ext):
+    """Generator of the chunks of a tar file, optionally compressed,
+    containing one CSV file for each table and view in the database.
+    The tar format is written here, rather than by the 'tarfile' module,
+    so that each chunk can be sent as soon as it has been produced.
+    Each CSV file is spooled to a temporary file, which is kept in memory
+    only while it is small, since its size is needed for the tar header.
+    """
+    if ext == 'tar.gz':
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    elif ext == 'tar.bz2':
+        compressor = bz2.BZ2Compressor()
+    else:
+        compressor = None
+    config = flask.current_app.config
+    total = 0
+    for schema, cursor in get_export_sources(db):
+        header = [c['name'] for c in schema['columns']]
+        with tempfile.SpooledTemporaryFile(
+                max_size=config['EXPORT_SPOOL_SIZE']) as csvfile:
+            for chunk in utils.csv_chunks(cursor, header=header):
+                csvfile.write(chunk.encode('utf-8'))
+            tarinfo = tarfile.TarInfo(name=f"{db['name']}/{schema['name']}.csv")
+            tarinfo.size = csvfile.tell()
+            tarinfo.mtime = int(time.time())
+            csvfile.seek(0)
+            chunks = itertools.chain(
+                [tarinfo.tobuf(tarfile.DEFAULT_FORMAT,
+                               tarfile.ENCODING,
+                               'surrogateescape')],
+                get_file_chunks(csvfile, close=False))
+            for chunk in chunks:
+                total += len(chunk)
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+        # Pad the member data to a full block.
+        remainder = total % tarfile.BLOCKSIZE
+        if remainder:
+            chunk = tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+            total += len(chunk)
+            yield compressor.compress(chunk) if compressor else chunk
+    # End-of-archive marker, padded to a full record.
+    chunk = tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+    total += len(chunk)
+    remainder = total % tarfile.RECORDSIZE
+    if remainder:
+        chunk += tarfile.NUL * (tarfile.RECORDSIZE - remainder)
+    if compressor:
+        yield compressor.compress(chunk) + compressor.flush()
+    else:
+        yield chunk
+
+def write_xlsx(db, outfile):
+    """Write an XLSX file containing one worksheet for each table.
+    The workbook is in write-only mode, so that openpyxl spools
+    the rows to disk instead of keeping them in memory.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    for schema, cursor in get_export_sources(db, views=False):
+        ws = wb.create_sheet(title=schema['name'])
+        ws.append([c['name'] for c in schema['columns']])
+        for row in cursor:
+            ws.append(row)
+    # A workbook must contain at least one worksheet.
+    if not wb.worksheets:
+        wb.create_sheet()
+    wb.save(outfile)
+
+def get_file_chunks(infile, close=True):
+    "Generator of the chunks of the content of the open file."
     try:
-        os.remove(utils.dbpath(dbname))
+        chunk_size = flask.current_app.config['EXPORT_CHUNK_SIZE']
+        chunk = infile.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = infile.read(chunk_size)
+    finally:
+        if close:
+            infile.close()
+
+def get_hashes(dbname):
+    """Return the content hash values of the database file.
+    The file is memory-mapped, and each hash is computed in a thread
+    of its own, since hashlib releases the GIL for large updates.
+    """
+    config = flask.current_app.config
+    hashnames = config['CONTENT_HASHES']
+    chunk_size = config['CONTENT_HASH_CHUNK_SIZE']
+    with open(utils.dbpath(dbname), 'rb') as infile:
+        try:
+            content = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:      # An empty file cannot be memory-mapped.
+            content = b''
+        try:
+            def digest(hashname):
+                hash = hashlib.new(hashname)
+                with memoryview(content) as view:
+                    for start in range(0, len(view), chunk_size):
+                        with view[start:start+chunk_size] as chunk:
+                            hash.update(chunk)
+                return hash.hexdigest()
+
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=len(hashnames),
+                    thread_name_prefix='content-hash') as executor:
+                return dict(zip(hashnames, executor.map(digest, hashnames)))
+        finally:
+            if isinstance(content, mmap.mmap):
+                content.close()
+
+def start_hashing(db):
+    """Start a job to compute the content hash values of the database,
+    which has been set to read-only without them. Return the job.
+    Raise ValueError if the current user has too many jobs not yet done.
+    """
+    return dbshare.jobs.submit('hashing', db['name'], _hashing,
+                               db['modified'])
+
+def _hashing(job, modified):
+    """Compute and record the content hash values; executed as a job.
+    They are discarded if the database was modified meanwhile.
+    If the computation fails or is cancelled, the database is set
+    back to read-write.
+    """
+    dbname = job.dbname
+    try:
+        hashes = get_hashes(dbname)
+        job.check_cancelled(force=True)
+        # A single statement, so that the check and insert are atomic.
+        values = ', '.join(['(?, ?)'] * len(hashes))
+        sql = "INSERT INTO dbs_hashes (name, hashname, hashvalue)" \
+              " SELECT dbs.name, h.column1, h.column2" \
+              f" FROM dbs, (VALUES {values}) AS h" \
+              " WHERE dbs.name=? AND dbs.readonly AND dbs.modified=?" \
+              " AND NOT EXISTS (SELECT 1 FROM dbs_hashes WHERE name=?)"
+        cnx = dbshare.system.get_cnx()
+        with cnx:
+            cnx.execute(sql, [v for item in hashes.items() for v in item] +
+                             [dbname, modified, dbname])
+        return {'hashes': hashes}
+    except (SystemError, OSError, sqlite3.Error):
+        try:
+            db = get_db(dbname)
+            if db and db['modified'] == modified:
+                with DbContext(db) as ctx:
+                    ctx.set_readonly(False)
+        except (ValueError, OSError, sqlite3.Error):
+            pass
+        raise
+
+def revert_hashing(dbname):
+    """Set the database back to read-write if it is read-only without
+    content hash values, and no job to compute them is queued or running.
+    Any problem is ignored.
+    """
+    try:
+        db = get_db(dbname)
+        if not db or not is_hashing(db): return
+        if dbshare.jobs.is_pending('hashing', dbname): return
+        with DbContext(db) as ctx:
+            ctx.set_readonly(False)
+    except (ValueError, OSError, sqlite3.Error):
+        pass
+
+def is_hashing(db):
+    "Are the content hash values of the read-only database being computed?"
+    return db['readonly'] and not db['hashes']
+
+def verify_hashes(db):
+    """Recompute the content hash values of the read-only database,
+    and compare them with the recorded ones. Return a dictionary with
+    items (hashname, (recorded, computed)).
+    Raise ValueError if the database is not read-only with hash values.
+    """
+    if not db['readonly'] or not db['hashes']:
+        raise ValueError('database is not read-only with content hashes')
+    result = {}
+    for hashname, hashvalue in get_hashes(db['name']).items():
+        result[hashname] = (db['hashes'].get(hashname), hashvalue)
+    for hashname, hashvalue in db['hashes'].items():
+        result.setdefault(hashname, (hashvalue, None))
+    return result
+
+def start_export(db, ext):
+    """Start a job to export the database to a file having the given
+    extension, unless one is already running. Return the job, if started.
+    Raise ValueError if the current user has too many jobs not yet done.
+    """
+    filepath = utils.exportpath(f"{db['name']}.{ext}")
+    if is_export_running(filepath): return None
+    partialpath = filepath + '.partial'
+    # Create the file in this thread, to signal that the export has started.
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    open(partialpath, 'wb').close()
+    try:
+        os.remove(filepath)
     except FileNotFoundError:
         pass
+    try:
+        return dbshare.jobs.submit('export', db['name'], _export,
+                                   db, ext, filepath, partialpath)
+    except ValueError:
+        os.remove(partialpath)
+        raise
+
+def _export(job, db, ext, filepath, partialpath):
+    "Write the export file; executed as a job."
+    try:
+        with open(partialpath, 'wb') as outfile:
+            if ext == 'xlsx':
+                write_xlsx(db, outfile)
+            else:
+                for chunk in get_tar_chunks(db, ext):
+                    job.check_cancelled()
+                    outfile.write(chunk)
+        os.rename(partialpath, filepath)
+    except (SystemError, OSError, sqlite3.Error):
+        try:
+            os.remove(partialpath)
+        except FileNotFoundError:
+            pass
+        raise
+    return {'filename': os.path.basename(filepath),
+            'size': os.path.getsize(filepath)}
+
+def start_vacuum(db, reset=True):
+    """Start a job to run VACUUM on the database, and optionally reset
+    the table caches. Return the job.
+    Raise ValueError if the current user has too many jobs not yet done.
+    """
+    return dbshare.jobs.submit('vacuum', db['name'], _vacuum, reset)
+
+def _vacuum(job, reset):
+    "Run VACUUM on the database; executed as a job."
+    db = get_db(job.dbname, complete=reset)
+    if db is None: return None  # Deleted meanwhile.
+    if db['readonly']:          # Not allowed, since the hashes would change.
+        raise ValueError('database is read-only')
+    if reset:
+        with DbContext(db) as ctx:
+            for schema in db['tables'].values():
+                ctx.update_table(schema)
+    job.execute(get_cnx(db['name'], write=True), 'VACUUM')
+    return {'size': set_size(db['name'])}
+
+def start_analyze(db):
+    """Start a job to run ANALYZE on the database. Return the job.
+    Raise ValueError if the current user has too many jobs not yet done.
+    """
+    return dbshare.jobs.submit('analyze', db['name'], _analyze)
+
+def _analyze(job):
+    "Run ANALYZE on the database; executed as a job."
+    db = get_db(job.dbname)
+    if db is None: return None  # Deleted meanwhile.
+    if db['readonly']:          # Not allowed, since the hashes would change.
+        raise ValueError('database is read-only')
+    job.execute(get_cnx(db['name'], write=True), 'ANALYZE')
+    return {'size': set_size(db['name'])}
+
+def start_load_csv(db, tablename, infile, delimiter, has_header):
+    """Start a job to create the table and load the data in the binary CSV
+    file, which must be seekable. The job closes the file. Return the job.
+    Raise ValueError if the current user has too many jobs not yet done.
+    """
+    return dbshare.jobs.submit('load', db['name'], _load_csv,
+                               tablename, infile, delimiter, has_header)
+
+def _load_csv(job, tablename, infile, delimiter, has_header):
+    "Create the table and load the CSV data; executed as a job."
+    try:
+        size = os.fstat(infile.fileno()).st_size or 1
+        db = get_check_write(job.dbname)
+        records = utils.CsvRecords(infile, delimiter=delimiter)
+        with DbContext(db) as ctx:
+            count = ctx.create_table_load_records(
+                tablename, records, has_header=has_header,
+                progress=lambda count: job.set_progress(infile.tell() / size))
+    finally:
+        infile.close()
+    return {'table': tablename, 'records': count}
+
+def start_add_database(dbname, add_func, infile, size):
+    """Start a job to add the database from the data in the open file,
+    using the function for its content type. Return the job.
+    Raise ValueError if the current user has too many jobs not yet done.
+    """
+    return dbshare.jobs.submit('create', dbname, _add_database,
+                               add_func, infile, size)
+
+def _add_database(job, add_func, infile, size):
+    "Add the database from the data in the file; executed as a job."
+    db = add_func(job.dbname, infile, size)
+    return {'name': db['name']}
+
+def is_export_current(db, filepath):
+    "Was the export file written after the latest modification of the database?"
+    modified = dbshare.cache.get_last_modified(db).replace(
+        tzinfo=datetime.timezone.utc)
+    return os.path.getmtime(filepath) >= modified.timestamp()
+
+def is_export_running(filepath):
+    "Is a background export to the file in progress?"
+    try:
+        modified = os.path.getmtime(filepath + '.partial')
+    except FileNotFoundError:
+        return False
+    return time.time() - modified < EXPORT_STALE_TIMEOUT
@@ -1,5 +1,6 @@
 "Database lists HTML endpoints."
 
+import json
 import os.path
 
 import flask
@@ -9,6 +10,20 @@ import dbshare.db
 from . import utils
 
 
+# The sort keys for the list of databases. The name breaks ties, and the
+# expressions are not null, as required for keyset pagination.
+SORT_KEYS = {'name': 'd.name',
+             'title': "COALESCE(d.title, '')",
+             'owner': 'd.owner',
+             'size': 'COALESCE(d.size, 0)',
+             'modified': 'd.modified',
+             'created': 'd.created'}
+
+
+# The number of hash values looked up per query.
+LOOKUP_BATCH_SIZE = 500
+
+
 blueprint = flask.Blueprint('dbs', __name__)
 
 @blueprint.route('/upload', methods=['GET', 'POST'])
@@ -71,31 +86,147 @@ def owner(username=''):
 
 @blueprint.route('/lookup/<hashcode>')
 def lookup(hashcode):
-    "Lookup and redirect to the database with the given hash."
-    for db in get_dbs(readonly=True):
-        for hashvalue in db['hashes'].values():
-            if hashvalue == hashcode:
-                return flask.redirect(
-                    flask.url_for('db.display', dbname=db['name']))
-    utils.flash_error('no such database')
-    return flask.redirect(flask.url_for('home'))
+    """Lookup and redirect to the database with the given hash,
+    which may be prefixed by the hash name and a colon.
+    """
+    try:
+        dbname = resolve_hashes([hashcode])[hashcode]
+        if dbname is None:
+            raise ValueError('no such database')
+    except ValueError as error:
+        utils.flash_error(error)
+        return flask.redirect(flask.url_for('home'))
+    return flask.redirect(flask.url_for('db.display', dbname=dbname))
+
+def resolve_hashes(hashcodes):
+    """Return a dictionary with the name of the database having the content
+    hash, or None if there is none that the current user may read, for each
+    of the given hash codes. A hash code is a hash value, optionally
+    prefixed by the name of one of the configured content hashes
+    and a colon.
+    The hash values are looked up using the primary key of 'dbs_hashes',
+    in batches of parameters.
+    Raise ValueError if a hash name is not one of those configured.
+    """
+    hashnames = flask.current_app.config['CONTENT_HASHES']
+    wanted = {}                 # Hash value: list of (hash code, hash name)
+    for hashcode in hashcodes:
+        hashname, sep, hashvalue = hashcode.rpartition(':')
+        if sep and hashname not in hashnames:
+            raise ValueError(f"invalid hash name '{hashname}'; must be one of"
+                             f" {', '.join(hashnames)}")
+        wanted.setdefault(hashvalue, []).append((hashcode, hashname or None))
+    result = dict([(hashcode, None) for hashcode in hashcodes])
+    cursor = dbshare.system.get_cursor()
+    values = list(wanted)
+    for batch in utils.batches(values, LOOKUP_BATCH_SIZE):
+        sql = "SELECT h.hashname, h.hashvalue, d.name, d.public, d.owner" \
+              " FROM dbs_hashes AS h JOIN dbs AS d ON d.name=h.name" \
+              " WHERE h.hashvalue IN (%s)" % ','.join('?' * len(batch))
+        for row in cursor.execute(sql, batch):
+            if not dbshare.db.has_read_access({'public': bool(row[3]),
+                                               'owner': row[4]}):
+                continue
+            for hashcode, hashname in wanted[row[1]]:
+                if hashname in (None, row[0]):
+                    result[hashcode] = row[2]
+    return result
 
 def has_access(username):
     "May the current user access the user's list of databases?"
     return flask.g.is_admin or flask.g.current_user['username'] == username
 
 def get_dbs(public=None, owner=None, complete=False, readonly=None):
-    "Get the list of databases according to criteria."
-    sql = "SELECT name FROM dbs"
-    criteria = {}
+    "Get the list of databases satisfying all the given criteria."
+    dbs = get_dbs_page(public=public, owner=owner, readonly=readonly)[0]
+    if complete:
+        dbs = [dbshare.db.get_db(db['name'], complete=True) for db in dbs]
+    return dbs
+
+def get_dbs_page(public=None, owner=None, readonly=None,
+                 sort='name', desc=False, limit=None, position=None):
+    """Get a page of the list of databases satisfying all the given criteria,
+    sorted by the given key, and the position of the next page, or None
+    if there are no more databases. All are returned if 'limit' is None.
+    This is keyset pagination; the page starts after the sort key value
+    and name given by the position.
+    The databases and their hashes are read in one query, and the file
+    sizes are taken from the system database.
+    Raise ValueError if the sort key or the position is invalid.
+    """
+    try:
+        key = SORT_KEYS[sort]
+    except KeyError:
+        raise ValueError(f"invalid sort key; must be one of"
+                         f" {', '.join(SORT_KEYS)}")
+    clauses, params = get_criteria(public=public,
+                                   owner=owner,
+                                   readonly=readonly)
+    direction = desc and 'DESC' or 'ASC'
+    if position:
+        try:
+            params.extend([position['value'], position['name']])
+        except (KeyError, TypeError):
+            raise ValueError('invalid cursor')
+        clauses.append(f"({key}, d.name) {desc and '<' or '>'} (?, ?)")
+    sql = "SELECT d.name, d.owner, d.title, d.description, d.public," \
+          " d.readonly, d.created, d.modified, d.autoindex, d.size," \
+          f" {key}, json_group_object(h.hashname, h.hashvalue)" \
+          " FILTER (WHERE h.hashname IS NOT NULL)" \
+          " FROM dbs AS d LEFT JOIN dbs_hashes AS h ON h.name=d.name"
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    sql += f" GROUP BY d.name ORDER BY {key} {direction}, d.name {direction}"
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit + 1)
+    cursor = dbshare.system.get_cursor()
+    rows = cursor.execute(sql, params).fetchall()
+    result = []
+    for row in rows[:limit]:
+        db = {'name':       row[0],
+              'owner':      row[1],
+              'title':      row[2],
+              'description':row[3],
+              'public':     bool(row[4]),
+              'readonly':   bool(row[5]),
+              'created':    row[6],
+              'modified':   row[7],
+              'autoindex':  bool(row[8]),
+              'size':       row[9],
+              'hashes':     json.loads(row[11])}
+        if db['size'] is None:  # Not yet set; should not happen.
+            db['size'] = dbshare.db.set_size(db['name'])
+        result.append(db)
+    if limit is not None and len(rows) > limit:
+        return result, {'value': rows[limit - 1][10],
+                        'name': rows[limit - 1][0]}
+    return result, None
+
+def get_total(public=None, owner=None, readonly=None):
+    """Return the number and the total size of the databases
+    satisfying all the given criteria.
+    """
+    clauses, params = get_criteria(public=public,
+                                   owner=owner,
+                                   readonly=readonly)
+    sql = "SELECT COUNT(*), COALESCE(SUM(d.size), 0) FROM dbs AS d"
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    cursor = dbshare.system.get_cursor()
+    return tuple(cursor.execute(sql, params).fetchone())
+
+def get_criteria(public=None, owner=None, readonly=None):
+    "Return the list of SQL clauses and the list of parameters for them."
+    clauses = []
+    params = []
     if public is not None:
-        criteria['public=?'] = public
+        clauses.append('d.public=?')
+        params.append(public)
     if owner:
-        criteria['owner=?'] = owner
+        clauses.append('d.owner=?')
+        params.append(owner)
     if readonly is not None:
-        criteria['readonly=?'] = readonly
-    if criteria:
-        sql += ' WHERE ' + ' OR '.join(criteria.keys())
-    cursor = dbshare.system.get_cursor()
-    cursor.execute(sql, tuple(criteria.values()))
-    return [dbshare.db.get_db(row[0], complete=complete) for row in cursor]
+        clauses.append('d.readonly=?')
+        params.append(readonly)
+    return clauses, params
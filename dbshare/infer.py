@@ -0,0 +1,129 @@
+"Infer the types and constraints of table columns from records of data items."
+
+import collections
+import datetime
+import re
+
+from . import constants
+
+# ISO date or datetime, terminated by newline; matched against joined values.
+DATES_RX = re.compile(r'(\d{4}-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])'
+                      r'([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?'
+                      r'(Z|[-+]\d{2}(:?\d{2})?)?)?\n)*')
+
+# The type lattice, in order of increasing generality.
+TYPES = (constants.INTEGER, constants.REAL, constants.TEXT)
+_INTEGER, _REAL, _TEXT = range(len(TYPES))
+
+NoneType = type(None)
+
+
+class Inferrer:
+    """Infer the type, the NOT NULL constraint and the 'temporal' annotation
+    of the columns from records of data items, in a single pass.
+    The records are given in batches by repeated calls to 'update'.
+
+    The type of a column starts as INTEGER and moves to REAL or TEXT,
+    never back, as required by the values seen. Hence a conversion by
+    'int' or 'float' fails at most twice per column. The values of a
+    column in a batch are checked together, using built-ins and regexps
+    that loop in C rather than in Python.
+    A TEXT column is temporal if all its values are ISO dates or datetimes.
+    """
+
+    def __init__(self, ncolumns):
+        self.ncolumns = ncolumns
+        self.types = [_INTEGER] * ncolumns
+        self.notnull = [True] * ncolumns
+        self.temporal = [True] * ncolumns
+        self.count = 0
+
+    def update(self, records):
+        """Update the inferred state of the columns from the batch of records.
+        Raises ValueError if a record has too few items.
+        """
+        if not isinstance(records, (list, tuple)):
+            records = list(records)
+        if not records: return
+        if min(map(len, records)) < self.ncolumns:
+            for pos, record in enumerate(records):
+                if len(record) < self.ncolumns:
+                    raise ValueError(f"record {self.count+pos+1}"
+                                     " has too few items")
+        self.count += len(records)
+        for i, values in zip(range(self.ncolumns), zip(*records)):
+            # Skip the column if nothing more can be learned.
+            if self.types[i] == _TEXT and \
+               not self.notnull[i] and not self.temporal[i]:
+                continue
+            kinds = set(map(type, values))
+            if NoneType in kinds:
+                self.notnull[i] = False
+                kinds.discard(NoneType)
+                values = [v for v in values if v is not None]
+            if not kinds:
+                continue
+            elif kinds == {str}:
+                self.update_strings(i, values)
+            else:
+                for value in values:
+                    self.update_value(i, value)
+
+    def update_strings(self, i, values):
+        "Update the inferred state of the column from the string values."
+        if self.types[i] == _INTEGER:
+            # Fast path for the common case of unsigned integers.
+            if (''.join(values).isdecimal() and all(values)) or \
+               converts(int, values):
+                self.temporal[i] = False
+                return
+            self.types[i] = _REAL
+        if self.types[i] == _REAL:
+            if converts(float, values):
+                self.temporal[i] = False
+                return
+            self.types[i] = _TEXT
+        if self.temporal[i] and not are_dates(values):
+            self.temporal[i] = False
+
+    def update_value(self, i, value):
+        "Update the inferred state of the column from the non-None value."
+        if isinstance(value, str):
+            self.update_strings(i, (value,))
+        elif isinstance(value, int):
+            self.temporal[i] = False
+        elif isinstance(value, float):
+            if self.types[i] == _INTEGER:
+                self.types[i] = _REAL
+            self.temporal[i] = False
+        elif isinstance(value, datetime.date):
+            self.types[i] = _TEXT
+        else:
+            self.types[i] = _TEXT
+            self.temporal[i] = False
+
+    def get_columns(self, names):
+        "Return the column definitions for the given column names."
+        return [{'name': name,
+                 'type': TYPES[self.types[i]],
+                 'notnull': self.notnull[i]}
+                for i, name in enumerate(names)]
+
+    def get_annotations(self, names):
+        "Return the annotations for the given column names."
+        return dict([(name, {'temporal': True})
+                     for i, name in enumerate(names)
+                     if self.types[i] == _TEXT and self.temporal[i]])
+
+
+def converts(func, values):
+    "Can all the values be converted by the function?"
+    try:
+        collections.deque(map(func, values), maxlen=0)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+def are_dates(values):
+    "Are all the string values ISO dates or datetimes?"
+    return bool(DATES_RX.fullmatch('\n'.join(values) + '\n'))
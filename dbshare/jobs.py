@@ -0,0 +1,343 @@
+"""Background jobs; long-running database operations executed by a pool
+of worker threads local to the process, instead of within a request.
+
+A job is recorded in the 'jobs' table of the system database, which
+holds its status, progress and result, so that any worker process may
+report on it. A job queued or running in a process which no longer
+exists is regarded as failed. The process is identified by a token made
+from the host name, the process id and the start time of the process,
+since a process id may be reused.
+
+Cancellation is cooperative: a queued job is not started, and a running
+job stops when it next checks for it, which it does when reporting
+progress, and at intervals while executing an Sqlite3 statement.
+"""
+
+import concurrent.futures
+import datetime
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+import flask
+
+import dbshare.db
+import dbshare.system
+import dbshare.user
+
+from . import constants
+from . import utils
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FINISHED = 'finished'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+JOB_COLUMNS = "iuid, kind, dbname, owner, status, progress, result, error," \
+              " pid, created, started, finished, instance"
+
+# Seconds between checks of the system database for cancellation.
+CANCEL_CHECK_INTERVAL = 1.0
+
+# Worker thread pools, keyed by process id; threads do not survive forking.
+_workers = {}
+_workers_lock = threading.Lock()
+
+# The instance token of this process, keyed by process id.
+_instances = {}
+
+
+class Job:
+    "Handle for a job while it is executed in a worker thread."
+
+    def __init__(self, iuid, kind, dbname):
+        self.iuid = iuid
+        self.kind = kind
+        self.dbname = dbname
+        self.cancelled = False
+        self._checked = time.monotonic()
+
+    def set_progress(self, fraction):
+        """Record the progress, as a fraction between 0 and 1.
+        Raise SystemError if the job has been cancelled.
+        """
+        self.check_cancelled(force=True)
+        cnx = dbshare.system.get_cnx()
+        with cnx:
+            cnx.execute("UPDATE jobs SET progress=? WHERE iuid=?",
+                        (round(min(max(fraction, 0.0), 1.0), 3), self.iuid))
+
+    def is_cancelled(self, force=False):
+        """Has the job been cancelled? The system database is checked
+        only at intervals, unless forced.
+        """
+        if not self.cancelled:
+            now = time.monotonic()
+            if force or now - self._checked >= CANCEL_CHECK_INTERVAL:
+                self._checked = now
+                job = get_job(self.iuid)
+                self.cancelled = job is None or job['status'] == CANCELLED
+        return self.cancelled
+
+    def check_cancelled(self, force=False):
+        "Raise SystemError if the job has been cancelled."
+        if self.is_cancelled(force=force):
+            raise SystemError('job cancelled')
+
+    def execute(self, dbcnx, sql):
+        """Execute the SQL on the database connection, checking at intervals
+        whether the job has been cancelled, in which case it is interrupted.
+        Raise SystemError if cancelled.
+        """
+        self.check_cancelled(force=True)
+        dbcnx.set_progress_handler(
+            self.is_cancelled,
+            flask.current_app.config['EXECUTE_TIMEOUT_PROGRESS_STEPS'])
+        try:
+            return dbcnx.execute(sql)
+        except sqlite3.OperationalError as error:
+            if str(error) == 'interrupted':
+                raise SystemError('job cancelled')
+            raise
+        finally:
+            dbcnx.set_progress_handler(None, 0)
+
+
+def submit(kind, dbname, function, *args, owner=None, system=False):
+    """Queue a job for the worker threads of this process. The function is
+    called as 'function(job, *args)' in an application context where the
+    current user is the owner of the job; by default the user of the
+    request. If 'system' is true, the job is done on behalf of the system
+    and has no owner. The function returns a result which can be
+    serialized to JSON, or None.
+    Return the job dictionary.
+    Raise ValueError if the owner has too many jobs not yet done.
+    """
+    config = flask.current_app.config
+    if system:
+        owner = None
+    elif owner is None:
+        user = flask.g.current_user
+        owner = user and user['username']
+    cnx = dbshare.system.get_cnx()
+    fail_stale(cnx)
+    if owner:
+        sql = "SELECT COUNT(*) FROM jobs WHERE owner=? AND status IN (?, ?)"
+        count = cnx.execute(sql, (owner, QUEUED, RUNNING)).fetchone()[0]
+        if count >= config['JOB_MAX_PER_USER']:
+            raise ValueError('too many jobs not yet done; try again later')
+    job = Job(utils.get_iuid(), kind, dbname)
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+        days=config['JOB_RETENTION'])
+    with cnx:
+        cnx.execute("INSERT INTO jobs (iuid, kind, dbname, owner, status,"
+                    " progress, pid, instance, created)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job.iuid, kind, dbname, owner, QUEUED, 0.0,
+                     os.getpid(), get_instance(), utils.get_time()))
+        cnx.execute("DELETE FROM jobs WHERE created<? AND status NOT IN (?, ?)",
+                    (cutoff.isoformat(), QUEUED, RUNNING))
+    get_workers().submit(_run,
+                         flask.current_app._get_current_object(),
+                         job, owner, function, args)
+    return get_job(job.iuid)
+
+def _run(app, job, owner, function, args):
+    "Execute the job; called in a worker thread."
+    with app.app_context():
+        flask.g.current_user = owner and dbshare.user.get_user(username=owner)
+        flask.g.is_admin = bool(flask.g.current_user) and \
+                           flask.g.current_user.get('role') == constants.ADMIN
+        cnx = dbshare.system.get_cnx()
+        with cnx:
+            cursor = cnx.execute("UPDATE jobs SET status=?, started=?"
+                                 " WHERE iuid=? AND status=?",
+                                 (RUNNING, utils.get_time(), job.iuid, QUEUED))
+        if cursor.rowcount != 1: return # Cancelled while queued.
+        result = None
+        error = None
+        try:
+            result = function(job, *args)
+            status = FINISHED
+        except SystemError as exc:
+            status = CANCELLED if job.cancelled else FAILED
+            error = str(exc)
+        # Any error must be recorded; else the job would seem to run forever.
+        except Exception as exc:
+            app.logger.error(f"job {job.kind} {job.iuid} failed: {exc}")
+            status = FAILED
+            error = str(exc)
+        with cnx:
+            cnx.execute("UPDATE jobs SET status=?,"
+                        " progress=COALESCE(?, progress), result=?, error=?,"
+                        " finished=? WHERE iuid=? AND status=?",
+                        (status,
+                         1.0 if status == FINISHED else None,
+                         json.dumps(result) if result is not None else None,
+                         error,
+                         utils.get_time(),
+                         job.iuid,
+                         RUNNING))
+
+def get_workers():
+    """Return the pool of worker threads. It is created in the process
+    using it, since threads do not survive forking a worker process.
+    """
+    pid = os.getpid()
+    with _workers_lock:
+        try:
+            return _workers[pid]
+        except KeyError:
+            _workers.clear()
+            workers = concurrent.futures.ThreadPoolExecutor(
+                max_workers=flask.current_app.config['JOB_WORKERS'],
+                thread_name_prefix='job-worker')
+            _workers[pid] = workers
+            return workers
+
+def fail_stale(cnx):
+    "Set to failed the jobs not done whose process no longer exists."
+    sql = "SELECT iuid, kind, dbname, instance FROM jobs WHERE status IN (?, ?)"
+    stale = [row[:3] for row in cnx.execute(sql, (QUEUED, RUNNING))
+             if not is_alive(row[3])]
+    if not stale: return
+    with cnx:
+        cnx.executemany("UPDATE jobs SET status=?, error=?, finished=?"
+                        " WHERE iuid=? AND status IN (?, ?)",
+                        [(FAILED, 'worker process no longer exists',
+                          utils.get_time(), iuid, QUEUED, RUNNING)
+                         for iuid, kind, dbname in stale])
+    for iuid, kind, dbname in stale:
+        if kind == 'hashing':
+            dbshare.db.revert_hashing(dbname)
+
+def get_instance():
+    """Return the token identifying this process: the host name,
+    the process id and the start time of the process.
+    """
+    pid = os.getpid()
+    try:
+        return _instances[pid]
+    except KeyError:
+        _instances.clear()
+        instance = f"{socket.gethostname()}:{pid}:{get_start_time(pid)}"
+        _instances[pid] = instance
+        return instance
+
+def get_start_time(pid):
+    """Return the start time of the process, in clock ticks since boot,
+    as a string. The empty string if not available on this system.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as infile:
+            # The command name may contain spaces; it ends with ')'.
+            return infile.read().rpartition(')')[2].split()[19]
+    except (OSError, IndexError):
+        return ''
+
+def is_alive(instance):
+    """Does the process identified by the instance token exist?
+    A process on another host is assumed to exist.
+    A job recorded by a previous version has no token; its process
+    is assumed to no longer exist.
+    """
+    if not instance: return False
+    host, pid, start = instance.rsplit(':', 2)
+    if host != socket.gethostname(): return True
+    pid = int(pid)
+    if pid == os.getpid(): return instance == get_instance()
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return get_start_time(pid) == start
+
+def get_job(iuid):
+    "Return the job dictionary, or None if no such job."
+    cursor = dbshare.system.get_cursor()
+    sql = f"SELECT {JOB_COLUMNS} FROM jobs WHERE iuid=?"
+    rows = cursor.execute(sql, (iuid,)).fetchall()
+    if len(rows) != 1: return None
+    return _get_job(rows[0])
+
+def get_jobs(owner=None, dbname=None, limit=None):
+    "Return the jobs, optionally for the owner or database, the latest first."
+    criteria = []
+    values = []
+    if owner:
+        criteria.append('owner=?')
+        values.append(owner)
+    if dbname:
+        criteria.append('dbname=?')
+        values.append(dbname)
+    sql = f"SELECT {JOB_COLUMNS} FROM jobs"
+    if criteria:
+        sql += ' WHERE ' + ' AND '.join(criteria)
+    sql += ' ORDER BY created DESC'
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    cursor = dbshare.system.get_cursor()
+    rows = cursor.execute(sql, values).fetchall()
+    return [_get_job(row) for row in rows]
+
+def _get_job(row):
+    "Return the job dictionary for the row. Set to failed if stale."
+    job = {'iuid':     row[0],
+           'kind':     row[1],
+           'dbname':   row[2],
+           'owner':    row[3],
+           'status':   row[4],
+           'progress': row[5],
+           'result':   json.loads(row[6]) if row[6] else None,
+           'error':    row[7],
+           'pid':      row[8],
+           'created':  row[9],
+           'started':  row[10],
+           'finished': row[11],
+           'instance': row[12]}
+    if job['status'] in (QUEUED, RUNNING) and not is_alive(job['instance']):
+        fail_stale(dbshare.system.get_cnx())
+        job['status'] = FAILED
+        job['error'] = 'worker process no longer exists'
+    return job
+
+def is_pending(kind, dbname):
+    "Is a job of the kind for the database queued or running?"
+    cursor = dbshare.system.get_cursor()
+    sql = "SELECT COUNT(*) FROM jobs WHERE kind=? AND dbname IS ?" \
+          " AND status IN (?, ?)"
+    cursor.execute(sql, (kind, dbname, QUEUED, RUNNING))
+    return cursor.fetchone()[0] > 0
+
+def is_done(job):
+    "Has the job finished, failed or been cancelled?"
+    return job['status'] not in (QUEUED, RUNNING)
+
+def has_access(job):
+    "Does the current user have access to the job?"
+    if flask.g.is_admin: return True
+    if not flask.g.current_user: return False
+    return job['owner'] == flask.g.current_user['username']
+
+def cancel(job):
+    """Cancel the job, if not done. A running job stops when it next checks.
+    A database being hashed is set back to read-write.
+    Return True if cancelled.
+    """
+    cnx = dbshare.system.get_cnx()
+    with cnx:
+        cursor = cnx.execute("UPDATE jobs SET status=?, finished=?"
+                             " WHERE iuid=? AND status IN (?, ?)",
+                             (CANCELLED, utils.get_time(), job['iuid'],
+                              QUEUED, RUNNING))
+    if cursor.rowcount != 1: return False
+    if job['kind'] == 'hashing':
+        dbshare.db.revert_hashing(job['dbname'])
+    return True
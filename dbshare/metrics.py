@@ -0,0 +1,252 @@
+"""Instrumentation of requests; histograms of timings.
+
+The wall time of each request is recorded per endpoint, as well as the
+time spent in it on Sqlite3 (connecting and executing), on rendering
+templates and on serializing JSON. The histograms are output in the
+Prometheus text format by 'dbshare.api.metrics'.
+
+The histograms are kept in the memory of each worker process, and are
+written at intervals to the 'metrics' table of the system database,
+keyed by the instance token of the process. The output is the sum over
+all processes, so that it does not depend on which process answers the
+scrape. The rows of a process that no longer exists are added into those
+of the empty instance token, to keep the sums from decreasing.
+"""
+
+import bisect
+import contextlib
+import json
+import sqlite3
+import threading
+import time
+
+import flask
+
+import dbshare.jobs
+import dbshare.pool
+
+from . import constants
+from . import utils
+
+
+# Upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The kinds of time spent in a request, in addition to its wall time.
+KINDS = ('sqlite', 'render', 'json')
+
+HELP = {
+    'request': 'Wall time of requests.',
+    'sqlite': 'Time spent in requests connecting to and executing Sqlite3.',
+    'render': 'Time spent in requests rendering templates.',
+    'json': 'Time spent in requests serializing JSON.'
+}
+
+
+class Histogram:
+    "Thread-safe histogram of observed values, with counts per bucket."
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last is '+Inf'.
+        self.sum = 0.0
+        self.written = 0        # Number of values when last written.
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        "Add the value to the histogram."
+        pos = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[pos] += 1
+            self.sum += value
+
+    def get_values(self):
+        "Return a copy of the bucket counts, and the sum."
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+def get_histogram_lines(name, labels, counts, total):
+    """Return the lines of text for the histogram in Prometheus format,
+    given its non-cumulative bucket counts and the sum of its values.
+    """
+    result = []
+    cumulative = 0
+    bounds = [repr(b) for b in BUCKETS] + ['+Inf']
+    for bound, count in zip(bounds, counts):
+        cumulative += count
+        result.append('%s_bucket{%s,le="%s"} %s' %
+                      (name, labels, bound, cumulative))
+    result.append('%s_sum{%s} %r' % (name, labels, total))
+    result.append('%s_count{%s} %s' % (name, labels, cumulative))
+    return result
+
+
+_lock = threading.Lock()
+_histograms = dict([(kind, {}) for kind in ('request',) + KINDS])
+
+# When the histograms were last written by this process.
+_written = time.monotonic()
+
+
+def init(app):
+    "Set up the recording of timings for requests and template rendering."
+    app.before_request(start)
+    app.teardown_request(finish)
+    flask.before_render_template.connect(render_started, app)
+    flask.template_rendered.connect(render_finished, app)
+
+def start():
+    "Start the timing of the request."
+    flask.g.started = time.monotonic()
+    flask.g.timings = dict([(kind, 0.0) for kind in KINDS])
+
+def finish(exception=None):
+    """Record the wall time of the request, and the time of each kind,
+    into the histograms for its endpoint. For a streamed response,
+    this is done when the stream is done.
+    """
+    try:
+        duration = time.monotonic() - flask.g.started
+        timings = flask.g.timings
+    except AttributeError:
+        return
+    endpoint = flask.request.endpoint or ''
+    observe('request', endpoint, duration)
+    for kind, value in timings.items():
+        observe(kind, endpoint, value)
+    if time.monotonic() - _written >= \
+       flask.current_app.config['METRICS_WRITE_INTERVAL']:
+        write()
+
+def observe(kind, endpoint, value):
+    "Add the value to the histogram of the kind for the endpoint."
+    try:
+        histogram = _histograms[kind][endpoint]
+    except KeyError:
+        with _lock:
+            histogram = _histograms[kind].setdefault(endpoint, Histogram())
+    histogram.observe(value)
+
+@contextlib.contextmanager
+def timing(kind):
+    "Context manager adding the time spent within it to the current request."
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        if flask.has_request_context():
+            try:
+                flask.g.timings[kind] += time.monotonic() - started
+            except AttributeError:
+                pass
+
+def render_started(sender, template, context, **extra):
+    "Record when the rendering of a template started."
+    flask.g.render_started = time.monotonic()
+
+def render_finished(sender, template, context, **extra):
+    "Add the time spent rendering the template to the current request."
+    try:
+        flask.g.timings['render'] += time.monotonic() - flask.g.render_started
+    except AttributeError:
+        pass
+
+def write():
+    """Write the histograms of this process changed since last written
+    to the system database. A separate connection is used, since the
+    request's own may be in an unfinished transaction.
+    """
+    global _written
+    _written = time.monotonic()
+    instance = dbshare.jobs.get_instance()
+    rows = []
+    with _lock:
+        items = [(kind, endpoint, histogram)
+                 for kind in _histograms
+                 for endpoint, histogram in _histograms[kind].items()]
+    for kind, endpoint, histogram in items:
+        counts, total = histogram.get_values()
+        if sum(counts) == histogram.written: continue
+        rows.append((histogram, sum(counts),
+                     (instance, kind, endpoint, json.dumps(counts), total)))
+    if not rows: return
+    cnx = dbshare.pool.acquire(utils.dbpath(constants.SYSTEM), write=True)
+    try:
+        with cnx:
+            cnx.executemany("INSERT OR REPLACE INTO metrics (instance, kind,"
+                            " endpoint, counts, sum) VALUES (?, ?, ?, ?, ?)",
+                            [row[2] for row in rows])
+    except sqlite3.Error:       # E.g. locked; try again next interval.
+        return
+    finally:
+        dbshare.pool.release(cnx)
+    for histogram, count, row in rows:
+        histogram.written = count
+
+def retire(cnx):
+    """Add the rows of processes that no longer exist into the rows
+    of the empty instance token, and delete them.
+    """
+    cnx.execute('BEGIN IMMEDIATE')
+    try:
+        instances = [row[0] for row in
+                     cnx.execute("SELECT DISTINCT instance FROM metrics"
+                                 " WHERE instance!=''").fetchall()
+                     if not dbshare.jobs.is_alive(row[0])]
+        for instance in instances:
+            for kind, endpoint, counts, total in cnx.execute(
+                    "SELECT kind, endpoint, counts, sum FROM metrics"
+                    " WHERE instance=?", (instance,)).fetchall():
+                row = cnx.execute("SELECT counts, sum FROM metrics"
+                                  " WHERE instance='' AND kind=?"
+                                  " AND endpoint=?",
+                                  (kind, endpoint)).fetchone()
+                if row is not None:
+                    counts = json.dumps([a + b for a, b in
+                                         zip(json.loads(counts),
+                                             json.loads(row[0]))])
+                    total += row[1]
+                cnx.execute("INSERT OR REPLACE INTO metrics (instance, kind,"
+                            " endpoint, counts, sum) VALUES ('', ?, ?, ?, ?)",
+                            (kind, endpoint, counts, total))
+            cnx.execute("DELETE FROM metrics WHERE instance=?", (instance,))
+    except sqlite3.Error:
+        cnx.rollback()
+        raise
+    else:
+        cnx.commit()
+
+def get_lines(cnx):
+    """Return the lines of text for all histograms in Prometheus format,
+    summed over all processes. The histograms of this process are first
+    written to the system database.
+    """
+    write()
+    try:
+        retire(cnx)
+    except sqlite3.Error:       # E.g. locked; done at the next scrape.
+        pass
+    histograms = dict([(kind, {}) for kind in ('request',) + KINDS])
+    for kind, endpoint, counts, total in cnx.execute(
+            "SELECT kind, endpoint, counts, sum FROM metrics"):
+        if kind not in histograms: continue
+        counts = json.loads(counts)
+        try:
+            previous = histograms[kind][endpoint]
+        except KeyError:
+            histograms[kind][endpoint] = (counts, total)
+        else:
+            histograms[kind][endpoint] = (
+                [a + b for a, b in zip(previous[0], counts)],
+                previous[1] + total)
+    result = []
+    for kind in ('request',) + KINDS:
+        name = f"dbshare_{kind}_duration_seconds"
+        result.append(f"# HELP {name} {HELP[kind]}")
+        result.append(f"# TYPE {name} histogram")
+        for endpoint, (counts, total) in sorted(histograms[kind].items()):
+            result.extend(get_histogram_lines(name, f'endpoint="{endpoint}"',
+                                              counts, total))
+    return result
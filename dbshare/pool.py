@@ -0,0 +1,210 @@
+"""Process-wide pool of Sqlite3 connections.
+
+Connections are kept per database file path, separately for read-only
+and read-write (write) connections. A connection acquired during a
+request is returned to the pool when the application context ends.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+import flask
+
+import dbshare.metrics
+
+from . import utils
+
+
+_lock = threading.Lock()
+_idle = {}          # Key (path, write): list of (cnx, released time)
+_info = {}          # Connection: (key, file identity, generation)
+_generations = {}   # Path: generation number, incremented when invalidated.
+
+# Seconds to wait for a busy database in each attempt to checkpoint it.
+CHECKPOINT_BUSY_TIMEOUT = 0.1
+
+
+def init(app):
+    "Release the connections acquired in an application context at its end."
+    app.teardown_appcontext(release_all)
+
+def acquire(path, write=False):
+    """Return a connection to the database at the given path.
+    An idle connection is reused if its database file has not been
+    renamed, replaced or had its permissions changed since it was opened.
+    The time spent is added to the instrumentation of the request.
+    """
+    with dbshare.metrics.timing('sqlite'):
+        return _acquire(path, write)
+
+def _acquire(path, write):
+    "Actually return a connection to the database at the given path."
+    config = flask.current_app.config
+    key = (path, write)
+    now = time.monotonic()
+    cnx = None
+    with _lock:
+        _evict(now - config['POOL_IDLE_TIMEOUT'])
+        idle = _idle.get(key, [])
+        while idle:
+            candidate = idle.pop()[0]
+            if _is_healthy(candidate):
+                cnx = candidate
+                break
+            _close(candidate)
+    if cnx is None:
+        cnx = _open(path, write, config)
+    if flask.has_app_context():
+        flask.g.setdefault('pooled', []).append(cnx)
+    return cnx
+
+def release(cnx):
+    """Return the connection to the pool.
+    It is closed instead if it is stale or the pool for its key is full.
+    """
+    if flask.has_app_context():
+        try:
+            flask.g.pooled.remove(cnx)
+        except (AttributeError, ValueError):
+            pass
+    try:
+        if cnx.in_transaction:
+            cnx.rollback()
+        cnx.set_progress_handler(None, 0)
+    except sqlite3.Error:
+        with _lock:
+            _close(cnx)
+        return
+    with _lock:
+        try:
+            key, identity, generation = _info[cnx]
+        except KeyError:        # Not from the pool; should not happen.
+            cnx.close()
+            return
+        idle = _idle.setdefault(key, [])
+        if generation != _generations.get(key[0], 0) or \
+           len(idle) >= flask.current_app.config['POOL_MAX_IDLE']:
+            _close(cnx)
+        else:
+            idle.append((cnx, time.monotonic()))
+
+def release_all(exception=None):
+    "Release all connections acquired in the current application context."
+    for cnx in flask.g.pop('pooled', []):
+        release(cnx)
+
+def count_idle():
+    "Return the total number of idle connections in the pool."
+    with _lock:
+        return sum([len(idle) for idle in _idle.values()])
+
+def invalidate(path):
+    """Close all idle connections to the database file at the given path.
+    Connections currently in use are closed when released.
+    """
+    with _lock:
+        _generations[path] = _generations.get(path, 0) + 1
+        for write in (False, True):
+            for cnx, released in _idle.pop((path, write), []):
+                _close(cnx)
+
+def close(path):
+    """Close all idle connections to the database file at the given path,
+    and checkpoint it, truncating the WAL file, so that the single file
+    holds all content. This is retried while the database is busy, for
+    at most POOL_CHECKPOINT_TIMEOUT seconds. The journal mode is not
+    changed, since that requires the connections of all processes to be
+    closed, and those of other processes may be idle for a long time.
+    Return True if that succeeded, False if the database is in use.
+    """
+    invalidate(path)
+    if not os.path.exists(path): return True
+    deadline = time.monotonic() + \
+               flask.current_app.config['POOL_CHECKPOINT_TIMEOUT']
+    cnx = utils.get_cnx(path, write=True)
+    try:
+        cnx.execute(f"PRAGMA busy_timeout={int(CHECKPOINT_BUSY_TIMEOUT*1000)}")
+        while True:
+            try:
+                busy = cnx.execute('PRAGMA wal_checkpoint(TRUNCATE)') \
+                          .fetchone()[0]
+            except sqlite3.OperationalError: # E.g. database is locked.
+                busy = 1
+            if not busy: return True
+            if time.monotonic() >= deadline: return False
+            time.sleep(CHECKPOINT_BUSY_TIMEOUT)
+    finally:
+        cnx.close()
+
+def remove(path):
+    "Close all connections to the database file and remove it from disk."
+    invalidate(path)
+    for filepath in (path, path + '-wal', path + '-shm'):
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+
+def checkpoint(path):
+    "Transfer all content in the WAL file into the database file."
+    cnx = acquire(path, write=True)
+    try:
+        cnx.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    except sqlite3.Error:
+        pass
+    finally:
+        release(cnx)
+
+def _open(path, write, config):
+    "Open a new connection and set it up according to the configuration."
+    cnx = utils.get_cnx(path, write=write)
+    cnx.execute(f"PRAGMA cache_size={int(config['SQLITE_CACHE_SIZE'])}")
+    cnx.execute(f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}")
+    if write:
+        # Rows deleted by 'INSERT OR REPLACE' must fire the delete triggers
+        # maintaining the row counts; see 'dbshare.db.DbContext.set_counts'.
+        cnx.execute('PRAGMA recursive_triggers=ON')
+    if write and config['SQLITE_JOURNAL_MODE']:
+        try:
+            cnx.execute(f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}")
+        except sqlite3.Error:   # E.g. file is read-only.
+            pass
+    with _lock:
+        _info[cnx] = ((path, write), _identity(path), _generations.get(path, 0))
+    return cnx
+
+def _identity(path):
+    "Return the identity of the file; changes if replaced or chmod'ed."
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_mode)
+
+def _is_healthy(cnx):
+    "Is the idle connection still valid? Must be called with the lock held."
+    try:
+        key, identity, generation = _info[cnx]
+    except KeyError:
+        return False
+    if generation != _generations.get(key[0], 0): return False
+    return identity is not None and identity == _identity(key[0])
+
+def _evict(limit):
+    "Close idle connections released before the limit. Lock must be held."
+    for key in list(_idle):
+        idle = _idle[key]
+        while idle and idle[0][1] < limit:
+            _close(idle.pop(0)[0])
+        if not idle:
+            _idle.pop(key)
+
+def _close(cnx):
+    "Close the connection and forget about it. Lock must be held."
+    _info.pop(cnx, None)
+    try:
+        cnx.close()
+    except sqlite3.Error:
+        pass
@@ -1,9 +1,12 @@
 "Query HTML endpoints."
 
+import re
 import sqlite3
 
 import flask
 
+import dbshare.advisor
+import dbshare.cache
 import dbshare.db
 import dbshare.table
 import dbshare.schema.query
@@ -12,6 +15,18 @@ from . import constants
 from . import utils
 
 
+DISTINCT_RX = re.compile(r'\s*DISTINCT\b', re.IGNORECASE)
+WINDOW_RX = re.compile(r'\bOVER\s*[(\w]', re.IGNORECASE)
+
+# Words separating the sources in the FROM part of the query.
+JOIN_WORDS = frozenset(['JOIN', 'INNER', 'LEFT', 'RIGHT', 'FULL', 'OUTER',
+                        'CROSS', 'NATURAL'])
+
+# Operators comparing a column such that an index on it may be used.
+INDEXABLE_OPERATORS = frozenset(['=', '==', '<', '>', '<=', '>=',
+                                 'IN', 'IS', 'BETWEEN', 'LIKE', 'GLOB'])
+EQUALITY_OPERATORS = frozenset(['=', '==', 'IN', 'IS'])
+
 blueprint = flask.Blueprint('query', __name__)
 
 @blueprint.route('/<name:dbname>')
@@ -51,13 +66,11 @@ def rows(dbname):
             limit = flask.current_app.config['MAX_NROWS_DISPLAY']
             if query['limit'] is None or query['limit'] > limit:
                 query_limited['limit'] = limit
-            dbcnx = dbshare.db.get_cnx(dbname)
-            cursor = utils.execute_timeout(dbcnx,
-                                           get_sql_statement(query_limited))
-            rows = cursor.fetchall()
+            columns, rows = dbshare.cache.fetch(
+                db, get_sql_statement(query_limited))[:2]
             if len(rows) >= query_limited['limit']:
                 utils.flash_message_limit(limit)
-            columns = [d[0] for d in cursor.description]
+            dbshare.advisor.observe(db, query, get_sql_statement(query))
         except (KeyError, SystemError, sqlite3.Error) as error:
             utils.flash_error(error)
             return flask.redirect(
@@ -157,6 +170,107 @@ def get_from_sources(from_):
         result.append(''.join(parts))
     return result
 
+def get_from_aliases(from_):
+    """Parse out table/view names from the FROM part of the query,
+    including the sources of joins. Return a dict of the aliases and the
+    names themselves to the names, and the list of the tokens of the join
+    constraints (ON), if any.
+    """
+    aliases = {}
+    constraints = []
+    name = None
+    state = 'name'
+    previous = None
+    for token in utils.lexer(from_):
+        if token['type'] == 'WHITESPACE': continue
+        reserved = token['type'] == 'RESERVED' and token['value']
+        if token['value'] == ',' or reserved in JOIN_WORDS:
+            name = None
+            state = 'name'
+        elif reserved in ('ON', 'USING'):
+            state = 'constraint'
+        elif state == 'constraint':
+            constraints.append(token)
+        elif reserved == 'AS':
+            state = 'alias'
+        elif token['type'] == 'IDENTIFIER':
+            if name is None or (previous and previous['value'] == '.'):
+                # Schema-qualified name; the last part is the name.
+                aliases.pop(name, None)
+                name = token['value']
+                aliases[name] = name
+            else:
+                aliases[token['value']] = name
+        previous = token
+    return aliases, constraints
+
+def get_column_comparisons(tokens):
+    """Return the column references in the tokens that are compared using
+    an operator such that an index may be used. Each item is a tuple
+    (source, column, operator), where 'source' is None if not given.
+    """
+    tokens = [t for t in tokens if t['type'] != 'WHITESPACE']
+    result = []
+    pos = 0
+    while pos < len(tokens):
+        ref = _get_column_reference(tokens, pos)
+        if ref is None:
+            pos += 1
+            continue
+        source, column, end = ref
+        operator = None
+        if end < len(tokens):
+            value = str(tokens[end]['value']).upper()
+            if value in INDEXABLE_OPERATORS: operator = value
+        if operator is None and pos > 0:
+            value = str(tokens[pos-1]['value'])
+            if tokens[pos-1]['type'] == 'DELIMITER' and \
+               value in INDEXABLE_OPERATORS:
+                operator = value
+        if operator:
+            result.append((source, column, operator))
+        pos = end
+    return result
+
+def get_orderby_columns(orderby):
+    """Return the column references in the ORDER BY part of the query,
+    as tuples (source, column). Return an empty list if any of the terms
+    is not a plain column reference.
+    """
+    tokens = [t for t in utils.lexer(orderby) if t['type'] != 'WHITESPACE']
+    result = []
+    pos = 0
+    while pos < len(tokens):
+        ref = _get_column_reference(tokens, pos)
+        if ref is None: return []
+        source, column, pos = ref
+        if pos < len(tokens) and tokens[pos]['value'] in ('ASC', 'DESC'):
+            pos += 1
+        if pos < len(tokens):
+            if tokens[pos]['value'] != ',': return []
+            pos += 1
+        result.append((source, column))
+    return result
+
+def _get_column_reference(tokens, pos):
+    """Return the column reference (source, column, end position) starting
+    at the position in the tokens, or None if there is none. A function
+    call is not a column reference.
+    """
+    if tokens[pos]['type'] != 'IDENTIFIER': return None
+    if pos > 0 and tokens[pos-1]['value'] == '.': return None
+    end = pos + 1
+    if end + 1 < len(tokens) and tokens[end]['value'] == '.' and \
+       tokens[end+1]['type'] == 'IDENTIFIER':
+        source = tokens[pos]['value']
+        column = tokens[end+1]['value']
+        end += 2
+    else:
+        source = None
+        column = tokens[pos]['value']
+    if end < len(tokens) and tokens[end]['value'] == '(': return None
+    return source, column, end
+
 def get_sql_statement(query):
     """Create the SQL SELECT statement from the query parts.
     Raises jsonschema.ValidationError if the query is invalid.
@@ -172,3 +286,53 @@ def get_sql_statement(query):
         if query.get('offset'):
             parts.append("OFFSET %s" % query['offset'])
     return ' '.join(parts)
+
+def get_page_sql(query, db, position):
+    """Create the SQL SELECT statement and its parameters for a page of
+    the query result, starting at the given position. The page size is
+    the query's 'limit'; one more row is fetched to tell if there are more.
+    If the query selects from one table, without DISTINCT, window
+    function, ORDER BY or OFFSET, then keyset pagination on the rowid
+    is used; the rowid is added as the last column of the result.
+    Otherwise the position is an offset.
+    Return the tuple (sql, params, keyset).
+    Raises jsonschema.ValidationError if the query is invalid.
+    Raises ValueError if the position is invalid.
+    """
+    utils.json_validate(query, dbshare.schema.query.input)
+    tablename = query['from'].strip()
+    if tablename.startswith('"') and tablename.endswith('"'):
+        tablename = tablename[1:-1]
+    keyset = tablename in db['tables'] and \
+             not query.get('orderby') and \
+             not query.get('offset') and \
+             not DISTINCT_RX.match(query['select']) and \
+             not WINDOW_RX.search(query['select'])
+    criteria = []
+    if query.get('where'):
+        criteria.append(f"({query['where']})")
+    params = []
+    if keyset:
+        parts = ["SELECT {select}, rowid FROM {from}".format(**query)]
+        if 'rowid' in position:
+            if not isinstance(position['rowid'], int):
+                raise ValueError('invalid cursor')
+            criteria.append('rowid>?')
+            params.append(position['rowid'])
+    else:
+        parts = ["SELECT {select} FROM {from}".format(**query)]
+    if criteria:
+        parts.append('WHERE ' + ' AND '.join(criteria))
+    if keyset:
+        parts.append('ORDER BY rowid LIMIT ?')
+        params.append(query['limit'] + 1)
+    else:
+        if query.get('orderby'):
+            parts.append('ORDER BY ' + query['orderby'])
+        offset = position.get('offset', 0)
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError('invalid cursor')
+        parts.append('LIMIT ? OFFSET ?')
+        params.append(query['limit'] + 1)
+        params.append((query.get('offset') or 0) + offset)
+    return ' '.join(parts), params, keyset
@@ -0,0 +1,47 @@
+"Index advisor API JSON schema."
+
+from .. import constants
+
+
+schema = {
+    '$id': '/advice',
+    '$schema': constants.JSON_SCHEMA_URL,
+    'title': 'Index advisor API JSON schema.',
+    'type': 'object',
+    'properties': {
+        '$id': {'type': 'string', 'format': 'uri'},
+        'timestamp': {'type': 'string', 'format': 'date-time'},
+        'name': {'type': 'string'},
+        'autoindex': {'type': 'boolean'},
+        'advice': {
+            'title': 'The recommended indexes, the most often observed first.',
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'table': {'type': 'string'},
+                    'columns': {'type': 'array',
+                                'items': {'type': 'string'},
+                                'minItems': 1},
+                    'count': {'type': 'integer', 'minimum': 0},
+                    'sql': {'type': 'string'},
+                    'before': {'type': ['number', 'null']},
+                    'after': {'type': ['number', 'null']},
+                    'last': {'type': ['string', 'null']},
+                    'views': {'type': 'array', 'items': {'type': 'string'}}
+                },
+                'required': ['table', 'columns', 'count', 'sql',
+                             'before', 'after', 'last', 'views'],
+                'additionalProperties': False
+            }
+        }
+    },
+    'required': [
+        '$id',
+        'timestamp',
+        'name',
+        'autoindex',
+        'advice'
+    ],
+    'additionalProperties': False
+}
@@ -0,0 +1,95 @@
+"Access analytics API JSON schema."
+
+from .. import constants
+
+
+latency = {
+    'mean_latency_ms': {'type': 'number'},
+    'max_latency_ms': {'type': 'number'}
+}
+
+schema = {
+    '$id': '/analytics',
+    '$schema': constants.JSON_SCHEMA_URL,
+    'title': 'Access analytics API JSON schema.',
+    'type': 'object',
+    'properties': {
+        '$id': {'type': 'string', 'format': 'uri'},
+        'timestamp': {'type': 'string', 'format': 'date-time'},
+        'title': {'type': 'string'},
+        'period': {
+            'type': 'object',
+            'properties': {
+                'days': {'type': 'integer', 'minimum': 1},
+                'hours': {'type': 'integer', 'minimum': 1},
+                'since': {'type': 'string'}
+            },
+            'required': ['since'],
+            'additionalProperties': False
+        },
+        'total': {
+            'type': 'object',
+            'properties': dict(count={'type': 'integer'}, **latency),
+            'required': ['count'],
+            'additionalProperties': False
+        },
+        'databases': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': dict(name={'type': ['string', 'null']},
+                                   count={'type': 'integer'},
+                                   **latency),
+                'required': ['name', 'count'],
+                'additionalProperties': False
+            }
+        },
+        'endpoints': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': dict(name={'type': ['string', 'null']},
+                                   count={'type': 'integer'},
+                                   **latency),
+                'required': ['name', 'count'],
+                'additionalProperties': False
+            }
+        },
+        'users': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'username': {'type': ['string', 'null']},
+                    'count': {'type': 'integer'}
+                },
+                'required': ['username', 'count'],
+                'additionalProperties': False
+            }
+        },
+        'status_codes': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'status_code': {'type': 'integer'},
+                    'count': {'type': 'integer'}
+                },
+                'required': ['status_code', 'count'],
+                'additionalProperties': False
+            }
+        }
+    },
+    'required': [
+        '$id',
+        'timestamp',
+        'title',
+        'period',
+        'total',
+        'databases',
+        'endpoints',
+        'users',
+        'status_codes'
+    ],
+    'additionalProperties': False
+}
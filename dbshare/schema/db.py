@@ -27,6 +27,9 @@ schema = {
         'modified': {'type': 'string', 'format': 'date-time'},
         'created': {'type': 'string', 'format': 'date-time'},
         'hashes': definitions.hashes,
+        'advice': {
+            'title': 'Link to the indexes recommended by the index advisor.',
+            '$ref': '#/definitions/link'},
         'tables': {
             'title': 'The list of tables in the database.',
             'type': 'array',
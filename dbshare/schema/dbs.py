@@ -17,7 +17,17 @@ schema = {
         'timestamp': {'type': 'string', 'format': 'date-time'},
         'title': {'type': 'string'},
         'user': {'$ref': '#/definitions/user'},
+        'count': {'type': 'integer', 'minimum': 0},
         'total_size': {'type': 'integer', 'minimum': 0},
+        'cursor': {'type': 'string'},
+        'next': {
+            'type': 'object',
+            'properties': {
+                'href': {'type': 'string', 'format': 'uri'}
+            },
+            'required': ['href'],
+            'additionalProperties': False
+        },
         'databases': {
             'type': 'array',
             'items': {
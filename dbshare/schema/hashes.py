@@ -0,0 +1,50 @@
+"Content hashes status API JSON schema."
+
+from .. import constants
+from . import definitions
+
+
+schema = {
+    '$id': '/hashes',
+    '$schema': constants.JSON_SCHEMA_URL,
+    'title': 'Content hashes status API JSON schema.',
+    'type': 'object',
+    'properties': {
+        '$id': {'type': 'string', 'format': 'uri'},
+        'timestamp': {'type': 'string', 'format': 'date-time'},
+        'name': {'type': 'string'},
+        'database': definitions.link,
+        'status': {
+            'title': "'none' if read-write, 'computing' while being"
+                     " computed in the background, else 'done'.",
+            'type': 'string',
+            'enum': ['none', 'computing', 'done']
+        },
+        'hashes': definitions.hashes,
+        'verified': {
+            'title': 'The recorded hash values compared with recomputed ones.',
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'hashname': {'type': 'string'},
+                    'recorded': {'type': ['string', 'null']},
+                    'computed': {'type': ['string', 'null']},
+                    'match': {'type': 'boolean'}
+                },
+                'required': ['hashname', 'recorded', 'computed', 'match'],
+                'additionalProperties': False
+            }
+        },
+        'valid': {'type': 'boolean'}
+    },
+    'required': [
+        '$id',
+        'timestamp',
+        'name',
+        'database',
+        'status',
+        'hashes'
+    ],
+    'additionalProperties': False
+}
@@ -0,0 +1,106 @@
+"Background jobs API JSON schemas."
+
+from .. import constants
+from . import definitions
+
+
+job_properties = {
+    'iuid': {'type': 'string'},
+    'href': {'type': 'string', 'format': 'uri'},
+    'kind': {
+        'title': 'The operation performed by the job.',
+        'type': 'string',
+        'enum': ['vacuum', 'analyze', 'hashing', 'export', 'create',
+                 'load', 'clone', 'autoindex', 'reconcile']
+    },
+    'database': {
+        'oneOf': [
+            {'type': 'null'},
+            {'type': 'object',
+             'properties': {
+                 'name': {'type': 'string'},
+                 'href': {'type': 'string', 'format': 'uri'}
+             },
+             'required': ['name', 'href'],
+             'additionalProperties': False}
+        ]
+    },
+    'owner': {'type': ['string', 'null']},
+    'status': {
+        'type': 'string',
+        'enum': ['queued', 'running', 'finished', 'failed', 'cancelled']
+    },
+    'progress': {
+        'title': 'Fraction done, if reported by the job.',
+        'type': ['number', 'null'],
+        'minimum': 0,
+        'maximum': 1
+    },
+    'result': {
+        'title': 'Result of the job, depending on its kind.',
+        'type': ['object', 'null']
+    },
+    'error': {'type': ['string', 'null']},
+    'created': {'type': 'string', 'format': 'date-time'},
+    'started': {'type': ['string', 'null'], 'format': 'date-time'},
+    'finished': {'type': ['string', 'null'], 'format': 'date-time'},
+    'result_link': {
+        'title': 'Link to the resource produced or changed by the job.',
+        **definitions.link
+    },
+    'cancel': {
+        'title': 'Link to cancel the job, if not done.',
+        'type': 'object',
+        'properties': {
+            'href': {'type': 'string', 'format': 'uri'},
+            'method': {'type': 'string', 'enum': ['POST']}
+        },
+        'required': ['href', 'method'],
+        'additionalProperties': False
+    }
+}
+
+job_required = ['iuid', 'href', 'kind', 'database', 'owner', 'status',
+                'progress', 'result', 'error', 'created', 'started',
+                'finished']
+
+job = {
+    '$id': '/job',
+    '$schema': constants.JSON_SCHEMA_URL,
+    'title': 'Background job API JSON schema.',
+    'type': 'object',
+    'properties': dict(job_properties,
+                       **{'$id': {'type': 'string', 'format': 'uri'},
+                          'timestamp': {'type': 'string',
+                                        'format': 'date-time'}}),
+    'required': ['$id', 'timestamp'] + job_required,
+    'additionalProperties': False
+}
+
+jobs = {
+    '$id': '/jobs',
+    '$schema': constants.JSON_SCHEMA_URL,
+    'title': 'Background jobs list API JSON schema.',
+    'type': 'object',
+    'properties': {
+        '$id': {'type': 'string', 'format': 'uri'},
+        'timestamp': {'type': 'string', 'format': 'date-time'},
+        'title': {'type': 'string'},
+        'jobs': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': job_properties,
+                'required': job_required,
+                'additionalProperties': False
+            }
+        }
+    },
+    'required': [
+        '$id',
+        'timestamp',
+        'title',
+        'jobs'
+    ],
+    'additionalProperties': False
+}
@@ -0,0 +1,63 @@
+"Content hash lookup API JSON schemas."
+
+from .. import constants
+
+
+input = {
+    '$id': '/lookup/input',
+    '$schema': constants.JSON_SCHEMA_URL,
+    'title': 'Content hash lookup input API JSON schema.',
+    'type': 'object',
+    'properties': {
+        'hashes': {
+            'title': "Hash values, optionally prefixed by the hash name"
+                     " and a colon, e.g. 'md5:...'.",
+            'type': 'array',
+            'items': {'type': 'string'}
+        }
+    },
+    'required': ['hashes'],
+    'additionalProperties': False
+}
+
+output = {
+    '$id': '/lookup/output',
+    '$schema': constants.JSON_SCHEMA_URL,
+    'title': 'Content hash lookup output API JSON schema.',
+    'type': 'object',
+    'properties': {
+        '$id': {'type': 'string', 'format': 'uri'},
+        'timestamp': {'type': 'string', 'format': 'date-time'},
+        'title': {'type': 'string'},
+        'hashes': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'hash': {'type': 'string'},
+                    'database': {
+                        'oneOf': [
+                            {'type': 'null'},
+                            {'type': 'object',
+                             'properties': {
+                                 'name': {'type': 'string'},
+                                 'href': {'type': 'string', 'format': 'uri'}
+                             },
+                             'required': ['name', 'href'],
+                             'additionalProperties': False}
+                        ]
+                    }
+                },
+                'required': ['hash', 'database'],
+                'additionalProperties': False
+            }
+        }
+    },
+    'required': [
+        '$id',
+        'timestamp',
+        'title',
+        'hashes'
+    ],
+    'additionalProperties': False
+}
@@ -25,7 +25,8 @@ query = {
         'columns': {
             'type': 'array',
             'items': {'type': 'string'}
-        }
+        },
+        'cursor': {'type': 'string'}
     },
     'required': [
         'select',
@@ -56,6 +57,8 @@ output = {
             'items': {'type': 'string'}
         },
         'cpu_time': {'type': 'number', 'mimimum': 0.0},
+        'cursor': {'type': 'string'},
+        'next': query,
         'data': {
             'type': 'array',
             'items': {'type': 'object'}
@@ -52,6 +52,18 @@ schema = {
             'required': ['all'],
             'additionalProperties': False
         },
+        'analytics': {
+            'title': 'Link to the access analytics.',
+            '$ref': '#/definitions/link'},
+        'metrics': {
+            'title': 'Link to the metrics in Prometheus text format.',
+            '$ref': '#/definitions/link'},
+        'slowqueries': {
+            'title': 'Link to the slow-query log.',
+            '$ref': '#/definitions/link'},
+        'jobs': {
+            'title': 'Link to the background jobs of the current user.',
+            '$ref': '#/definitions/link'},
         'user': definitions.user,
         'operations': definitions.operations
     },
@@ -25,6 +25,14 @@ schema = {
                 {'type': 'integer', 'minimum': 0}
             ]
         },
+        'cursor': {'type': 'string'},
+        'next': {
+            'type': 'object',
+            'properties': {
+                'href': {'type': 'string', 'format': 'uri'}
+            },
+            'required': ['href']
+        },
         'data': {
             'type': 'array',
             'items': {'type': 'object'}
@@ -0,0 +1,49 @@
+"Slow-query log API JSON schema."
+
+from .. import constants
+
+
+schema = {
+    '$id': '/slowqueries',
+    '$schema': constants.JSON_SCHEMA_URL,
+    'title': 'Slow-query log API JSON schema.',
+    'type': 'object',
+    'properties': {
+        '$id': {'type': 'string', 'format': 'uri'},
+        'timestamp': {'type': 'string', 'format': 'date-time'},
+        'title': {'type': 'string'},
+        'threshold': {'type': ['number', 'null']},
+        'queries': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'dbname': {'type': ['string', 'null']},
+                    'sql': {'type': 'string'},
+                    'count': {'type': 'integer'},
+                    'max_elapsed': {'type': 'number'},
+                    'mean_elapsed': {'type': 'number'},
+                    'nrows': {'type': ['integer', 'null']},
+                    'interrupted': {'type': 'integer'},
+                    'username': {'type': ['string', 'null']},
+                    'plan': {'type': 'array', 'items': {'type': 'string'}},
+                    'full_scans': {'type': 'array',
+                                   'items': {'type': 'string'}},
+                    'latest': {'type': 'string', 'format': 'date-time'}
+                },
+                'required': ['dbname', 'sql', 'count', 'max_elapsed',
+                             'mean_elapsed', 'nrows', 'interrupted',
+                             'username', 'plan', 'full_scans', 'latest'],
+                'additionalProperties': False
+            }
+        }
+    },
+    'required': [
+        '$id',
+        'timestamp',
+        'title',
+        'threshold',
+        'queries'
+    ],
+    'additionalProperties': False
+}
@@ -35,6 +35,9 @@ columns = {
     }
 }
 
+statistics_mode = {'type': 'string',
+                   'enum': list(constants.STATISTICS_MODES)}
+
 indexes = {
     'type': 'array',
     'items': {
@@ -69,6 +72,7 @@ schema = {
         'rows': {'$ref': '#/definitions/link'},
         'data': {'$ref': '#/definitions/link'},
         'statistics': {'$ref': '#/definitions/link'},
+        'statistics_mode': statistics_mode,
         'columns': columns,
         'indexes': indexes,
         'charts': definitions.charts
@@ -102,6 +106,7 @@ statistics = {
         'rows': {'$ref': '#/definitions/link'},
         'data': {'$ref': '#/definitions/link'},
         'href': {'type': 'string', 'format': 'uri'},
+        'statistics_mode': statistics_mode,
         'columns': columns
     },
     'required': [
@@ -145,3 +150,48 @@ input = {
     },
     'required': ['data']
 }
+
+insert_summary = {
+    '$id': '/table/insert/summary',
+    '$schema': constants.JSON_SCHEMA_URL,
+    'title': 'Table NDJSON data insert summary API JSON schema.',
+    'type': 'object',
+    'properties': {
+        '$id': {'type': 'string', 'format': 'uri'},
+        'timestamp': {'type': 'string', 'format': 'date-time'},
+        'name': {'type': 'string'},
+        'href': {'type': 'string', 'format': 'uri'},
+        'on_conflict': {
+            'oneOf': [{'type': 'null'},
+                      {'type': 'string',
+                       'enum': list(constants.ON_CONFLICT_ACTIONS)}]
+        },
+        'records': {'type': 'integer', 'minimum': 0},
+        'nrows': {'type': 'integer', 'minimum': 0},
+        'seconds': {'type': 'number', 'minimum': 0},
+        'batches': {
+            'type': 'array',
+            'items': {
+                'type': 'object',
+                'properties': {
+                    'records': {'type': 'integer', 'minimum': 0},
+                    'seconds': {'type': 'number', 'minimum': 0}
+                },
+                'required': ['records', 'seconds'],
+                'additionalProperties': False
+            }
+        }
+    },
+    'required': [
+        '$id',
+        'timestamp',
+        'name',
+        'href',
+        'on_conflict',
+        'records',
+        'nrows',
+        'seconds',
+        'batches'
+    ],
+    'additionalProperties': False
+}
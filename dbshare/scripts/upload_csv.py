@@ -35,21 +35,16 @@ with dbshare.app.app.app_context():
         if utils.name_in_nocase(tablename, db['tables']):
             raise ValueError('table name already in use')
         delimiter = delimiters[args.delimiter]['char']
-        # Read the file; eliminate empty records.
-        records = [r for r in csv.reader(infile, delimiter=delimiter) if r]
-        if not records:
-            raise ValueError('empty CSV file')
-        # Change empty string items to None.
-        for record in records:
-            for i, item in enumerate(record):
-                if item == '':
-                    record[i] = None
-        with open(args.filename, newline='') as infile:
+        def progress(count):
+            print(f"{count} records...", file=sys.stderr)
+        with open(args.filename, 'rb') as infile:
+            records = utils.CsvRecords(infile, delimiter=delimiter)
             with dbshare.db.DbContext(db) as ctx:
-                ctx.create_table_load_records(tablename,
-                                              records,
-                                              has_header=args.header)
+                count = ctx.create_table_load_records(tablename,
+                                                      records,
+                                                      has_header=args.header,
+                                                      progress=progress)
     except (ValueError, IOError) as error:
         sys.exit(f"Error: {str(error)}")
-    print(f"Loaded {len(records)} records into table {tablename}"
+    print(f"Loaded {count} records into table {tablename}"
           f" in database {args.dbname}.")
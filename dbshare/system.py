@@ -1,12 +1,22 @@
 "System database; metadata key/value, users, db list."
 
+import atexit
 import datetime
+import json
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
 
 import flask
 
 import dbshare
 import dbshare.db
+import dbshare.jobs
+import dbshare.metrics
+import dbshare.pool
 
 from . import constants
 from . import utils
@@ -26,7 +36,59 @@ SYSTEM_TABLES = [
                   dict(name='time', type=constants.TEXT),
                   dict(name='method', type=constants.TEXT),
                   dict(name='path', type=constants.TEXT),
-                  dict(name='status_code', type=constants.INTEGER)
+                  dict(name='status_code', type=constants.INTEGER),
+                  dict(name='endpoint', type=constants.TEXT),
+                  dict(name='duration', type=constants.REAL),
+                  dict(name='sqlite_duration', type=constants.REAL),
+                  dict(name='render_duration', type=constants.REAL),
+                  dict(name='json_duration', type=constants.REAL)
+         ]
+    ),
+    dict(name='access_hourly',
+         columns=[dict(name='period', type=constants.TEXT, primarykey=True),
+                  dict(name='dbname', type=constants.TEXT, primarykey=True),
+                  dict(name='endpoint', type=constants.TEXT, primarykey=True),
+                  dict(name='username', type=constants.TEXT, primarykey=True),
+                  dict(name='status_code', type=constants.INTEGER,
+                       primarykey=True),
+                  dict(name='count', type=constants.INTEGER, notnull=True),
+                  dict(name='duration', type=constants.REAL, notnull=True),
+                  dict(name='duration_max', type=constants.REAL, notnull=True)
+         ]
+    ),
+    dict(name='access_daily',
+         columns=[dict(name='period', type=constants.TEXT, primarykey=True),
+                  dict(name='dbname', type=constants.TEXT, primarykey=True),
+                  dict(name='endpoint', type=constants.TEXT, primarykey=True),
+                  dict(name='username', type=constants.TEXT, primarykey=True),
+                  dict(name='status_code', type=constants.INTEGER,
+                       primarykey=True),
+                  dict(name='count', type=constants.INTEGER, notnull=True),
+                  dict(name='duration', type=constants.REAL, notnull=True),
+                  dict(name='duration_max', type=constants.REAL, notnull=True)
+         ]
+    ),
+    dict(name='slow_queries',
+         columns=[dict(name='dbname', type=constants.TEXT),
+                  dict(name='sql', type=constants.TEXT, notnull=True),
+                  dict(name='username', type=constants.TEXT),
+                  dict(name='elapsed', type=constants.REAL, notnull=True),
+                  dict(name='nrows', type=constants.INTEGER),
+                  dict(name='interrupted', type=constants.INTEGER,
+                       notnull=True),
+                  dict(name='plan', type=constants.TEXT, notnull=True),
+                  dict(name='timestamp', type=constants.TEXT, notnull=True)
+         ]
+    ),
+    dict(name='index_advice',
+         columns=[dict(name='dbname', type=constants.TEXT, primarykey=True),
+                  dict(name='tablename', type=constants.TEXT, primarykey=True),
+                  dict(name='columns', type=constants.TEXT, primarykey=True),
+                  dict(name='count', type=constants.INTEGER, notnull=True),
+                  dict(name='sql', type=constants.TEXT, notnull=True),
+                  dict(name='before', type=constants.REAL),
+                  dict(name='after', type=constants.REAL),
+                  dict(name='last', type=constants.TEXT, notnull=True)
          ]
     ),
     dict(name='users',
@@ -58,7 +120,9 @@ SYSTEM_TABLES = [
                   dict(name='public', type=constants.INTEGER, notnull=True),
                   dict(name='readonly', type=constants.INTEGER, notnull=True),
                   dict(name='created', type=constants.TEXT, notnull=True),
-                  dict(name='modified', type=constants.TEXT, notnull=True)
+                  dict(name='modified', type=constants.TEXT, notnull=True),
+                  dict(name='autoindex', type=constants.INTEGER),
+                  dict(name='size', type=constants.INTEGER)
          ]
     ),
     dict(name='dbs_hashes',
@@ -76,25 +140,101 @@ SYSTEM_TABLES = [
                   dict(name='timestamp', type=constants.TEXT, notnull=True)
          ]
     ),
+    dict(name='usage',
+         columns=[dict(name='username', type=constants.TEXT, primarykey=True),
+                  dict(name='ndbs', type=constants.INTEGER, notnull=True),
+                  dict(name='size', type=constants.INTEGER, notnull=True)
+         ]
+    ),
+    dict(name='metrics',
+         columns=[dict(name='instance', type=constants.TEXT, primarykey=True),
+                  dict(name='kind', type=constants.TEXT, primarykey=True),
+                  dict(name='endpoint', type=constants.TEXT, primarykey=True),
+                  dict(name='counts', type=constants.TEXT, notnull=True),
+                  dict(name='sum', type=constants.REAL, notnull=True)
+         ]
+    ),
+    dict(name='jobs',
+         columns=[dict(name='iuid', type=constants.TEXT, primarykey=True),
+                  dict(name='kind', type=constants.TEXT, notnull=True),
+                  dict(name='dbname', type=constants.TEXT),
+                  dict(name='owner', type=constants.TEXT),
+                  dict(name='status', type=constants.TEXT, notnull=True),
+                  dict(name='progress', type=constants.REAL),
+                  dict(name='result', type=constants.TEXT),
+                  dict(name='error', type=constants.TEXT),
+                  dict(name='pid', type=constants.INTEGER, notnull=True),
+                  dict(name='created', type=constants.TEXT, notnull=True),
+                  dict(name='started', type=constants.TEXT),
+                  dict(name='finished', type=constants.TEXT),
+                  dict(name='instance', type=constants.TEXT)
+         ]
+    ),
 ]
 
+# Triggers maintaining the usage ledger; the number of databases and
+# their total size per user, from the file sizes kept in 'dbs'.
+SYSTEM_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS usage_insert AFTER INSERT ON dbs BEGIN"
+    " INSERT INTO usage (username, ndbs, size)"
+    " VALUES (new.owner, 1, COALESCE(new.size, 0))"
+    " ON CONFLICT (username) DO UPDATE"
+    " SET ndbs=ndbs+1, size=size+excluded.size; END",
+    "CREATE TRIGGER IF NOT EXISTS usage_delete AFTER DELETE ON dbs BEGIN"
+    " UPDATE usage SET ndbs=ndbs-1, size=size-COALESCE(old.size, 0)"
+    " WHERE username=old.owner; END",
+    "CREATE TRIGGER IF NOT EXISTS usage_update"
+    " AFTER UPDATE OF owner, size ON dbs BEGIN"
+    " UPDATE usage SET ndbs=ndbs-1, size=size-COALESCE(old.size, 0)"
+    " WHERE username=old.owner;"
+    " INSERT INTO usage (username, ndbs, size)"
+    " VALUES (new.owner, 1, COALESCE(new.size, 0))"
+    " ON CONFLICT (username) DO UPDATE"
+    " SET ndbs=ndbs+1, size=size+excluded.size; END"
+]
+
+# When the usage ledger was last checked for reconciliation by this process.
+_usage_checked = time.monotonic()
+
 SYSTEM_INDEXES = [
     dict(name='users_email', table='users', columns=['email'], unique=True),
     dict(name='users_apikey', table='users', columns=['apikey']),
     dict(name='users_logs_username', table='users_logs', columns=['username']),
     dict(name='dbs_logs_id', table='dbs_logs', columns=['name']),
+    dict(name='dbs_hashes_name', table='dbs_hashes', columns=['name']),
     dict(name='access_logs_remote_addr', table='access_logs', columns=['remote_addr']),
     dict(name='access_logs_username', table='access_logs', columns=['username']),
     dict(name='access_logs_dbname', table='access_logs', columns=['dbname']),
     dict(name='access_logs_date', table='access_logs', columns=['date']),
+    dict(name='slow_queries_dbname', table='slow_queries', columns=['dbname']),
+    dict(name='slow_queries_timestamp', table='slow_queries',
+         columns=['timestamp']),
+    dict(name='jobs_owner', table='jobs', columns=['owner', 'status']),
+    dict(name='jobs_dbname', table='jobs', columns=['dbname']),
+    dict(name='jobs_created', table='jobs', columns=['created']),
 ]
 
+# Query plan lines for a scan of a whole table, not using any index,
+# or for building a transient index on a table, since none exists.
+FULL_SCAN_RX = re.compile(r'^SCAN (?:TABLE )?("[^"]+"|[^ ("]\S*)(?: AS \S+)?$')
+AUTOMATIC_INDEX_RX = re.compile(r'^SEARCH (?:TABLE )?("[^"]+"|\S+)'
+                                r'(?: AS \S+)? USING AUTOMATIC')
+
+# Query plan line for a subquery or CTE; scanning it is not a table scan.
+SUBQUERY_RX = re.compile(r'^(?:CO-ROUTINE|MATERIALIZE) (?:SUBQUERY )?(\S+)')
+
+# SQL clauses for which an index may avoid a full scan.
+INDEXABLE_RX = re.compile(r'\b(WHERE|JOIN|ORDER\s+BY|GROUP\s+BY)\b', re.I)
+
 def get_cnx():
-    "Return the existing connection to the system database, else a new one."
+    """Return the existing connection to the system database,
+    else one from the pool.
+    """
     try:
         return flask.g.cnx
     except AttributeError:
-        flask.g.cnx = utils.get_cnx(utils.dbpath(constants.SYSTEM), write=True)
+        flask.g.cnx = dbshare.pool.acquire(utils.dbpath(constants.SYSTEM),
+                                           write=True)
         return flask.g.cnx
 
 def get_cursor():
@@ -102,42 +242,361 @@ def get_cursor():
     return get_cnx().cursor()
 
 def log_access(response):
-    "Add log entry for an access after response has been prepared."
+    """Add log entry for an access after response has been prepared.
+    The entry is written later by the access logger thread.
+    """
     # Skip if logging turned off.
-    if not flask.current_app.config['LOG_ACCESS']:
+    if ACCESS_LOGGER is None:
         return response
     # Skip if access to '/static*'.
     if flask.request.path.startswith('/static'):
         return response
-    cnx = get_cnx()
+    if flask.g.current_user:
+        username = flask.g.current_user['username']
+    else:
+        username = None
+    try:
+        duration = time.monotonic() - flask.g.started
+    except AttributeError:
+        duration = None
+    if flask.current_app.config['LOG_ACCESS_TIMINGS']:
+        timings = tuple([flask.g.timings.get(kind)
+                         for kind in dbshare.metrics.KINDS])
+    else:
+        timings = (None,) * len(dbshare.metrics.KINDS)
+    dt = datetime.datetime.utcnow()
+    ACCESS_LOGGER.put((flask.request.remote_addr,
+                       username,
+                       getattr(flask.g, 'dbname', None),
+                       dt.date().isoformat(),
+                       dt.time().replace(microsecond=0).isoformat(),
+                       flask.request.method,
+                       flask.request.path,
+                       response.status_code,
+                       flask.request.endpoint,
+                       duration) + timings)
+    return response
+
+def write_slow_queries(exception=None):
+    """Write the slow-query entries of the request, if any, to the system
+    database, and remove entries older than the retention period.
+    A separate connection is used, since the request's own may be in
+    an unfinished transaction.
+    """
+    entries = flask.g.pop('slow_queries', None)
+    if not entries: return
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+        days=flask.current_app.config['SLOW_QUERY_RETENTION'])
+    cnx = dbshare.pool.acquire(utils.dbpath(constants.SYSTEM), write=True)
+    try:
+        with cnx:
+            cnx.executemany("INSERT INTO slow_queries (dbname, sql, username,"
+                            " elapsed, nrows, interrupted, plan, timestamp)"
+                            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            [(e['dbname'], e['sql'], e['username'],
+                              e['elapsed'], e['nrows'], int(e['interrupted']),
+                              json.dumps(e['plan']), e['timestamp'])
+                             for e in entries])
+            cnx.execute("DELETE FROM slow_queries WHERE timestamp<?",
+                        (cutoff.isoformat(),))
+    except sqlite3.Error:       # E.g. locked; the entries are lost.
+        pass
+    finally:
+        dbshare.pool.release(cnx)
+
+def reconcile_usage_if_due():
+    """Submit a job to reconcile the usage ledger against the file system,
+    if not done by any process within the configured interval, and no such
+    job is pending. The interval is first checked against the time this
+    process last looked, to avoid a query.
+    """
+    global _usage_checked
+    interval = flask.current_app.config['USAGE_RECONCILE_INTERVAL']
+    if time.monotonic() - _usage_checked < interval: return
+    _usage_checked = time.monotonic()
+    try:
+        row = get_cnx().execute("SELECT value FROM meta WHERE key=?",
+                                ('usage_reconciled',)).fetchone()
+        if row is not None and time.time() - float(row[0]) < interval: return
+        if dbshare.jobs.is_pending('reconcile', None): return
+        dbshare.jobs.submit('reconcile', None, _reconcile_usage, system=True)
+    except sqlite3.Error:       # E.g. locked; try again next interval.
+        pass
+
+def _reconcile_usage(job):
+    "Reconcile the usage ledger; executed as a job."
+    reconcile_usage(get_cnx(), flask.current_app.config['DATABASES_DIRPATH'])
+
+def reconcile_usage(cnx, dirpath):
+    """Set the sizes of the databases in 'dbs' from their files, and
+    rebuild the usage ledger from them. Databases and files may have been
+    changed without going through the application.
+    The time of reconciliation is kept in the 'meta' table.
+    """
+    sizes = []
+    for name, size in cnx.execute("SELECT name, size FROM dbs").fetchall():
+        try:
+            actual = os.path.getsize(utils.dbpath(name, dirpath=dirpath))
+        except OSError:
+            continue
+        if actual != size:
+            sizes.append((actual, name))
     with cnx:
-        sql = "INSERT INTO access_logs (remote_addr, username," \
-              " dbname, date, time, method, path, status_code)" \
-              " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
-        if flask.g.current_user:
-            username = flask.g.current_user['username']
+        cnx.executemany("UPDATE dbs SET size=? WHERE name=?", sizes)
+        cnx.execute("DELETE FROM usage")
+        cnx.execute("INSERT INTO usage (username, ndbs, size)"
+                    " SELECT owner, COUNT(*), COALESCE(SUM(size), 0)"
+                    " FROM dbs GROUP BY owner")
+        cnx.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    ('usage_reconciled', repr(time.time())))
+
+def get_slow_queries(limit, dbname=None):
+    """Return the slowest statements in the slow-query log, grouped by
+    database and SQL, with the query plan and user of the latest one.
+    Tables scanned in full, or given a transient index, by a statement
+    having a clause that an index could serve are given in 'full_scans'.
+    """
+    # The latest entry of each group is the one numbered 1.
+    sql = "WITH q AS (SELECT *, ROW_NUMBER() OVER (PARTITION BY dbname, sql" \
+          " ORDER BY timestamp DESC, rowid DESC) AS number FROM slow_queries"
+    params = []
+    if dbname:
+        sql += " WHERE dbname=?"
+        params.append(dbname)
+    sql += ") SELECT dbname, sql, COUNT(*), MAX(elapsed), AVG(elapsed)," \
+           " MAX(nrows), SUM(interrupted)," \
+           " MAX(CASE WHEN number=1 THEN username END)," \
+           " MAX(CASE WHEN number=1 THEN plan END), MAX(timestamp)" \
+           " FROM q GROUP BY dbname, sql ORDER BY 4 DESC LIMIT ?"
+    params.append(limit)
+    result = []
+    for row in get_cnx().execute(sql, params):
+        plan = json.loads(row[8])
+        full_scans = []
+        if INDEXABLE_RX.search(row[1]):
+            subqueries = set()
+            for line in plan:
+                match = SUBQUERY_RX.match(line.strip())
+                if match:
+                    subqueries.add(match.group(1))
+            for line in plan:
+                match = FULL_SCAN_RX.match(line.strip()) or \
+                        AUTOMATIC_INDEX_RX.match(line.strip())
+                if match and match.group(1) not in subqueries:
+                    name = match.group(1).strip('"')
+                    if name not in full_scans:
+                        full_scans.append(name)
+        result.append({'dbname': row[0],
+                       'sql': row[1],
+                       'count': row[2],
+                       'max_elapsed': row[3],
+                       'mean_elapsed': row[4],
+                       'nrows': row[5],
+                       'interrupted': row[6],
+                       'username': row[7],
+                       'plan': plan,
+                       'full_scans': full_scans,
+                       'latest': row[9]})
+    return result
+
+def rollup_access_logs(cnx, retention, hourly_retention):
+    """Add the access log entries not yet rolled up to the hourly and daily
+    aggregates per database, endpoint, username and status code.
+    Delete the entries older than 'retention' days, and the hourly
+    aggregates older than 'hourly_retention' days.
+    The rowid of the last entry rolled up is kept in the 'meta' table.
+    The entry with the highest rowid is never deleted, so that the rowids
+    of new entries are always higher.
+    """
+    cnx.execute('BEGIN IMMEDIATE')
+    try:
+        rows = cnx.execute("SELECT value FROM meta WHERE key=?",
+                           ('access_logs_rowid',)).fetchall()
+        low = rows and int(rows[0][0]) or 0
+        high = cnx.execute("SELECT MAX(rowid) FROM access_logs").fetchone()[0]
+        if high is not None and high > low:
+            for table, period in [('access_hourly',
+                                   "date || 'T' || substr(time, 1, 2)"),
+                                  ('access_daily', 'date')]:
+                cnx.execute(f"INSERT INTO {table} (period, dbname,"
+                            " endpoint, username, status_code,"
+                            " count, duration, duration_max)"
+                            f" SELECT {period}, COALESCE(dbname, ''),"
+                            " COALESCE(endpoint, ''), COALESCE(username, ''),"
+                            " COALESCE(status_code, 0), COUNT(*),"
+                            " TOTAL(duration), COALESCE(MAX(duration), 0.0)"
+                            " FROM access_logs WHERE rowid>? AND rowid<=?"
+                            " GROUP BY 1, 2, 3, 4, 5"
+                            " ON CONFLICT (period, dbname, endpoint,"
+                            " username, status_code) DO UPDATE SET"
+                            " count=count+excluded.count,"
+                            " duration=duration+excluded.duration,"
+                            " duration_max=MAX(duration_max,"
+                            " excluded.duration_max)", (low, high))
+            cnx.execute("INSERT OR REPLACE INTO meta (key, value)"
+                        " VALUES (?, ?)", ('access_logs_rowid', str(high)))
+            cutoff = datetime.datetime.utcnow().date() - \
+                     datetime.timedelta(days=retention)
+            cnx.execute("DELETE FROM access_logs WHERE date<? AND rowid<?",
+                        (cutoff.isoformat(), high))
+        cutoff = datetime.datetime.utcnow().date() - \
+                 datetime.timedelta(days=hourly_retention)
+        cnx.execute("DELETE FROM access_hourly WHERE period<?",
+                    (cutoff.isoformat(),))
+    except sqlite3.Error:
+        cnx.rollback()
+        raise
+    else:
+        cnx.commit()
+
+
+class AccessLogger:
+    """Buffered writer of access log entries to the system database.
+    The entries are put on a bounded queue, which is drained by a background
+    thread that writes them in batches, each in a single transaction.
+    A batch is written when it is full, or when the interval has passed
+    since its first entry. An entry is dropped if the queue is full,
+    or if the write fails; the number of such is counted.
+    The entries are rolled up after a write if the rollup interval
+    has passed since the previous rollup.
+    """
+
+    SQL = "INSERT INTO access_logs (remote_addr, username," \
+          " dbname, date, time, method, path, status_code," \
+          " endpoint, duration, sqlite_duration, render_duration," \
+          " json_duration)" \
+          " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+    def __init__(self, path, batch_size, interval, queue_size,
+                 rollup_interval, retention, hourly_retention):
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.rollup_interval = rollup_interval
+        self.retention = retention
+        self.hourly_retention = hourly_retention
+        self.rolled_up = time.monotonic()
+        self.written = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def put(self, entry):
+        "Put the entry on the queue, unless it is full. Start if not done."
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def start(self):
+        """Start the background thread. This is done in the process that
+        logs, since a thread does not survive forking a worker process.
+        """
+        with self._lock:
+            if self._pid == os.getpid(): return
+            if self._pid is None:
+                atexit.register(self.stop)
+            else:               # In a forked process; discard parent's.
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self.run,
+                                            name='access-logger',
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5.0):
+        "Write all queued entries and stop the background thread."
+        if self._thread is None or not self._thread.is_alive(): return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def run(self):
+        "Write batches of entries from the queue until stopped."
+        cnx = utils.get_cnx(self.path, write=True)
+        try:
+            stop = False
+            while not stop:
+                entry = self.queue.get()
+                if entry is None: break
+                batch = [entry]
+                deadline = time.monotonic() + self.interval
+                while len(batch) < self.batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0.0: break
+                    try:
+                        entry = self.queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                    if entry is None:
+                        stop = True
+                        break
+                    batch.append(entry)
+                self.write(cnx, batch)
+                if time.monotonic() - self.rolled_up > self.rollup_interval:
+                    self.rolled_up = time.monotonic()
+                    try:
+                        rollup_access_logs(cnx, self.retention,
+                                           self.hourly_retention)
+                    except sqlite3.Error:
+                        pass
+        finally:
+            cnx.close()
+
+    def write(self, cnx, batch):
+        "Write the batch of entries in a single transaction."
+        try:
+            with cnx:
+                cnx.executemany(self.SQL, batch)
+        except sqlite3.Error:
+            with self._lock:
+                self.dropped += len(batch)
         else:
-            username = None
-        dt = datetime.datetime.utcnow()
-        values = [flask.request.remote_addr,
-                  username,
-                  getattr(flask.g, 'dbname', None),
-                  dt.date().isoformat(),
-                  dt.time().replace(microsecond=0).isoformat(),
-                  flask.request.method,
-                  flask.request.path,
-                  response.status_code]
-        cnx.execute(sql, values)
-    return response
+            with self._lock:
+                self.written += len(batch)
+
+ACCESS_LOGGER = None
 
 def init(app):
-    "Initialize tables in the system database, if not done."
+    """Initialize tables in the system database, if not done.
+    Set up the access logger, if logging is turned on.
+    """
+    global ACCESS_LOGGER
     path = utils.dbpath(constants.SYSTEM, 
                         dirpath=app.config['DATABASES_DIRPATH'])
+    if app.config['LOG_ACCESS']:
+        ACCESS_LOGGER = AccessLogger(
+            path,
+            app.config['LOG_ACCESS_BATCH_SIZE'],
+            app.config['LOG_ACCESS_INTERVAL'],
+            app.config['LOG_ACCESS_QUEUE_SIZE'],
+            app.config['LOG_ACCESS_ROLLUP_INTERVAL'],
+            app.config['LOG_ACCESS_RETENTION'],
+            app.config['LOG_ACCESS_HOURLY_RETENTION'])
     cnx = sqlite3.connect(path)
     for schema in SYSTEM_TABLES:
         sql = dbshare.db.get_sql_create_table(schema, if_not_exists=True)
         cnx.execute(sql)
+        # Add any columns missing in a table created by a previous version.
+        sql = 'PRAGMA table_info("%s")' % schema['name']
+        existing = set([row[1] for row in cnx.execute(sql)])
+        for column in schema['columns']:
+            if column['name'] not in existing:
+                sql = 'ALTER TABLE "%s" ADD COLUMN "%s" %s' % \
+                      (schema['name'], column['name'], column['type'])
+                cnx.execute(sql)
+    for sql in SYSTEM_TRIGGERS:
+        cnx.execute(sql)
+    # Set the database file sizes, e.g. any missing from a previous version,
+    # and the usage ledger from them.
+    reconcile_usage(cnx, app.config['DATABASES_DIRPATH'])
     for schema in SYSTEM_INDEXES:
         sql = dbshare.db.get_sql_create_index(schema['table'], 
                                               schema, 
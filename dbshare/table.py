@@ -1,14 +1,16 @@
 "Table HTML endpoints."
 
 import copy
-import csv
 import http.client
+import json
+import math
 import sqlite3
-import statistics as statistics_module
 
 import flask
 
+import dbshare.cache
 import dbshare.db
+import dbshare.jobs
 
 from . import constants
 from . import utils
@@ -88,18 +90,16 @@ def rows(dbname, tablename):  # NOTE: tablename is a NameExt instance!
     except KeyError:
         utils.flash_error('no such table')
         return flask.redirect(flask.url_for('db.display', dbname=dbname))
+    representation = utils.get_representation(tablename)
+    response = dbshare.cache.not_modified(db, representation)
+    if response: return response
     try:
         title = schema.get('title') or "Table {}".format(tablename)
         columns = [c['name'] for c in schema['columns']]
         dbcnx = dbshare.db.get_cnx(dbname)
         colnames = ','.join([f'"{c}"' for c in columns])
 
-        if tablename.ext == 'json' or utils.accept_json():
-            sql = f'SELECT {colnames} FROM "{tablename}"'
-            try:
-                cursor = utils.execute_timeout(dbcnx, sql)
-            except SystemError:
-                flask.abort(http.client.REQUEST_TIMEOUT)
+        if representation == 'json':
             result = {
                 'name': str(tablename),
                 'title': title,
@@ -107,41 +107,77 @@ def rows(dbname, tablename):  # NOTE: tablename is a NameExt instance!
                            'href': utils.url_for('api_table.table',
                                                  dbname=db['name'],
                                                  tablename=str(tablename))},
-                'nrows': schema['nrows'],
-                'data': [dict(zip(columns, row)) for row in cursor]
+                'nrows': schema['nrows']
             }
-            return utils.jsonify(utils.get_json(**result), schema='/rows')
+            try:
+                limit, position = utils.get_page_args()
+                if limit is None:
+                    sql = f'SELECT {colnames} FROM "{tablename}"'
+                    cursor = dbshare.cache.fetch(db, sql, stream=True)[1]
+                else:
+                    cursor, position = get_rows_page(dbcnx, schema,
+                                                     limit, position)
+                    cursor = [row[1:] for row in cursor]
+                    if position:
+                        result['cursor'] = utils.encode_cursor(position)
+                        url = utils.url_for('.rows',
+                                            dbname=db['name'],
+                                            tablename=f"{tablename}.json",
+                                            limit=limit,
+                                            cursor=result['cursor'])
+                        result['next'] = {'href': url}
+            except ValueError as error:
+                utils.abort_json(http.client.BAD_REQUEST, error)
+            except SystemError:
+                flask.abort(http.client.REQUEST_TIMEOUT)
+            response = utils.jsonify_rows(utils.get_json(**result), columns,
+                                          cursor, schema='/rows')
+            return dbshare.cache.set_headers(response, db, representation)
 
-        elif tablename.ext == 'csv':
+        elif representation == 'csv':
             sql = f'SELECT {colnames} FROM "{tablename}"'
-            writer = utils.CsvWriter(header=columns)
             try:
-                cursor = utils.execute_timeout(dbcnx, sql)
+                cursor = dbshare.cache.fetch(db, sql, stream=True)[1]
             except SystemError:
                 flask.abort(http.client.REQUEST_TIMEOUT)
-            writer.write_rows(cursor)
-            return flask.Response(writer.getvalue(),
-                                  mimetype=constants.CSV_MIMETYPE)
+            response = utils.csv_response(cursor, header=columns)
+            return dbshare.cache.set_headers(response, db, representation)
 
-        elif tablename.ext in (None, 'html'):
-            sql = f'SELECT rowid, {colnames} FROM "{tablename}"'
+        elif representation == 'html':
             limit = flask.current_app.config['MAX_NROWS_DISPLAY']
-            if schema.get('nrows', 0) > limit:
-                sql += f" LIMIT {limit}"
+            try:
+                limit, position = utils.get_page_args(limit)
+                cursor, position = get_rows_page(dbcnx, schema,
+                                                 limit, position)
+            except ValueError as error:
+                utils.flash_error(error)
+                return flask.redirect(flask.url_for('.rows',
+                                                    dbname=dbname,
+                                                    tablename=str(tablename)))
+            if position:
                 utils.flash_message_limit(limit)
-            cursor = utils.execute_timeout(dbcnx, sql)
+                next_url = flask.url_for('.rows',
+                                         dbname=dbname,
+                                         tablename=str(tablename),
+                                         limit=limit,
+                                         cursor=utils.encode_cursor(position))
+            else:
+                next_url = None
             charts = [c for c in db['charts'].values()
                       if c['source'] == str(tablename)]
             updateable = bool([c for c in schema['columns']
                                if c.get('primarykey')])
-            return flask.render_template('table/rows.html', 
-                                         db=db,
-                                         schema=schema,
-                                         title=title,
-                                         rows=cursor,
-                                         charts=charts,
-                                         updateable=updateable,
-                                         has_write_access=has_write_access)
+            response = flask.make_response(
+                flask.render_template('table/rows.html', 
+                                      db=db,
+                                      schema=schema,
+                                      title=title,
+                                      rows=cursor,
+                                      next_url=next_url,
+                                      charts=charts,
+                                      updateable=updateable,
+                                      has_write_access=has_write_access))
+            return dbshare.cache.set_headers(response, db, representation)
 
         else:
             flask.abort(http.client.NOT_ACCEPTABLE)
@@ -151,6 +187,33 @@ def rows(dbname, tablename):  # NOTE: tablename is a NameExt instance!
         return flask.redirect(
             flask.url_for('.schema', tablename=str(tablename)))
 
+def get_rows_page(dbcnx, schema, limit, position):
+    """Return a page of at most 'limit' rows from the table, with the rowid
+    as the first item of each row, and the position of the next page,
+    or None if there are no more rows.
+    This is keyset pagination on the rowid: the page starts after the rowid
+    given by the position, so the cost of a page does not depend on how
+    far into the table it is.
+    Raises ValueError if the position is invalid.
+    Raises SystemError if interrupted by timeout.
+    """
+    colnames = ','.join(['"%(name)s"' % c for c in schema['columns']])
+    sql = f'''SELECT rowid, {colnames} FROM "{schema['name']}"'''
+    params = []
+    if 'rowid' in position:
+        if not isinstance(position['rowid'], int):
+            raise ValueError('invalid cursor')
+        sql += ' WHERE rowid>?'
+        params.append(position['rowid'])
+    sql += ' ORDER BY rowid LIMIT ?'
+    params.append(limit + 1)
+    rows = utils.execute_timeout(dbcnx,
+                                 lambda cnx: cnx.execute(sql, params).fetchall())
+    if len(rows) > limit:
+        return rows[:limit], {'rowid': rows[limit-1][0]}
+    else:
+        return rows, None
+
 @blueprint.route('/<name:dbname>/<name:tablename>/edit',
                  methods=['GET', 'POST', 'DELETE'])
 @utils.login_required
@@ -507,9 +570,9 @@ def insert_csv(dbname, tablename):
             raise ValueError('invalid delimiter')
         csvfile = flask.request.files['csvfile']
         header = utils.to_bool(flask.request.form.get('header'))
-        rows = get_csv_rows(schema, csvfile, delimiter, header)
-        insert_rows(db, schema, rows)
-        utils.flash_message(f"Inserted {len(rows)} rows.")
+        rows = get_csv_rows(schema, csvfile.stream, delimiter, header)
+        count = insert_rows(db, schema, rows)
+        utils.flash_message(f"Inserted {count} rows.")
     except (ValueError, sqlite3.Error) as error:
         utils.flash_error(error)
         return flask.redirect(
@@ -564,13 +627,21 @@ def update_csv(dbname, tablename):
         delimiter = flask.current_app.config['CSV_FILE_DELIMITERS'][delimiter]['char']
     except KeyError:
             raise ValueError('invalid delimiter')
+    upsert = utils.to_bool(flask.request.form.get('upsert'))
     try:
-        nrows, count = update_csv_rows(db, schema, csvfile, delimiter)
+        nrows, updated, inserted = update_csv_rows(db, schema,
+                                                   csvfile.stream, delimiter,
+                                                   upsert=upsert)
     except ValueError as error:
         utils.flash_error(error)
         return flask.redirect(
             flask.url_for('.insert', dbname=dbname, tablename=tablename))
-    utils.flash_message(f"{nrows} rows in file; {count} table rows updated.")
+    if upsert:
+        utils.flash_message(f"{nrows} rows in file; {updated} table rows"
+                            f" updated, {inserted} inserted.")
+    else:
+        utils.flash_message(f"{nrows} rows in file;"
+                            f" {updated} table rows updated.")
     return flask.redirect(
         flask.url_for('.rows', dbname=dbname, tablename=tablename))
 
@@ -606,23 +677,33 @@ def clone(dbname, tablename):
             schema['name'] = flask.request.form['name']
             if schema.get('title'):
                 schema['title'] = 'Clone of ' + schema['title']
+            # Create the table here, to check it; copy the rows in a job.
             with dbshare.db.DbContext(db) as ctx:
                 ctx.add_table(schema)
-                colnames = ','.join(['"%(name)s"' % c 
-                                     for c in schema['columns']])
-                sql = 'INSERT INTO "%s" (%s) SELECT %s FROM "%s"' % \
-                      (schema['name'],
-                       colnames,
-                       colnames,
-                       tablename)
-                ctx.dbcnx.execute(sql)
-                ctx.update_table(schema)
+            dbshare.jobs.submit('clone', dbname, _clone,
+                                tablename, schema['name'])
         except (ValueError, sqlite3.Error) as error:
             utils.flash_error(error)
             return flask.redirect(
                 flask.url_for('.clone', dbname=dbname, tablename=tablename))
-        return flask.redirect(
-            flask.url_for('.rows', dbname=dbname, tablename=schema['name']))
+        utils.flash_message(f"Copying the rows to table {schema['name']}"
+                            " as a background job.")
+        return flask.redirect(flask.url_for('db.display', dbname=dbname))
+
+def _clone(job, tablename, clonename):
+    "Copy the rows of the table to its clone; executed as a job."
+    db = dbshare.db.get_check_write(job.dbname)
+    schema = db['tables'][clonename]
+    with dbshare.db.DbContext(db) as ctx:
+        colnames = ','.join(['"%(name)s"' % c for c in schema['columns']])
+        sql = 'INSERT INTO "%s" (%s) SELECT %s FROM "%s"' % \
+              (clonename, colnames, colnames, tablename)
+        with ctx.dbcnx:
+            ctx.suspend_counts(clonename)
+            cursor = job.execute(ctx.dbcnx, sql)
+            ctx.resume_counts(clonename, cursor.rowcount)
+        ctx.update_table(schema)
+    return {'table': clonename, 'nrows': schema['nrows']}
 
 @blueprint.route('/<name:dbname>/<name:tablename>/download')
 def download(dbname, tablename):
@@ -653,7 +734,7 @@ def download_csv(dbname, tablename):
         utils.flash_error('no such table')
         return flask.redirect(flask.url_for('db.display', dbname=dbname))
     try:
-        delimiter = flask.request.form.get('delimiter') or 'comma'
+        delimiter = flask.request.values.get('delimiter') or 'comma'
         try:
             delimiter = flask.current_app.config['CSV_FILE_DELIMITERS'][delimiter]['char']
         except KeyError:
@@ -665,22 +746,20 @@ def download_csv(dbname, tablename):
                 header.insert(0, 'rowid')
         else:
             header = None
-        writer = utils.CsvWriter(header, delimiter=delimiter)
         colnames = ['"%(name)s"' % c for c in schema['columns']]
         if rowid:
             colnames.insert(0, 'rowid')
         dbcnx = dbshare.db.get_cnx(dbname)
         sql = 'SELECT %s FROM "%s"' % (','.join(colnames), tablename)
-        writer.write_rows(utils.execute_timeout(dbcnx, sql))
+        cursor = utils.execute_timeout(dbcnx, sql)
     except (ValueError, SystemError, sqlite3.Error) as error:
         utils.flash_error(error)
         return flask.redirect(
             flask.url_for('.download', dbname=dbname, tablename=tablename))
-    response = flask.make_response(writer.getvalue())
-    response.headers.set('Content-Type', constants.CSV_MIMETYPE)
-    response.headers.set('Content-Disposition', 'attachment', 
-                         filename=f"{tablename}.csv")
-    return response
+    return utils.csv_response(cursor,
+                              header=header,
+                              delimiter=delimiter,
+                              filename=f"{tablename}.csv")
 
 @blueprint.route('/<name:dbname>/<name:tablename>/statistics')
 def statistics(dbname, tablename):
@@ -691,11 +770,17 @@ def statistics(dbname, tablename):
         utils.flash_error(error)
         return flask.redirect(flask.url_for('home'))
     try:
-        schema = db['tables'][tablename]
+        schema = copy.deepcopy(db['tables'][tablename])
     except KeyError:
         utils.flash_error('no such table')
         return flask.redirect(flask.url_for('db.display', dbname=dbname))
-    compute_statistics(db, schema)
+    try:
+        compute_statistics(db, schema, mode=flask.request.args.get('mode'))
+    except ValueError as error:
+        utils.flash_error(error)
+        return flask.redirect(flask.url_for('.rows',
+                                            dbname=dbname,
+                                            tablename=tablename))
     return flask.render_template('table/statistics.html', db=db, schema=schema)
 
 def get_row_values_errors(columns):
@@ -719,83 +804,175 @@ def get_row_values_errors(columns):
     return tuple(values), errors
 
 def get_csv_rows(schema, csvfile, delimiter, header):
-    """Get rows from the CSV input file to insert into the given table.
+    """Generator of rows from the CSV input file to insert into the table.
+    The file is read one record at a time.
     The order of the items in the rows must match the order of the columns.
     Raises ValueError if any problem.
     """
-    lines = csvfile.read().decode('utf-8').split('\n')
-    rows = list(csv.reader(lines, delimiter=delimiter))
-    # Eliminate empty rows
-    rows = [r for r in rows if r]
-    if not rows:
-        raise ValueError('empty CSV file')
-    if header:
-        header = [h.strip() for h in rows.pop(0)]
-        for n, column in enumerate(schema['columns']):
-            if header[n] != column['name']:
+    records = utils.CsvRecords(csvfile, delimiter=delimiter)
+    converters = []
+    for column in schema['columns']:
+        if column['type'] == constants.INTEGER:
+            converters.append(int)
+        elif column['type'] == constants.REAL:
+            converters.append(float)
+        else:
+            converters.append(None)
+    empty = True
+    for n, row in enumerate(records):
+        empty = False
+        if header and n == 0:
+            header = [(h or '').strip() for h in row]
+            if header[:len(schema['columns'])] != \
+               [c['name'] for c in schema['columns']]:
                 raise ValueError('header/column name mismatch')
-    try:
-        for i, column in enumerate(schema['columns']):
-            type = column['type']
-            notnull = column['notnull']
-            if type == constants.INTEGER:
-                for n, row in enumerate(rows):
-                    value = row[i]
-                    if value:
-                        row[i] = int(value)
-                    elif notnull:
-                        raise ValueError('NULL disallowed')
-                    else:
-                        row[i] = None
-            elif type == constants.REAL:
-                for n, row in enumerate(rows):
-                    value = row[i]
-                    if value:
-                        row[i] = float(value)
-                    elif notnull:
-                        raise ValueError('NULL disallowed')
-                    else:
-                        row[i] = None
+            continue
+        try:
+            for i, column in enumerate(schema['columns']):
+                value = row[i]
+                if value:
+                    if converters[i]:
+                        row[i] = converters[i](value)
+                elif column['notnull']:
+                    raise ValueError('NULL disallowed')
+                else:
+                    row[i] = None
+        except (ValueError, TypeError, IndexError) as error:
+            raise ValueError("line %s, column %s (%s): %s" %
+                             (n+1, i+1, column['name'], str(error)))
+        yield row
+    if empty:
+        raise ValueError('empty CSV file')
+
+def get_item_converter(schema):
+    """Return a function converting an input item (a dictionary with
+    column names as keys) to a row for the table; a list of values in
+    the order of the columns. The type checks for the columns are set up
+    once, here, rather than for each item.
+    The function raises ValueError if a value is missing or of wrong type.
+    """
+    checks = []
+    for column in schema['columns']:
+        if column['type'] == constants.INTEGER:
+            types = int
+        elif column['type'] == constants.REAL:
+            types = (int, float)
+        elif column['type'] == constants.TEXT:
+            types = str
+        else:
+            types = ()
+        checks.append((column['name'], types, bool(column.get('notnull'))))
+
+    def convert(item):
+        row = []
+        for name, types, notnull in checks:
+            try:
+                value = item[name]
+            except KeyError:
+                if notnull:
+                    raise ValueError(f"missing key '{name}'")
+                value = None
             else:
-                for n, row in enumerate(rows):
-                    value = row[i]
-                    if value:
-                        row[i] = value
-                    elif notnull:
-                        raise ValueError('NULL disallowed')
-                    else:
-                        row[i] = None
-    except (ValueError, TypeError, IndexError) as error:
-        raise ValueError("line %s, column %s (%s): %s" %
-                         (n+1, i+1, column['name'], str(error)))
-    return rows
-
-def insert_rows(db, schema, rows):
-    "Insert the given rows into the given table."
+                if not isinstance(value, types) and \
+                   (value is not None or notnull):
+                    raise ValueError(f"'{name}' invalid type")
+            row.append(value)
+        return row
+
+    return convert
+
+def get_ndjson_rows(schema, infile):
+    """Generator of rows from the NDJSON (newline-delimited JSON) input file
+    to insert into the table. Each line contains one JSON object.
+    The file is read and checked one line at a time.
+    Raises ValueError if any problem.
+    """
+    convert = get_item_converter(schema)
+    for pos, line in enumerate(infile):
+        if not line.strip(): continue
+        try:
+            item = json.loads(line)
+            if not isinstance(item, dict):
+                raise ValueError('not a JSON object')
+            yield convert(item)
+        except ValueError as error:
+            raise ValueError(f"{error} in line {pos+1}")
+
+def insert_rows(db, schema, rows, progress=None, on_conflict=None):
+    """Insert the given rows into the given table.
+    The rows may be any iterable; they are inserted in batches,
+    in one transaction. If given, 'progress' is called with the number
+    of rows inserted so far after each batch.
+    If given, 'on_conflict' is the action when a row conflicts with
+    an existing row: 'replace' it, 'ignore' the new row, or 'update'
+    the existing row with the values of the new row.
+    Return the number of rows inserted.
+    Raises ValueError if invalid 'on_conflict'.
+    """
+    names = ','.join(['"%(name)s"' % c for c in schema['columns']])
+    values = ','.join('?' * len(schema['columns']))
+    if on_conflict is None:
+        sql = 'INSERT'
+    elif on_conflict == constants.REPLACE:
+        sql = 'INSERT OR REPLACE'
+    elif on_conflict == constants.IGNORE:
+        sql = 'INSERT OR IGNORE'
+    elif on_conflict != constants.UPDATE:
+        raise ValueError(f"invalid on_conflict action '{on_conflict}'")
+    else:
+        sql = 'INSERT'
+    sql += f''' INTO "{schema['name']}" ({names}) VALUES ({values})'''
+    if on_conflict == constants.UPDATE:
+        primarykeys = ['"%(name)s"' % c for c in schema['columns']
+                       if c.get('primarykey')]
+        if not primarykeys:
+            raise ValueError('no primary key in table')
+        setexpr = ','.join(['"%(name)s"=excluded."%(name)s"' % c
+                            for c in schema['columns']
+                            if not c.get('primarykey')])
+        sql += f" ON CONFLICT ({','.join(primarykeys)})"
+        if setexpr:
+            sql += f" DO UPDATE SET {setexpr}"
+        else:
+            sql += " DO NOTHING"
+    count = 0
     with dbshare.db.DbContext(db) as ctx:
         with ctx.dbcnx:
-            names = ','.join(['"%(name)s"' % c for c in schema['columns']])
-            values = ','.join('?' * len(schema['columns']))
-            sql = f'''INSERT INTO "{schema['name']}" ({names}) VALUES ({values})'''
-            ctx.dbcnx.executemany(sql, rows)
+            # The change of the row count is known only for plain inserts;
+            # otherwise the triggers maintain it.
+            if on_conflict is None:
+                ctx.suspend_counts(schema['name'])
+            size = flask.current_app.config['LOAD_BATCH_SIZE']
+            for batch in utils.batches(rows, size):
+                ctx.dbcnx.executemany(sql, batch)
+                count += len(batch)
+                if progress:
+                    progress(count)
+            if on_conflict is None:
+                ctx.resume_counts(schema['name'], count)
             ctx.update_table(schema)
+    return count
 
-def update_csv_rows(db, schema, csvfile, delimiter):
+def update_csv_rows(db, schema, csvfile, delimiter, upsert=False):
     """Update the given table with the given CSV file.
     The CSV file must contain a header row. The primary key column(s) 
     must be present. Only given column values will be updated.
+    The records are loaded in batches into a temporary table, from which
+    the table is updated by one set-based statement. If the same primary
+    key occurs in several records, the last one is used.
+    If 'upsert' is True, records not matching any row are inserted.
+    Return a tuple of the number of records in the file, the number
+    of table rows updated and the number of table rows inserted.
     Raises ValueError if any problem.
     """
-    lines = csvfile.read().decode('utf-8').split('\n')
-    rows = list(csv.reader(lines, delimiter=delimiter))
-    # Eliminate empty rows.
-    rows = [r for r in rows if r]
-    if len(rows) <= 1:
+    records = iter(utils.CsvRecords(csvfile, delimiter=delimiter))
+    try:
+        header = [(h or '').strip() for h in next(records)]
+    except StopIteration:
         raise ValueError('empty CSV file')
     # Figure out mapping of CSV row columns to table columns.
-    header = [h.strip() for h in rows.pop(0)]
-    primarykeys = set([c['name'] for c in schema['columns']
-                       if c.get('primarykey')])
+    primarykeys = [c['name'] for c in schema['columns']
+                   if c.get('primarykey')]
     columns = set([c['name'] for c in schema['columns']])
     pkpos = {}
     for pos, name in enumerate(header):
@@ -812,92 +989,257 @@ def update_csv_rows(db, schema, csvfile, delimiter):
         colpos[name] = pos
     if not colpos:
         raise ValueError('no columns in CSV file for update')
-    setexpr = ','.join(['"%s"=?' % pk for pk in colpos.keys()])
-    criteria = ' AND '.join(['"%s"=?' % pk for pk in pkpos.keys()])
-    sql = f'''UPDATE "{schema['name']}" SET {setexpr} WHERE {criteria}'''
-    colpos = colpos.values()
-    pkpos = pkpos.values()
-    count = 0
+    positions = list(pkpos.values()) + list(colpos.values())
+    names = list(pkpos.keys()) + list(colpos.keys())
+    types = dict([(c['name'], c['type']) for c in schema['columns']])
+
+    tablename = schema['name']
+    tempname = '_update_csv'
+    # The temporary table has the same column types, hence the same
+    # conversion of values, as the table.
+    definitions = ['"%s" %s' % (n, types[n]) for n in names]
+    definitions.append('PRIMARY KEY (%s)' %
+                       ','.join(['"%s"' % n for n in pkpos]))
+    sql_create = f'''CREATE TEMP TABLE "{tempname}"''' \
+                 f''' ({','.join(definitions)})'''
+    sql_load = f'''INSERT OR REPLACE INTO temp."{tempname}"''' \
+               f''' VALUES ({','.join('?' * len(names))})'''
+    setexpr = ','.join(['"%s"=u."%s"' % (n, n) for n in colpos])
+    criteria = ' AND '.join(['"%s"."%s"=u."%s"' % (tablename, pk, pk)
+                             for pk in pkpos])
+    sql_update = f'''UPDATE "{tablename}" SET {setexpr}''' \
+                 f''' FROM temp."{tempname}" AS u WHERE {criteria}'''
+    quoted = ','.join(['"%s"' % n for n in names])
+    sql_insert = f'''INSERT INTO "{tablename}" ({quoted})''' \
+                 f''' SELECT {quoted} FROM temp."{tempname}" WHERE true''' \
+                 f''' ON CONFLICT ({','.join(['"%s"' % pk for pk in pkpos])})''' \
+                 f''' DO NOTHING'''
+    size = flask.current_app.config['LOAD_BATCH_SIZE']
+    nrows = 0
+    updated = 0
+    inserted = 0
     try:
         with dbshare.db.DbContext(db) as ctx:
             with ctx.dbcnx:
-                for rowpos, row in enumerate(rows):
-                    values = [row[i] for i in colpos]
-                    pkeys = [row[i] for i in pkpos]
-                    cursor = ctx.dbcnx.execute(sql, values+pkeys)
-                    count += cursor.rowcount
+                ctx.dbcnx.execute(f'DROP TABLE IF EXISTS temp."{tempname}"')
+                ctx.dbcnx.execute(sql_create)
+                try:
+                    for batch in utils.batches(records, size):
+                        rows = []
+                        for record in batch:
+                            nrows += 1
+                            try:
+                                rows.append([record[i] for i in positions])
+                            except IndexError:
+                                raise ValueError(f"record {nrows} has too"
+                                                 " few items")
+                        ctx.dbcnx.executemany(sql_load, rows)
+                    ctx.suspend_counts(tablename)
+                    updated = ctx.dbcnx.execute(sql_update).rowcount
+                    if upsert:
+                        inserted = ctx.dbcnx.execute(sql_insert).rowcount
+                    ctx.resume_counts(tablename, inserted)
+                finally:
+                    ctx.dbcnx.execute(f'DROP TABLE temp."{tempname}"')
+            if updated or inserted:
+                ctx.update_table(schema)
     except sqlite3.Error as error:
-        raise ValueError("row number %s; %s" (rowpos+1, str(error)))
-    return (len(rows), count)
+        raise ValueError(str(error))
+    return (nrows, updated, inserted)
 
-def compute_statistics(db, schema):
-    """Compute the stastistics for the data of the table's columns.
+def compute_statistics(db, schema, mode=None):
+    """Compute the statistics for the data of the table's columns.
+    The aggregates for all columns are computed by Sqlite3 in one scan.
+    The mode is one of 'exact', 'approximate' (estimated number of unique
+    values) or 'sample' (all values from a random sample of the rows).
+    If no mode is given, 'exact' is used for tables of moderate size,
+    else 'sample'.
     Cache the results if the database is writeable.
+    Raise ValueError if invalid mode.
     """
+    if mode is not None and mode not in constants.STATISTICS_MODES:
+        raise ValueError(f"invalid statistics mode '{mode}'")
     # Skip if no columns.
     if len(schema['columns']) == 0: return
-    # Skip if statistics already present.
-    if 'statistics' in schema['columns'][0]: return
+    # Skip if statistics already present, and computed in the given mode.
+    if 'statistics' in schema['columns'][0] and \
+       mode in (None, schema.get('statistics_mode', constants.EXACT)):
+        return
 
     # Recompute statistics and cache.
+    config = flask.current_app.config
+    if mode is None:
+        if schema['nrows'] > config['STATISTICS_EXACT_MAX_NROWS']:
+            mode = constants.SAMPLE
+        else:
+            mode = constants.EXACT
     dbcnx = dbshare.db.get_cnx(db['name'])
+    if mode == constants.SAMPLE:
+        tablename = '_statistics_sample'
+        dbcnx.execute(f'DROP TABLE IF EXISTS temp."{tablename}"')
+        # Bernoulli sample; each row is included with the same probability.
+        fraction = config['STATISTICS_SAMPLE_SIZE'] / max(schema['nrows'], 1)
+        sql = f'''CREATE TEMP TABLE "{tablename}" AS SELECT *''' \
+              f''' FROM "{schema['name']}" WHERE abs(random() % 1000000) < ?'''
+        dbcnx.execute(sql, (round(1000000 * min(fraction, 1.0)),))
+    else:
+        tablename = schema['name']
+    if mode == constants.APPROXIMATE:
+        dbcnx.create_aggregate('approximate_distinct', 1, ApproximateDistinct)
+    try:
+        _compute_statistics(dbcnx, schema, tablename, mode)
+    finally:
+        if mode == constants.SAMPLE:
+            dbcnx.execute(f'DROP TABLE IF EXISTS temp."{tablename}"')
+    schema['statistics_mode'] = mode
+    if dbshare.db.has_write_access(db):
+        with dbshare.db.DbContext(db) as ctx:
+            ctx.update_table(schema, reset_cache=False)
+
+def _compute_statistics(dbcnx, schema, tablename, mode):
+    """Compute the statistics from the given table, which may be a sample.
+    The number of NULL and non-NULL values in a sample are scaled to
+    estimates for the whole table. The number of unique values in a sample
+    cannot be scaled; it is labelled as such.
+    The standard deviation is computed from the deviations from the mean,
+    in a second scan, since the difference between the sum of squares and
+    the squared sum loses precision.
+    """
+    numerical = (constants.INTEGER, constants.REAL)
+    # The aggregates for all columns in a single scan of the table.
+    aggregates = []
+    for column in schema['columns']:
+        name = f'''"{column['name']}"'''
+        aggregates.append(f"COUNT({name})")
+        aggregates.append(f"MIN({name})")
+        aggregates.append(f"MAX({name})")
+        if column.get('primarykey'):
+            aggregates.append('NULL')
+        elif mode == constants.APPROXIMATE:
+            aggregates.append(f"approximate_distinct({name})")
+        else:
+            aggregates.append(f"COUNT(DISTINCT {name})")
+        if column['type'] in numerical:
+            aggregates.append(f"AVG({name})")
+    sql = f'''SELECT COUNT(*), {', '.join(aggregates)} FROM "{tablename}"'''
+    values = list(dbcnx.execute(sql).fetchone())
+    nrows = values.pop(0)
+    if mode == constants.SAMPLE and nrows:
+        scale = schema['nrows'] / nrows
+    else:
+        scale = 1
+
+    # The variances of the numerical columns in a second single scan.
+    variances = {}
+    aggregates = []
+    params = []
+    position = 0
+    for column in schema['columns']:
+        position += 4
+        if column['type'] in numerical:
+            mean = values[position]
+            position += 1
+            if mean is None: continue
+            name = f'''"{column['name']}"'''
+            aggregates.append(f"AVG(({name}-?)*({name}-?))")
+            params.extend([mean, mean])
+            variances[column['name']] = None
+    if aggregates:
+        sql = f"SELECT {', '.join(aggregates)} FROM \"{tablename}\""
+        row = dbcnx.execute(sql, params).fetchone()
+        variances = dict(zip(variances, row))
+
     for column in schema['columns']:
         column['statistics'] = stats = {}
-        sql = f'''SELECT "{column['name']}" FROM "{schema['name']}"'''
-        values = [row[0] for row in dbcnx.execute(sql)]
+        name = f'''"{column['name']}"'''
+        count, minimum, maximum, uniques = values[:4]
+        del values[:4]
+        if column['type'] in numerical:
+            mean = values.pop(0)
 
         # Number of NULLs in the column.
         stats['nulls'] = {'title': 'NULL values'}
         if column.get('notnull'):
             stats['nulls']['value'] = False
-            nonnull_values = values
         else:
-            count = 0
-            for value in values:
-                if value is None: count += 1
-            stats['nulls']['value'] = count
-            if count:
-                nonnull_values = [v for v in values if v is not None]
-            else:
-                nonnull_values = values
+            stats['nulls']['value'] = round((nrows - count) * scale)
             stats['nonnulls'] = {'title': 'Non-NULL values',
-                                 'value': len(nonnull_values)}
+                                 'value': round(count * scale)}
+            if mode == constants.SAMPLE:
+                stats['nulls']['title'] = 'NULL values (estimated)'
+                stats['nonnulls']['title'] = 'Non-NULL values (estimated)'
 
-        # Number of unique values in the column.
+        # Number of unique values in the column; list them if only a few.
         stats['uniques'] = {'title': 'Unique values'}
         if column.get('primarykey'):
             stats['uniques']['value'] = True
         else:
-            uniques = set(nonnull_values)
-            stats['uniques']['value'] = len(uniques)
-            if len(uniques) < 9:
-                stats['uniques']['info'] = list(uniques)
-
-        nonnull_values = sorted(nonnull_values)
+            if mode == constants.SAMPLE:
+                stats['uniques']['title'] = 'Unique values in sample'
+            if uniques < 9:
+                sql = f'SELECT DISTINCT {name} FROM "{tablename}"' \
+                      f' WHERE {name} IS NOT NULL LIMIT 9'
+                uniques = [row[0] for row in dbcnx.execute(sql)]
+                if len(uniques) < 9:
+                    stats['uniques']['info'] = uniques
+                uniques = len(uniques)
+            stats['uniques']['value'] = uniques
 
         # Numerical min, max, mean, median
-        if column['type'] in (constants.INTEGER, constants.REAL):
-            if len(nonnull_values):
-                stats['min'] = {'title': 'Minimum', 'value': nonnull_values[0]}
-                mean = statistics_module.mean(nonnull_values)
+        if column['type'] in numerical:
+            if count:
+                stats['min'] = {'title': 'Minimum', 'value': minimum}
                 stats['mean'] = {'title': 'Mean', 'value': mean}
-                stats['median'] = {
-                    'title': 'Median',
-                    'value': statistics_module.median_low(nonnull_values)}
-                stats['max'] = {'title': 'Maximum', 'value': nonnull_values[-1]}
-                if len(nonnull_values) > 2:
-                    stats['stdev'] = {
-                        'title': 'Standard deviation',
-                        'value': statistics_module.stdev(nonnull_values,
-                                                         xbar=mean)}
+                # The low median; uses the index for the column, if any.
+                sql = f'SELECT {name} FROM "{tablename}"' \
+                      f' WHERE {name} IS NOT NULL' \
+                      f' ORDER BY {name} LIMIT 1 OFFSET ?'
+                median = dbcnx.execute(sql, ((count - 1) // 2,)).fetchone()[0]
+                stats['median'] = {'title': 'Median', 'value': median}
+                stats['max'] = {'title': 'Maximum', 'value': maximum}
+                if count > 2:
+                    # The sample variance; from the population variance.
+                    variance = variances[column['name']] * count / (count-1)
+                    stats['stdev'] = {'title': 'Standard deviation',
+                                      'value': math.sqrt(variance)}
 
         # Lexical min, max
         if column['type'] == constants.TEXT:
-            if len(nonnull_values):
-                stats['min'] = {'title': 'Lexical minimum',
-                                'value': nonnull_values[0]}
-                stats['max'] = {'title': 'Lexical maximum', 
-                                'value': nonnull_values[-1]}
-    if dbshare.db.has_write_access(db):
-        with dbshare.db.DbContext(db) as ctx:
-            ctx.update_table(schema, reset_cache=False)
+            if count:
+                stats['min'] = {'title': 'Lexical minimum', 'value': minimum}
+                stats['max'] = {'title': 'Lexical maximum', 'value': maximum}
+
+
+class ApproximateDistinct:
+    """Sqlite3 aggregate function estimating the number of distinct values
+    using the HyperLogLog algorithm; the relative error is typically 2%.
+    """
+
+    PRECISION = 12              # Number of registers is 2**PRECISION.
+    MASK = 2**64 - 1
+
+    def __init__(self):
+        self.registers = bytearray(2**self.PRECISION)
+
+    def step(self, value):
+        if value is None: return
+        # Mix the bits of the Python hash value (splitmix64 finalizer).
+        x = hash(value) & self.MASK
+        x = ((x ^ (x >> 30)) * 0xbf58476d1ce4e5b9) & self.MASK
+        x = ((x ^ (x >> 27)) * 0x94d049bb133111eb) & self.MASK
+        x ^= x >> 31
+        bits = 64 - self.PRECISION
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        index = x >> bits
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def finalize(self):
+        m = len(self.registers)
+        estimate = (0.7213 / (1 + 1.079 / m)) * m * m / \
+                   sum([2.0 ** -r for r in self.registers])
+        # Small range correction.
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
@@ -262,10 +262,11 @@ def logs(username):
 @utils.admin_required
 def users():
     "Display list of all users."
-    import dbshare.dbs
     cursor = dbshare.system.get_cursor()
-    sql = "SELECT username, email, password, apikey," \
-          " role, status, quota, created, modified FROM users"
+    sql = "SELECT u.username, u.email, u.password, u.apikey, u.role," \
+          " u.status, u.quota, u.created, u.modified," \
+          " COALESCE(g.ndbs, 0), COALESCE(g.size, 0)" \
+          " FROM users AS u LEFT JOIN usage AS g ON g.username=u.username"
     cursor.execute(sql)
     users = [{'username':   row[0],
               'email':      row[1],
@@ -276,13 +277,9 @@ def users():
               'quota':      row[6],
               'created':    row[7],
               'modified':   row[8],
-              'ndbs':       0,
-              'size':       0}
+              'ndbs':       row[9],
+              'size':       row[10]}
              for row in cursor]
-    lookup = dict([(u['username'], u) for u in users])
-    for db in dbshare.dbs.get_dbs():
-        lookup[db['owner']]['ndbs'] += 1
-        lookup[db['owner']]['size'] += db['size']
     return flask.render_template('user/users.html', users=users)
 
 @blueprint.route('/enable/<name:username>', methods=['POST'])
@@ -1,5 +1,8 @@
 "Various utility functions and classes."
 
+import base64
+import codecs
+import collections
 import csv
 import datetime
 import functools
@@ -23,6 +26,7 @@ import markdown
 import werkzeug.routing
 
 import dbshare.lexer
+import dbshare.metrics
 from dbshare import constants
 
 
@@ -32,15 +36,19 @@ mail = flask_mail.Mail()
 # Global instance of SQL lexer.
 lexer = dbshare.lexer.Lexer([
     {'type': 'RESERVED',
-     'regexp': r"(?i)SELECT|DISTINCT|ALL|FROM|AS|WHERE|ORDER|BY|AND|OR|NOT|"
-               r"LIMIT|CREATE|VIEW",
+     'regexp': r"(?i)\b(?:SELECT|DISTINCT|ALL|FROM|AS|WHERE|ORDER|BY|AND|OR|"
+               r"NOT|LIMIT|CREATE|VIEW|JOIN|INNER|LEFT|RIGHT|FULL|OUTER|"
+               r"CROSS|NATURAL|ON|USING|GROUP|HAVING|ASC|DESC)\b",
      'convert': 'upcase'},
     {'type': 'INTEGER', 'regexp': r"-?\d+", 'convert': 'integer'},
-    {'type': 'DELIMITER', 'regexp': r"!=|>=|<=|[-+/*<>=\?\.,;\(\)]"},
+    {'type': 'DELIMITER', 'regexp': r"!=|>=|<=|==|<>|\|\||[-+/*%<>=\?\.,;\(\)]"},
     {'type': 'WHITESPACE', 'regexp': r"\s+", 'skip': True},
-    {'type': 'IDENTIFIER', 'regexp': r"(?i)[a-z]\w*"},
+    {'type': 'IDENTIFIER', 'regexp': r"(?i)[a-z_]\w*"},
+    {'type': 'STRING',
+     'regexp': r"(?P<quotechar>')(?:[^']|'')*'",
+     'convert': 'quotechar_strip'},
     {'type': 'IDENTIFIER',
-     'regexp': r"(?P<quotechar>[\'|\"])\S+(?P=quotechar)",
+     'regexp': r'(?P<quotechar>")(?:[^"]|"")*"',
      'convert': 'quotechar_strip'}
 ])
 
@@ -113,16 +121,62 @@ class Timer:
         return round(1000 * self())
 
 
+class LruCache:
+    "Thread-safe least-recently-used cache, with hit and miss counters."
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        "Return the value for the key, else the default."
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        "Set the value for the key, evicting the least recently used item."
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def pop(self, key):
+        "Remove the item for the key, if any."
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        "Remove all items."
+        with self._lock:
+            self._items.clear()
+
+
 def get_cnx(path, write=False):
     """Return a new connection to the database at the given path.
     If the database file does not exist, it will be created.
     The OS-level file permissions are set in DbContext.
+    The connection may be used by different threads, but only by
+    one at a time; see 'dbshare.pool'.
     """
     if write:
-        cnx = sqlite3.connect(path)
+        cnx = sqlite3.connect(path, check_same_thread=False)
     else:
         path = "file:%s?mode=ro" % path
-        cnx = sqlite3.connect(path, uri=True)
+        cnx = sqlite3.connect(path, uri=True, check_same_thread=False)
     return cnx
 
 def sorted_schema(schemalist):
@@ -138,6 +192,16 @@ def dbpath(dbname, dirpath=None):
     dirpath = os.path.expandvars(dirpath)
     return os.path.join(dirpath, dbname) + '.sqlite3'
 
+def exportpath(filename):
+    "Return the file path for the given export file name."
+    dirpath = flask.current_app.config['EXPORTS_DIRPATH']
+    if dirpath is None:
+        dirpath = os.path.join(flask.current_app.config['DATABASES_DIRPATH'],
+                               '_exports')
+    dirpath = os.path.expanduser(dirpath)
+    dirpath = os.path.expandvars(dirpath)
+    return os.path.join(dirpath, filename)
+
 def get_iuid():
     "Return a new IUID, which is a UUID4 pseudo-random string."
     return uuid.uuid4().hex
@@ -218,6 +282,48 @@ def url_for_unq(endpoint, **values):
     """
     return urllib.parse.unquote(url_for(endpoint, **values))
 
+def get_page_args(default_limit=None):
+    """Return the page size and position from the request arguments
+    'limit' and 'cursor' (an opaque continuation token).
+    The page size is 'default_limit' if not given. The position is
+    a dictionary, which is empty for the first page.
+    Raise ValueError if either argument is invalid.
+    """
+    limit = flask.request.args.get('limit')
+    if limit is None:
+        limit = default_limit
+    else:
+        try:
+            limit = int(limit)
+            if limit <= 0: raise ValueError
+        except ValueError:
+            raise ValueError('invalid limit; must be a positive integer')
+    cursor = flask.request.args.get('cursor')
+    if cursor:
+        if limit is None:
+            limit = flask.current_app.config['MAX_NROWS_DISPLAY']
+        position = decode_cursor(cursor)
+    else:
+        position = {}
+    return limit, position
+
+def encode_cursor(position):
+    "Return the opaque continuation token for the position dictionary."
+    data = json.dumps(position, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Return the position dictionary from the continuation token.
+    Raise ValueError if it is invalid.
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        position = json.loads(data.decode('utf-8'))
+        if not isinstance(position, dict): raise ValueError
+    except (ValueError, TypeError):
+        raise ValueError('invalid cursor')
+    return position
+
 def accept_json():
     "Return True if the header Accept contains the JSON content type."
     acc = flask.request.accept_mimetypes
@@ -225,6 +331,14 @@ def accept_json():
     return best == constants.JSON_MIMETYPE and \
         acc[best] > acc[constants.HTML_MIMETYPE]
 
+def get_representation(nameext):
+    """Return the requested representation; 'json' if given by the extension
+    of the NameExt instance or the header Accept, else the extension,
+    or 'html' if none.
+    """
+    if nameext.ext == 'json' or accept_json(): return 'json'
+    return nameext.ext or 'html'
+
 def get_json(**items):
     "Return the JSON structure adding standard entries."
     result = {'$id': flask.request.url,
@@ -235,14 +349,19 @@ def get_json(**items):
 def jsonify(result, schema=None):
     """Return a Response object containing the JSON of 'result'.
     Optionally add a header Link to the schema given by its URL path."""
-    response = flask.jsonify(result)
+    with dbshare.metrics.timing('json'):
+        response = flask.jsonify(result)
     if schema:
-        response.headers.add(
-            'Link',
-            f"<{flask.current_app.config['SCHEMA_BASE_URL']}{schema}>",
-            rel='schema')
+        add_schema_link(response, schema)
     return response
 
+def add_schema_link(response, schema):
+    "Add a header Link to the schema given by its URL path."
+    response.headers.add(
+        'Link',
+        f"<{flask.current_app.config['SCHEMA_BASE_URL']}{schema}>",
+        rel='schema')
+
 def http_GET():
     "Is the HTTP method GET?"
     return flask.request.method == 'GET'
@@ -365,43 +484,56 @@ def abort_json(status_code, error):
     response.set_data(json.dumps({'message': str(error)}))
     flask.abort(response)
 
-def _timeout_interrupt(cnx, event, timeout, increment, backoff):
-    "Background thread to interrupt the Sqlite3 query when timeout."
-    assert timeout > 0.0
-    assert increment > 0.0
-    assert backoff > 1.0
-    event.wait()
-    elapsed = 0.0
-    while elapsed < timeout:
-        if not event.is_set(): return
-        time.sleep(increment)
-        elapsed += increment
-        increment *= backoff
-    cnx.interrupt()
-
-def execute_timeout(cnx, command, **kwargs):
+def get_execute_timeout():
+    """Return the time-out (in seconds) for executing an Sqlite3 command
+    in the current request. A value set for the current user overrides
+    one set for the current endpoint, which overrides the default.
+    """
+    config = flask.current_app.config
+    timeout = config['EXECUTE_TIMEOUT']
+    if flask.has_request_context():
+        timeout = config['EXECUTE_TIMEOUT_ENDPOINTS'].get(
+            flask.request.endpoint, timeout)
+        user = getattr(flask.g, 'current_user', None)
+        if user:
+            timeout = config['EXECUTE_TIMEOUT_USERS'].get(user['username'],
+                                                          timeout)
+    return timeout
+
+def execute_timeout(cnx, command, deadline=None, **kwargs):
     """Perform Sqlite3 command to be interrupted if running too long.
     If the given command is a string, it is executed as SQL.
     If the command is a callable, call it with the cnx and any given
     keyword arguments.
+    The deadline is checked by a progress handler in the Sqlite3 VM,
+    so no extra thread is involved. If a 'deadline' (a value of
+    'time.monotonic') is given, it is used if earlier than the time-out.
+    The time spent is added to the instrumentation of the request.
+    If the command takes longer than the slow-query threshold, or is
+    interrupted, its last SQL statement is added to the slow-query log.
     Raises SystemError if interrupted by timeout.
     """
     config = flask.current_app.config
-    event = threading.Event()
-    timeout = config['EXECUTE_TIMEOUT']
-    args = (cnx, 
-            event,
-            timeout,
-            config['EXECUTE_TIMEOUT_INCREMENT'],
-            config['EXECUTE_TIMEOUT_BACKOFF'])
-    thread = threading.Thread(target=_timeout_interrupt, args=args)
-    thread.start()
-    event.set()
+    timeout = get_execute_timeout()
+    threshold = config['SLOW_QUERY_THRESHOLD']
+    statements = []
+    if threshold is not None:
+        cnx.set_trace_callback(statements.append)
+    started = time.monotonic()
+    if deadline is None:
+        deadline = started + timeout
+    else:
+        deadline = min(deadline, started + timeout)
+    cnx.set_progress_handler(lambda: time.monotonic() > deadline,
+                             config['EXECUTE_TIMEOUT_PROGRESS_STEPS'])
+    result = None
+    interrupted = False
     try:
-        if isinstance(command, str): # SQL
-            result = cnx.execute(command)
-        elif callable(command):
-            result = command(cnx, **kwargs)
+        with dbshare.metrics.timing('sqlite'):
+            if isinstance(command, str): # SQL
+                result = cnx.execute(command)
+            elif callable(command):
+                result = command(cnx, **kwargs)
     except sqlite3.ProgrammingError:
         raise
     except sqlite3.OperationalError as error:
@@ -410,13 +542,61 @@ def execute_timeout(cnx, command, **kwargs):
         # not sqlite3.OperationalError, which is what it does.
         # That's why the error message has to be checked.
         if str(error) == 'interrupted':
+            interrupted = True
             raise SystemError(f"execution exceeded {timeout} seconds; interrupted")
         else:
             raise
-    event.clear()
-    thread.join()
+    finally:
+        cnx.set_progress_handler(None, 0)
+        if threshold is not None:
+            cnx.set_trace_callback(None)
+            elapsed = time.monotonic() - started
+            if interrupted or elapsed >= threshold:
+                if isinstance(result, list):
+                    nrows = len(result)
+                else:
+                    nrows = None
+                add_slow_query(cnx, statements, elapsed, nrows, interrupted)
     return result
 
+def add_slow_query(cnx, statements, elapsed, nrows, interrupted):
+    """Add the last of the traced SQL statements, with its query plan,
+    to the slow-query entries of the current request. These are written
+    to the system database when the request is done.
+    """
+    if not flask.has_request_context(): return
+    statements = [s for s in statements
+                  if s.split(None, 1)[0].upper() not in
+                  ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')]
+    if not statements: return
+    sql = statements[-1]
+    plan = []
+    depths = {}
+    try:
+        for id, parent, notused, detail in cnx.execute(
+                f"EXPLAIN QUERY PLAN {sql}"):
+            depths[id] = depths.get(parent, -1) + 1
+            plan.append('  ' * depths[id] + detail)
+    except sqlite3.Error:
+        pass
+    if cnx is getattr(flask.g, 'dbcnx', None):
+        dbname = flask.g.dbname
+    else:
+        dbname = None
+    if flask.g.get('current_user'):
+        username = flask.g.current_user['username']
+    else:
+        username = None
+    flask.g.setdefault('slow_queries', []).append(
+        dict(dbname=dbname,
+             sql=sql,
+             username=username,
+             elapsed=elapsed,
+             nrows=nrows,
+             interrupted=interrupted,
+             plan=plan,
+             timestamp=get_time()))
+
 
 class CsvWriter:
     "Create CSV file content from rows of data."
@@ -436,3 +616,98 @@ class CsvWriter:
     def getvalue(self):
         "Return the written data."
         return self.outfile.getvalue()
+
+
+class CsvRecords:
+    """Iterate over the records in a binary CSV file, one at a time.
+    Empty records are skipped, and empty items are changed to None.
+    If the file is seekable, then it can be iterated over more than once.
+    """
+
+    def __init__(self, infile, delimiter=None, encoding='utf-8'):
+        self.infile = infile
+        self.delimiter = delimiter or ','
+        self.encoding = encoding
+
+    def __iter__(self):
+        if self.infile.seekable():
+            self.infile.seek(0)
+        lines = codecs.iterdecode(self.infile, self.encoding)
+        for record in csv.reader(lines, delimiter=self.delimiter):
+            if record:
+                yield [item if item != '' else None for item in record]
+
+
+def batches(iterable, size):
+    "Generator of lists of at most the given size from the iterable."
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def csv_chunks(rows, header=None, delimiter=None):
+    """Generator of CSV text for the rows, in chunks of a fixed number of rows.
+    Memory use is bounded by the chunk size, not by the number of rows.
+    """
+    chunk_rows = flask.current_app.config['STREAM_CHUNK_ROWS']
+    writer = CsvWriter(header=header, delimiter=delimiter)
+    count = 0
+    for row in rows:
+        writer.writer.writerow(row)
+        count += 1
+        if count >= chunk_rows:
+            yield writer.getvalue()
+            writer.outfile.seek(0)
+            writer.outfile.truncate()
+            count = 0
+    yield writer.getvalue()
+
+def json_chunks(result, columns, rows):
+    """Generator of JSON text for 'result' with the rows added as a list
+    of objects in the item 'data', in chunks of a fixed number of rows.
+    Memory use is bounded by the chunk size, not by the number of rows.
+    """
+    config = flask.current_app.config
+    encoder = json.JSONEncoder(ensure_ascii=config['JSON_AS_ASCII'])
+    with dbshare.metrics.timing('json'):
+        head = encoder.encode(result)
+    if len(head) > 2:           # Not an empty dictionary.
+        yield head[:-1] + ', "data": ['
+    else:
+        yield '{"data": ['
+    delimiter = ''
+    for batch in batches(rows, config['STREAM_CHUNK_ROWS']):
+        with dbshare.metrics.timing('json'):
+            chunk = ', '.join([encoder.encode(dict(zip(columns, row)))
+                               for row in batch])
+        yield delimiter + chunk
+        delimiter = ', '
+    yield ']}'
+
+def csv_response(rows, header=None, delimiter=None, filename=None):
+    """Return a streamed Response containing the rows as CSV.
+    Optionally set the header Content-Disposition for a file attachment.
+    """
+    response = flask.Response(
+        flask.stream_with_context(csv_chunks(rows, header, delimiter)),
+        mimetype=constants.CSV_MIMETYPE)
+    if filename:
+        response.headers.set('Content-Disposition', 'attachment',
+                             filename=filename)
+    return response
+
+def jsonify_rows(result, columns, rows, schema=None):
+    """Return a streamed Response containing the JSON of 'result',
+    with the rows as a list of objects in the item 'data'.
+    Optionally add a header Link to the schema given by its URL path.
+    """
+    response = flask.Response(
+        flask.stream_with_context(json_chunks(result, columns, rows)),
+        mimetype=constants.JSON_MIMETYPE)
+    if schema:
+        add_schema_link(response, schema)
+    return response
@@ -6,7 +6,9 @@ import sqlite3
 
 import flask
 
+import dbshare.cache
 import dbshare.db
+import dbshare.query
 import dbshare.table
 
 from . import constants
@@ -106,28 +108,26 @@ def edit(dbname, viewname):
 def rows(dbname, viewname):     # NOTE: viewname is a NameExt instance!
     "Display rows in the view."
     try:
-        db = dbshare.db.get_check_read(dbname, nrows=[str(viewname)])
+        db = dbshare.db.get_check_read(dbname)
     except (KeyError, ValueError) as error:
         utils.flash_error(error)
         return flask.redirect(flask.url_for('home'))
     has_write_access = dbshare.db.has_write_access(db)
-    try:
-        schema = db['views'][str(viewname)]
-    except KeyError:
+    if str(viewname) not in db['views']:
         utils.flash_error('no such view')
         return flask.redirect(flask.url_for('db.display', dbname=dbname))
+    representation = utils.get_representation(viewname)
+    response = dbshare.cache.not_modified(db, representation)
+    if response: return response
+    dbshare.db.set_nrows(db, [str(viewname)])
+    schema = db['views'][str(viewname)]
     try:
         title = schema.get('title') or "View {}".format(viewname)
-        dbcnx = dbshare.db.get_cnx(dbname)
         columns = [c['name'] for c in schema['columns']]
         quoted_columns = [f'"{c}"' for c in columns]
         sql = 'SELECT %s FROM "%s"' % (','.join(quoted_columns), viewname)
 
-        if viewname.ext == 'json' or utils.accept_json():
-            try:
-                cursor = utils.execute_timeout(dbcnx, sql)
-            except SystemError:
-                flask.abort(http.client.REQUEST_TIMEOUT)
+        if representation == 'json':
             result = {
                 'name': str(viewname),
                 'title': title,
@@ -135,45 +135,80 @@ def rows(dbname, viewname):     # NOTE: viewname is a NameExt instance!
                            'href': utils.url_for('api_view.view',
                                                  dbname=db['name'],
                                                  viewname=schema['name'])},
-                'nrows': schema['nrows'],
-                'data': [dict(zip(columns, row)) for row in cursor]
+                'nrows': schema['nrows']
             }
-            return utils.jsonify(utils.get_json(**result), schema='/rows')
+            try:
+                limit, position = utils.get_page_args()
+                if limit is None:
+                    cursor = dbshare.cache.fetch(db, sql, stream=True)[1]
+                else:
+                    cursor, position = get_rows_page(db, schema,
+                                                     limit, position)
+                    if position:
+                        result['cursor'] = utils.encode_cursor(position)
+                        url = utils.url_for('.rows',
+                                            dbname=db['name'],
+                                            viewname=f"{viewname}.json",
+                                            limit=limit,
+                                            cursor=result['cursor'])
+                        result['next'] = {'href': url}
+            except ValueError as error:
+                utils.abort_json(http.client.BAD_REQUEST, error)
+            except SystemError:
+                flask.abort(http.client.REQUEST_TIMEOUT)
+            response = utils.jsonify_rows(utils.get_json(**result), columns,
+                                          cursor, schema='/rows')
+            return dbshare.cache.set_headers(response, db, representation)
 
-        elif viewname.ext == 'csv':
-            writer = utils.CsvWriter(header=columns)
+        elif representation == 'csv':
             try:
-                cursor = utils.execute_timeout(dbcnx, sql)
+                cursor = dbshare.cache.fetch(db, sql, stream=True)[1]
             except SystemError:
                 flask.abort(http.client.REQUEST_TIMEOUT)
-            writer.write_rows(cursor)
-            return flask.Response(writer.getvalue(),
-                                  mimetype=constants.CSV_MIMETYPE)
+            response = utils.csv_response(cursor, header=columns)
+            return dbshare.cache.set_headers(response, db, representation)
 
-        elif viewname.ext in (None, 'html'):
+        elif representation == 'html':
             limit = flask.current_app.config['MAX_NROWS_DISPLAY']
+            next_url = None
             if schema['nrows'] is None:
                 utils.flash_error('too many rows to fetch; interrupted')
                 cursor = []     # Fake cursor
-            elif schema['nrows'] > limit:
-                utils.flash_message_limit(limit)
-                sql += f" LIMIT {limit}"
-                cursor = utils.execute_timeout(dbcnx, sql) # Maybe LIMIT
             else:
-                cursor = utils.execute_timeout(dbcnx, sql)
+                try:
+                    limit, position = utils.get_page_args(limit)
+                    cursor, position = get_rows_page(db, schema,
+                                                     limit, position)
+                except ValueError as error:
+                    utils.flash_error(error)
+                    return flask.redirect(
+                        flask.url_for('.rows',
+                                      dbname=dbname,
+                                      viewname=str(viewname)))
+                if position:
+                    utils.flash_message_limit(limit)
+                    next_url = flask.url_for(
+                        '.rows',
+                        dbname=dbname,
+                        viewname=str(viewname),
+                        limit=limit,
+                        cursor=utils.encode_cursor(position))
             query = schema['query']
             sql = dbshare.query.get_sql_statement(query) # No imposed LIMIT
             charts = [c for c in db['charts'].values()
                       if c['source'] == str(viewname)]
-            return flask.render_template('view/rows.html', 
-                                         db=db,
-                                         schema=schema,
-                                         query=query,
-                                         sql=sql,
-                                         title=title,
-                                         rows=cursor,
-                                         charts=charts,
-                                         has_write_access=has_write_access)
+            response = flask.make_response(
+                flask.render_template('view/rows.html', 
+                                      db=db,
+                                      schema=schema,
+                                      query=query,
+                                      sql=sql,
+                                      title=title,
+                                      rows=cursor,
+                                      next_url=next_url,
+                                      charts=charts,
+                                      has_write_access=has_write_access))
+            return dbshare.cache.set_headers(response, db, representation)
 
         else:
             flask.abort(http.client.NOT_ACCEPTABLE)
@@ -183,6 +218,97 @@ def rows(dbname, viewname):     # NOTE: viewname is a NameExt instance!
         return flask.redirect(
             flask.url_for('.schema', viewname=str(viewname)))
 
+def get_rows_page(db, schema, limit, position):
+    """Return a page of at most 'limit' rows from the view, and the position
+    of the next page, or None if there are no more rows.
+    The rows are taken from the result cache if the database is read-only.
+    If the view has a key column, then this is keyset pagination on it:
+    the page starts after the key value given by the position.
+    Otherwise the position is an offset, and the rows are ordered by all
+    columns of the view, so that the pages are consistent.
+    Raises ValueError if the position is invalid.
+    Raises SystemError if interrupted by timeout.
+    """
+    colnames = ','.join(['"%(name)s"' % c for c in schema['columns']])
+    sql = f'''SELECT {colnames} FROM "{schema['name']}"'''
+    key = get_key(db, schema)
+    if key:
+        params = []
+        if 'key' in position:
+            if not isinstance(position['key'], (int, float, str)):
+                raise ValueError('invalid cursor')
+            sql += f' WHERE "{key}">?'
+            params.append(position['key'])
+        sql += f' ORDER BY "{key}" LIMIT ?'
+        params.append(limit + 1)
+    else:
+        offset = position.get('offset', 0)
+        if not isinstance(offset, int) or offset < 0:
+            raise ValueError('invalid cursor')
+        sql += f" ORDER BY {colnames} LIMIT ? OFFSET ?"
+        params = [limit + 1, offset]
+    rows = list(dbshare.cache.fetch(db, sql, params)[1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    if key:
+        index = [c['name'] for c in schema['columns']].index(key)
+        return rows, {'key': rows[-1][index]}
+    else:
+        return rows, {'offset': offset + limit}
+
+def get_key(db, schema):
+    """Return the name of the key column of the view, or None if it has none.
+    The key is the single-column primary key of the only source table of
+    the view, when it is selected as such, without alias. The FROM part
+    must have exactly one item; a self-join repeats the key values.
+    """
+    query = schema['query']
+    for token in utils.lexer(query['from']):
+        if token['value'] == ',' or \
+           (token['type'] == 'RESERVED' and
+            token['value'] in dbshare.query.JOIN_WORDS):
+            return None
+    aliases, constraints = dbshare.query.get_from_aliases(query['from'])
+    sources = set(aliases.values())
+    if len(sources) != 1 or len(aliases) > 2 or constraints: return None
+    try:
+        table = db['tables'][sources.pop()]
+    except KeyError:
+        return None
+    primarykey = [c['name'] for c in table['columns'] if c.get('primarykey')]
+    if len(primarykey) != 1: return None
+    primarykey = primarykey[0].lower()
+    # The terms of the SELECT part, each as the list of its tokens.
+    terms = [[]]
+    depth = 0
+    for token in utils.lexer(query['select']):
+        if token['type'] == 'WHITESPACE': continue
+        if token['value'] == '(':
+            depth += 1
+        elif token['value'] == ')':
+            depth -= 1
+        elif token['value'] == ',' and depth == 0:
+            terms.append([])
+            continue
+        terms[-1].append(token)
+    for term in terms:
+        values = [t['value'] for t in term]
+        if values[:1] == ['DISTINCT']:
+            values = values[1:]
+            term = term[1:]
+        if values == ['*'] or \
+           (len(term) in (1, 3) and term[-1]['type'] == 'IDENTIFIER' and
+            values[-1].lower() == primarykey and
+            (len(term) == 1 or values[1] == '.')):
+            break
+    else:
+        return None
+    for column in schema['columns']:
+        if column['name'].lower() == primarykey:
+            return column['name']
+    return None
+
 @blueprint.route('/<name:dbname>/<name:viewname>/schema')
 def schema(dbname, viewname):
     "Display the schema for a view."
@@ -281,26 +407,24 @@ def download_csv(dbname, viewname):
         utils.flash_error('no such view')
         return flask.redirect(flask.url_for('db.display', dbname=dbname))
     try:
-        delimiter = flask.request.form.get('delimiter') or 'comma'
+        delimiter = flask.request.values.get('delimiter') or 'comma'
         try:
             delimiter = flask.current_app.config['CSV_FILE_DELIMITERS'][delimiter]['char']
         except KeyError:
             raise ValueError('invalid delimiter')
+        columns = [c['name'] for c in schema['columns']]
         if utils.to_bool(flask.request.args.get('header')):
-            header = schema['query']['columns']
+            header = columns
         else:
             header = None
-        writer = utils.CsvWriter(header, delimiter=delimiter)
-        dbcnx = dbshare.db.get_cnx(dbname)
-        colnames = ['"%s"' % c for c in schema['query']['columns']]
+        colnames = ['"%s"' % c for c in columns]
         sql = 'SELECT %s FROM "%s"' % (','.join(colnames), viewname)
-        writer.write_rows(utils.execute_timeout(dbcnx, sql))
+        cursor = dbshare.cache.fetch(db, sql, stream=True)[1]
     except (ValueError, SystemError, sqlite3.Error) as error:
         utils.flash_error(error)
         return flask.redirect(
             flask.url_for('.download', dbname=dbname, viewname=viewname))
-    response = flask.make_response(writer.getvalue())
-    response.headers.set('Content-Type', constants.CSV_MIMETYPE)
-    response.headers.set('Content-Disposition', 'attachment', 
-                         filename="%s.csv" % viewname)
-    return response
+    return utils.csv_response(cursor,
+                              header=header,
+                              delimiter=delimiter,
+                              filename=f"{viewname}.csv")
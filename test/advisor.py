@@ -0,0 +1,56 @@
+"Test the index advisor API endpoint."
+
+import http.client
+
+import base
+
+
+class Advisor(base.Base):
+    "Test the index advisor API endpoint."
+
+    def setUp(self):
+        "Upload a file containing a plain Sqlite3 database."
+        super().setUp()
+        self.upload_file()
+        url = self.root['operations']['database']['query']['href']
+        self.url_query = url.format(dbname=base.SETTINGS['dbname'])
+
+    def get_advice(self):
+        "Return the advice for the database."
+        response = self.session.get(self.db_url)
+        result = self.check_schema(response)
+        response = self.session.get(result['advice']['href'])
+        self.assertEqual(response.status_code, http.client.OK)
+        return self.check_schema(response)
+
+    def test_advice(self):
+        "An index is recommended after the query has been performed often."
+        self.assertEqual(self.get_advice()['advice'], [])
+        query = {'select': 'i',
+                 'from': 't1',
+                 'where': "t = 'b'",
+                 'orderby': 'r'}
+        for count in range(3):
+            response = self.session.post(self.url_query, json=query)
+            self.check_schema(response)
+        result = self.get_advice()
+        self.assertFalse(result['autoindex'])
+        self.assertEqual(len(result['advice']), 1)
+        advice = result['advice'][0]
+        self.assertEqual(advice['table'], 't1')
+        self.assertEqual(advice['columns'], ['t', 'r'])
+        self.assertEqual(advice['count'], 3)
+
+    def test_covered(self):
+        "No index is recommended for the primary key."
+        query = {'select': 't',
+                 'from': 't1 AS a',
+                 'where': 'a.i >= 2'}
+        for count in range(3):
+            response = self.session.post(self.url_query, json=query)
+            self.check_schema(response)
+        self.assertEqual(self.get_advice()['advice'], [])
+
+
+if __name__ == '__main__':
+    base.run()
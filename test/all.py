@@ -3,10 +3,15 @@
 from root import Root
 from user import User
 from users import Users
+from analytics import Analytics
+from metrics import Metrics
+from slowqueries import Slowqueries
 from dbs import Dbs
 from db import Db
+from jobs import Jobs
 from table import Table
 from query import Query
+from advisor import Advisor
 from view import View
 from chart import Chart
 from crawl import Crawl
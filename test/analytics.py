@@ -0,0 +1,28 @@
+"Test the access analytics API endpoint."
+
+import http.client
+
+import base
+
+
+class Analytics(base.Base):
+    "Test the access analytics API endpoint."
+
+    def test_schema(self):
+        "Valid access analytics JSON."
+        response = self.session.get(self.root['analytics']['href'])
+        self.assertEqual(response.status_code, http.client.OK)
+        self.check_schema(response)
+
+    def test_hours(self):
+        "Valid access analytics JSON for hours; bad period."
+        url = self.root['analytics']['href']
+        response = self.session.get(url, params={'hours': 2})
+        result = self.check_schema(response)
+        self.assertEqual(result['period']['hours'], 2)
+        response = self.session.get(url, params={'days': 0})
+        self.assertEqual(response.status_code, http.client.BAD_REQUEST)
+
+
+if __name__ == '__main__':
+    base.run()
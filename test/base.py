@@ -8,6 +8,7 @@ import os
 import re
 import sqlite3
 import sys
+import time
 import unittest
 import urllib
 
@@ -106,6 +107,18 @@ class Base(unittest.TestCase):
                             schema=schema,
                             format_checker=jsonschema.draft7_format_checker)
 
+    def wait_job(self, response):
+        """Check that the response is 202 Accepted for a background job,
+        and poll the job until it is done. Return the job JSON.
+        """
+        self.assertEqual(response.status_code, http.client.ACCEPTED)
+        url = response.headers['Location']
+        for attempt in range(100):
+            result = self.check_schema(self.session.get(url))
+            if result['status'] not in ('queued', 'running'): break
+            time.sleep(0.1)
+        return result
+
     def create_database(self):
         "Create an empty database."
         dbops = self.root['operations']['database']
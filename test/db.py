@@ -1,7 +1,9 @@
 "Test the db API endpoint."
 
 import http.client
+import io
 import sqlite3
+import tarfile
 
 import base
 
@@ -33,6 +35,20 @@ class Db(base.Base):
         self.assertEqual(response.status_code, http.client.OK)
         self.check_schema(response)
 
+    def test_tar_export(self):
+        "Create a database by file upload, export it as a gzipped tar file."
+        self.upload_file()
+        url = f"{base.SETTINGS['base_url']}/db/{base.SETTINGS['dbname']}.tar.gz"
+        response = self.session.get(url)
+        self.assertEqual(response.status_code, http.client.OK)
+        tar = tarfile.open(fileobj=io.BytesIO(response.content))
+        dbname = base.SETTINGS['dbname']
+        self.assertEqual(sorted(tar.getnames()),
+                         [f"{dbname}/t1.csv", f"{dbname}/v1.csv"])
+        lines = tar.extractfile(f"{dbname}/t1.csv").read().splitlines()
+        self.assertEqual(lines[0], b'i,r,t')
+        self.assertEqual(len(lines), 4)
+
     def test_bad_upload(self):
         "Try uploading with the wrong content type."
         dbops = self.root['operations']['database']
@@ -108,6 +124,85 @@ class Db(base.Base):
         self.assertFalse(result['readonly'])
         self.assertFalse(result['hashes'])
 
+    def test_readonly_background(self):
+        "Set to read-only with the content hashes computed in the background."
+        response = self.create_database()
+        self.assertEqual(response.status_code, http.client.OK)
+        response = self.session.post(f"{self.db_url}/readonly",
+                                     params={'background': 'true'})
+        job = self.wait_job(response)
+        self.assertEqual(job['status'], 'finished')
+        url = f"{self.db_url}/hashes"
+        response = self.session.get(url)
+        result = self.check_schema(response)
+        self.assertEqual(result['status'], 'done')
+        self.assertEqual(result['hashes'], job['result']['hashes'])
+        self.assertTrue(result['hashes'])
+        response = self.session.get(self.db_url)
+        self.assertEqual(self.check_schema(response)['hashes'],
+                         result['hashes'])
+
+        # Re-verify the recorded hashes.
+        response = self.session.post(f"{url}/verify")
+        self.assertEqual(response.status_code, http.client.OK)
+        result = self.check_schema(response)
+        self.assertTrue(result['valid'])
+
+        # Set to read-write, to allow deletion.
+        response = self.session.post(f"{self.db_url}/readwrite")
+        self.assertEqual(response.status_code, http.client.OK)
+        response = self.session.get(url)
+        self.assertEqual(self.check_schema(response)['status'], 'none')
+
+    def test_lookup(self):
+        "Look up a read-only database by its content hashes."
+        response = self.create_database()
+        self.assertEqual(response.status_code, http.client.OK)
+        response = self.session.post(f"{self.db_url}/readonly")
+        result = self.check_schema(response)
+        hashes = [f"{name}:{value}" for name, value in result['hashes'].items()]
+        hashes.append('0123456789abcdef')
+
+        lookup = self.root['operations']['database']['lookup']
+        response = self.session.post(lookup['href'], json={'hashes': hashes})
+        result = self.check_schema(response)
+        self.assertEqual(len(result['hashes']), len(hashes))
+        for item in result['hashes'][:-1]:
+            self.assertEqual(item['database']['href'], self.db_url)
+        self.assertIsNone(result['hashes'][-1]['database'])
+
+        # Invalid hash name.
+        response = self.session.post(lookup['href'],
+                                     json={'hashes': ['nohash:0123']})
+        self.assertEqual(response.status_code, http.client.BAD_REQUEST)
+
+        # Set to read-write, to allow deletion.
+        response = self.session.post(f"{self.db_url}/readwrite")
+        self.assertEqual(response.status_code, http.client.OK)
+
+    def test_conditional(self):
+        "Get the database JSON conditionally; modify it and get it again."
+        response = self.create_database()
+        self.assertEqual(response.status_code, http.client.OK)
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+
+        # Not modified.
+        response = self.session.get(self.db_url,
+                                    headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, http.client.NOT_MODIFIED)
+        response = self.session.get(self.db_url,
+                                    headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, http.client.NOT_MODIFIED)
+
+        # Modified.
+        response = self.session.post(self.db_url, json={'title': 'New title'})
+        self.assertEqual(response.status_code, http.client.OK)
+        response = self.session.get(self.db_url,
+                                    headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, http.client.OK)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
 
 if __name__ == '__main__':
     base.run()
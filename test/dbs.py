@@ -26,6 +26,35 @@ class Dbs(base.Base):
             response = self.session.get(dbs_urls[key])
             self.check_schema(response)
 
+    def test_pages(self):
+        "Sorted pages of the list of all databases."
+        self.create_database()
+        url = self.root['databases']['all']['href']
+        response = self.session.get(url, params={'sort': 'size',
+                                                 'desc': 'true'})
+        result = self.check_schema(response)
+        names = [db['name'] for db in result['databases']]
+        self.assertEqual(result['count'], len(names))
+        sizes = [db['size'] for db in result['databases']]
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+
+        # Follow the links to the next pages.
+        paged = []
+        response = self.session.get(url, params={'sort': 'size',
+                                                 'desc': 'true',
+                                                 'limit': 1})
+        while True:
+            result = self.check_schema(response)
+            self.assertTrue(len(result['databases']) <= 1)
+            paged.extend([db['name'] for db in result['databases']])
+            if 'next' not in result: break
+            response = self.session.get(result['next']['href'])
+        self.assertEqual(paged, names)
+
+        # Invalid sort key.
+        response = self.session.get(url, params={'sort': 'nonsense'})
+        self.assertEqual(response.status_code, http.client.BAD_REQUEST)
+
 
 if __name__ == '__main__':
     base.run()
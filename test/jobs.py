@@ -0,0 +1,66 @@
+"Test the background jobs API endpoints."
+
+import http.client
+
+import base
+
+
+class Jobs(base.Base):
+    "Test the background jobs API endpoints."
+
+    def test_schema(self):
+        "Valid jobs list JSON; bad limit; no such job."
+        url = self.root['jobs']['href']
+        response = self.session.get(url)
+        self.check_schema(response)
+        response = self.session.get(url, params={'limit': 0})
+        self.assertEqual(response.status_code, http.client.BAD_REQUEST)
+        response = self.session.get(f"{url}/0123456789abcdef")
+        self.assertEqual(response.status_code, http.client.NOT_FOUND)
+
+    def test_vacuum(self):
+        "Run VACUUM by a job; get its result; it is in the list of jobs."
+        self.upload_file()
+        vacuum = self.root['operations']['database']['vacuum']
+        url = vacuum['href'].format(dbname=base.SETTINGS['dbname'])
+        job = self.wait_job(self.session.post(url))
+        self.assertEqual(job['status'], 'finished')
+        self.assertEqual(job['progress'], 1)
+        self.assertTrue(job['result']['size'] > 0)
+        self.assertEqual(job['database']['href'], self.db_url)
+
+        # The result of the job is the database.
+        response = self.session.get(job['result_link']['href'])
+        result = self.check_schema(response)
+        self.assertEqual(result['$id'], self.db_url)
+
+        # Cancelling a finished job has no effect.
+        response = self.session.post(f"{job['href']}/cancel")
+        result = self.check_schema(response)
+        self.assertEqual(result['status'], 'finished')
+
+        response = self.session.get(self.root['jobs']['href'])
+        result = self.check_schema(response)
+        self.assertTrue(job['iuid'] in [j['iuid'] for j in result['jobs']])
+
+    def test_upload(self):
+        "Create a database by file upload, loaded by a job."
+        self.upload_file()
+        response = self.session.delete(self.db_url)
+        self.assertEqual(response.status_code, http.client.NO_CONTENT)
+        dbops = self.root['operations']['database']
+        url = dbops['create']['href'].format(dbname=base.SETTINGS['dbname'])
+        headers = {'Content-Type': 'application/x-sqlite3'}
+        with open(base.SETTINGS['filename'], 'rb') as infile:
+            response = self.session.put(url, data=infile, headers=headers,
+                                        params={'background': 'true'})
+        job = self.wait_job(response)
+        self.assertEqual(job['status'], 'finished')
+        response = self.session.get(job['result_link']['href'])
+        result = self.check_schema(response)
+        self.assertEqual(result['$id'], self.db_url)
+        self.assertEqual([t['name'] for t in result['tables']], ['t1'])
+
+
+if __name__ == '__main__':
+    base.run()
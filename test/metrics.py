@@ -0,0 +1,38 @@
+"Test the metrics API endpoint."
+
+import http.client
+
+import base
+
+
+class Metrics(base.Base):
+    "Test the metrics API endpoint."
+
+    def test_text(self):
+        "Get the metrics in Prometheus text format."
+        response = self.session.get(self.root['metrics']['href'])
+        self.assertEqual(response.status_code, http.client.OK)
+        self.assertTrue(response.headers['Content-Type'].startswith(
+            'text/plain'))
+        self.assertIn('dbshare_request_duration_seconds_bucket',
+                      response.text)
+        self.assertIn('dbshare_metadata_cache_hits_total{instance=',
+                      response.text)
+
+    def test_counts_increase(self):
+        "The request counts summed over processes do not decrease."
+        counts = []
+        for i in range(2):
+            response = self.session.get(self.root['metrics']['href'])
+            self.assertEqual(response.status_code, http.client.OK)
+            total = 0
+            for line in response.text.split('\n'):
+                if line.startswith('dbshare_request_duration_seconds_count'):
+                    total += int(line.split()[-1])
+            counts.append(total)
+        self.assertGreater(counts[0], 0)
+        self.assertGreaterEqual(counts[1], counts[0])
+
+
+if __name__ == '__main__':
+    base.run()
@@ -72,6 +72,47 @@ class Query(base.Base):
         self.assertEqual(result['nrows'], 2)
         self.assertEqual(len(result['data'][0]), 1)
 
+    def test_table_query_pages(self):
+        "Get all rows in pages of 2 rows, using the continuation cursor."
+        query = {'select': 't',
+                 'from': 't1',
+                 'limit': 2}
+        response = self.session.post(self.url_query, json=query)
+        result = self.check_schema(response)
+        self.assertEqual(result['nrows'], 2)
+        self.assertTrue(result['cursor'])
+        self.assertEqual(result['next']['cursor'], result['cursor'])
+        rows = result['data']
+
+        # The second and last page.
+        response = self.session.post(self.url_query, json=result['next'])
+        result = self.check_schema(response)
+        self.assertEqual(result['nrows'], 1)
+        self.assertFalse('next' in result)
+        rows.extend(result['data'])
+
+        # Same rows as without pages.
+        query = {'select': 't',
+                 'from': 't1'}
+        response = self.session.post(self.url_query, json=query)
+        result = self.check_schema(response)
+        self.assertEqual(rows, result['data'])
+
+        # Bad cursor.
+        query = {'select': 't',
+                 'from': 't1',
+                 'limit': 2,
+                 'cursor': 'garbage'}
+        response = self.session.post(self.url_query, json=query)
+        self.assertEqual(response.status_code, http.client.BAD_REQUEST)
+
+    def test_table_query_timeout(self):
+        "A query running too long should yield HTTP Request Timeout."
+        query = {'select': 'COUNT(*)',
+                 'from': ', '.join(['t1'] * 24)}
+        response = self.session.post(self.url_query, json=query)
+        self.assertEqual(response.status_code, http.client.REQUEST_TIMEOUT)
+
 
 if __name__ == '__main__':
     base.run()
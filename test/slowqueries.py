@@ -0,0 +1,47 @@
+"Test the slow-query log API endpoint."
+
+import http.client
+
+import base
+
+
+class Slowqueries(base.Base):
+    "Test the slow-query log API endpoint."
+
+    def test_schema(self):
+        "Valid slow-query log JSON; bad limit."
+        url = self.root['slowqueries']['href']
+        response = self.session.get(url)
+        self.assertEqual(response.status_code, http.client.OK)
+        self.check_schema(response)
+        response = self.session.get(url, params={'limit': 0})
+        self.assertEqual(response.status_code, http.client.BAD_REQUEST)
+
+    def test_interrupted(self):
+        "A query interrupted by timeout is in the slow-query log."
+        self.upload_file()
+        url = self.root['operations']['database']['query']['href']
+        url = url.format(dbname=base.SETTINGS['dbname'])
+        # Recursive CTE without end; is interrupted.
+        query = {'select': 'x',
+                 'from': '(WITH RECURSIVE c(x) AS'
+                         ' (SELECT 1 UNION ALL SELECT x+1 FROM c)'
+                         ' SELECT x FROM c)',
+                 'where': 'x<0'}
+        response = self.session.post(url, json=query)
+        self.assertEqual(response.status_code, http.client.REQUEST_TIMEOUT)
+        response = self.session.get(self.root['slowqueries']['href'],
+                                    params={'dbname': base.SETTINGS['dbname']})
+        result = self.check_schema(response)
+        entries = [e for e in result['queries']
+                   if 'WITH RECURSIVE' in e['sql']]
+        self.assertEqual(len(entries), 1)
+        entry = entries[0]
+        self.assertTrue(entry['interrupted'])
+        self.assertTrue(entry['plan'])
+        # The scans of the CTE are not table scans.
+        self.assertEqual(entry['full_scans'], [])
+
+
+if __name__ == '__main__':
+    base.run()
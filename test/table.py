@@ -4,6 +4,7 @@ import copy
 import csv
 import io
 import http.client
+import json
 
 import base
 
@@ -62,6 +63,53 @@ class Table(base.Base):
                                     headers={'Accept': base.JSON_MIMETYPE})
         self.check_schema(response)
 
+    def test_rows_csv(self):
+        "Create a database by file upload, compare the JSON and CSV rows."
+        response = self.upload_file()
+        result = self.check_schema(response)
+        response = self.session.get(result['tables'][0]['href'])
+        result = self.check_schema(response)
+
+        # The rows as JSON.
+        response = self.session.get(result['rows']['href'])
+        rows = self.check_schema(response)['data']
+        self.assertEqual(len(rows), 3)
+
+        # The rows as CSV, with header record.
+        response = self.session.get(result['data']['href'])
+        self.assertEqual(response.status_code, http.client.OK)
+        self.assertTrue(response.headers['Content-Type'].startswith('text/csv'))
+        records = list(csv.reader(io.StringIO(response.text)))
+        self.assertEqual(records[0], list(rows[0].keys()))
+        self.assertEqual(len(records), len(rows) + 1)
+        for record, row in zip(records[1:], rows):
+            self.assertEqual(record, [str(v) for v in row.values()])
+
+    def test_rows_pages(self):
+        "Create a database by file upload, get the rows in pages."
+        response = self.upload_file()
+        result = self.check_schema(response)
+        response = self.session.get(result['tables'][0]['href'])
+        result = self.check_schema(response)
+        url = result['rows']['href']
+        response = self.session.get(url)
+        all_rows = self.check_schema(response)['data']
+
+        # Follow the 'next' links.
+        rows = []
+        response = self.session.get(url, params={'limit': 2})
+        while True:
+            result = self.check_schema(response)
+            self.assertTrue(len(result['data']) <= 2)
+            rows.extend(result['data'])
+            if 'next' not in result: break
+            response = self.session.get(result['next']['href'])
+        self.assertEqual(rows, all_rows)
+
+        # Bad page size.
+        response = self.session.get(url, params={'limit': 0})
+        self.assertEqual(response.status_code, http.client.BAD_REQUEST)
+
     def test_create(self):
         "Create a database and a table in it. Check the table definition."
 
@@ -185,6 +233,14 @@ class Table(base.Base):
         response = self.session.post(url, json=data)
         self.assertEqual(response.status_code, http.client.BAD_REQUEST)
 
+        # Replacing a row must not change the row count.
+        data = {'data': [{'i': 2, 't': 'replaced', 'r': 3}] }
+        response = self.session.post(url, json=data,
+                                     params={'on_conflict': 'replace'})
+        self.assertEqual(response.status_code, http.client.OK)
+        result = response.json()
+        self.assertEqual(result['nrows'], 5)
+
         # Get the table data.
         response = self.session.get(url_table)
         self.assertEqual(response.status_code, http.client.OK)
@@ -222,6 +278,7 @@ class Table(base.Base):
                          tablename=self.table_spec['name'])
         response = self.session.put(url, json=self.table_spec)
         result = self.check_schema(response)
+        url_table = response.url
         self.assertEqual(result['nrows'], 0)
 
         headers = {'Content-Type': 'text/csv'}
@@ -247,6 +304,76 @@ class Table(base.Base):
         response = self.session.post(url, data=data, headers=headers)
         self.assertEqual(response.status_code, http.client.BAD_REQUEST)
 
+        # A bad row after good ones; none of the rows must be inserted.
+        data = self.get_csvfile_data([(4, 'fourth', 1.0),
+                                      (5, 'fifth', 2.0),
+                                      ('bad', 'sixth', 3.0)])
+        response = self.session.post(url, data=data, headers=headers)
+        self.assertEqual(response.status_code, http.client.BAD_REQUEST)
+        response = self.session.get(url_table)
+        result = self.check_schema(response)
+        self.assertEqual(result['nrows'], 3)
+
+    def test_ndjson(self):
+        "Create database and table; insert NDJSON, with conflicts."
+
+        # Create an empty database.
+        response = self.create_database()
+        result = self.check_schema(response)
+
+        # Create a table in the database.
+        url = self.root['operations']['table']['create']['href']
+        url = url.format(dbname=base.SETTINGS['dbname'],
+                         tablename=self.table_spec['name'])
+        response = self.session.put(url, json=self.table_spec)
+        result = self.check_schema(response)
+        self.assertEqual(result['nrows'], 0)
+
+        headers = {'Content-Type': 'application/x-ndjson'}
+
+        # Insert NDJSON data; check the summary.
+        url = self.root['operations']['table']['insert']['href']
+        url = url.format(dbname=base.SETTINGS['dbname'],
+                         tablename=self.table_spec['name'])
+        data = '\n'.join([json.dumps({'i': 1, 't': 'test', 'r': 0.2}),
+                          json.dumps({'i': 2, 't': None, 'r': 4}),
+                          '',
+                          json.dumps({'i': 3, 'r': -13.0})])
+        response = self.session.post(url, data=data, headers=headers)
+        result = self.check_schema(response)
+        self.assertEqual(result['records'], 3)
+        self.assertEqual(result['nrows'], 3)
+        self.assertEqual(sum([b['records'] for b in result['batches']]), 3)
+
+        # Bad type in a line; none of the rows must be inserted.
+        data = '\n'.join([json.dumps({'i': 4, 't': 'ok', 'r': 1.0}),
+                          json.dumps({'i': 5, 't': 'bad', 'r': 'string!'})])
+        response = self.session.post(url, data=data, headers=headers)
+        self.assertEqual(response.status_code, http.client.BAD_REQUEST)
+
+        # Conflicting primary key.
+        data = json.dumps({'i': 1, 't': 'changed', 'r': 1.0})
+        response = self.session.post(url, data=data, headers=headers)
+        self.assertEqual(response.status_code, http.client.BAD_REQUEST)
+        response = self.session.post(url, data=data, headers=headers,
+                                     params={'on_conflict': 'ignore'})
+        result = self.check_schema(response)
+        self.assertEqual(result['nrows'], 3)
+        response = self.session.post(url, data=data, headers=headers,
+                                     params={'on_conflict': 'update'})
+        result = self.check_schema(response)
+        self.assertEqual(result['nrows'], 3)
+        response = self.session.post(url, data=data, headers=headers,
+                                     params={'on_conflict': 'bad'})
+        self.assertEqual(response.status_code, http.client.BAD_REQUEST)
+
+        # Check the updated row.
+        response = self.session.get(result['href'])
+        result = self.check_schema(response)
+        response = self.session.get(result['rows']['href'])
+        result = self.check_schema(response)
+        self.assertEqual(result['data'][0], {'i': 1, 't': 'changed', 'r': 1.0})
+
     def test_update(self):
         "Create database and table; insert and update using CSV."
 
@@ -301,6 +428,21 @@ class Table(base.Base):
         result = self.check_schema(response)
         self.assertEqual(rows, result['data'])
 
+        # Upsert; update one existing row and insert one new.
+        data = self.get_csvfile_data([(3, 'changed again', 2.0),
+                                      (4, 'inserted', 3.0)])
+        response = self.session.post(update_url,
+                                     params={'upsert': 'true'},
+                                     data=data,
+                                     headers=headers)
+        result = self.check_schema(response)
+        self.assertEqual(result['nrows'], 4)
+        response = self.session.get(result['rows']['href'])
+        result = self.check_schema(response)
+        rows = result['data']
+        self.assertEqual(rows[2]['t'], 'changed again')
+        self.assertEqual(rows[3], {'i': 4, 't': 'inserted', 'r': 3.0})
+
     def test_index(self):
         "Create database and table; create index and test it."
 
@@ -358,6 +500,23 @@ class Table(base.Base):
         # Check the statistics
         response = self.session.get(statistics_url)
         result = self.check_schema(response)
+        self.assertEqual(result['statistics_mode'], 'exact')
+        stats = dict([(c['name'], c['statistics']) for c in result['columns']])
+        self.assertEqual(stats['i']['min']['value'], 1)
+        self.assertEqual(stats['i']['max']['value'], 3)
+        self.assertEqual(stats['i']['median']['value'], 2)
+        self.assertAlmostEqual(stats['i']['stdev']['value'], 1.0)
+
+        # Other modes of computation
+        response = self.session.get(statistics_url, 
+                                    params={'mode': 'approximate'})
+        result = self.check_schema(response)
+        self.assertEqual(result['statistics_mode'], 'approximate')
+        response = self.session.get(statistics_url, params={'mode': 'sample'})
+        result = self.check_schema(response)
+        self.assertEqual(result['statistics_mode'], 'sample')
+        response = self.session.get(statistics_url, params={'mode': 'bad'})
+        self.assertEqual(response.status_code, http.client.BAD_REQUEST)
 
 
 if __name__ == '__main__':
@@ -18,6 +18,20 @@ class User(base.Base):
         response = self.session.get(self.root['user']['href'])
         self.check_schema(response)
 
+    def test_usage(self):
+        "The total size of the user's databases follows their sizes."
+        response = self.session.get(self.root['user']['href'])
+        before = self.check_schema(response)['total_size']
+        response = self.create_database()
+        size = response.json()['size']
+        response = self.session.get(self.root['user']['href'])
+        self.assertEqual(self.check_schema(response)['total_size'],
+                         before + size)
+        response = self.session.delete(self.db_url)
+        self.assertEqual(response.status_code, http.client.NO_CONTENT)
+        response = self.session.get(self.root['user']['href'])
+        self.assertEqual(self.check_schema(response)['total_size'], before)
+
 
 if __name__ == '__main__':
     base.run()
@@ -68,6 +68,73 @@ class View(base.Base):
         response = self.session.delete(url)
         self.assertEqual(response.status_code, http.client.NO_CONTENT)
 
+    def test_self_join_pages(self):
+        "Page through a view with a self-join; no rows are lost."
+        response = self.upload_file()
+        result = self.check_schema(response)
+        view_spec = {
+            'name': 'v3',
+            'query': {'from': 't1 a, t1 b',
+                      'select': 'a.i, b.t'}
+        }
+        url = self.root['operations']['view']['create']['href']
+        url = url.format(dbname=base.SETTINGS['dbname'],
+                         viewname=view_spec['name'])
+        response = self.session.put(url, json=view_spec)
+        result = self.check_schema(response)
+        url = result['rows']['href']
+        params = {'limit': 2}
+        rows = []
+        while url:
+            response = self.session.get(url, params=params)
+            result = self.check_schema(response)
+            rows.extend(result['data'])
+            url = result.get('next', {}).get('href')
+            params = None
+        self.assertEqual(len(rows), 9)      # 3 rows in t1, squared.
+
+    def test_readonly_cache(self):
+        "Get the rows of a view in a read-only database; check the ETag."
+        response = self.upload_file()
+        result = self.check_schema(response)
+        url = result['views'][0]['href']
+        response = self.session.post(f"{self.db_url}/readonly")
+        self.assertEqual(response.status_code, http.client.OK)
+        response = self.session.get(url)
+        result = self.check_schema(response)
+        url = result['rows']['href']
+        response = self.session.get(url)
+        result = self.check_schema(response)
+        self.assertEqual(result['nrows'], 2)
+        etag = response.headers['ETag']
+        self.assertNotIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('Accept', response.headers['Vary'])
+
+        # Immutable if the URL contains the content hash.
+        response = self.session.get(self.db_url)
+        hashes = self.check_schema(response)['hashes']
+        response = self.session.get(url, params={'hash': hashes['md5']})
+        self.check_schema(response)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+
+        # Same result from the cache.
+        response = self.session.get(url)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.json()['data'], result['data'])
+
+        # Not modified.
+        response = self.session.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, http.client.NOT_MODIFIED)
+
+        # Set to read-write; not immutable.
+        response = self.session.post(f"{self.db_url}/readwrite")
+        self.assertEqual(response.status_code, http.client.OK)
+        response = self.session.get(url, headers={'If-None-Match': etag},
+                                    params={'hash': hashes['md5']})
+        self.assertEqual(response.status_code, http.client.OK)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertNotIn('immutable', response.headers['Cache-Control'])
+
 
 if __name__ == '__main__':
     base.run()